@@ -3,27 +3,30 @@ import numpy as np
 import netCDF4 as nc
 from scipy.ndimage import uniform_filter1d
 from clim_functions.smoothing import smooth
+from io_functions.instrument import instrumented
 
+def get_QBO_transitions(u_smoothed):
+    """ Returns boolean array, same size as u_smoothed (time on axis 0), which is True at each
+    zero wind transition from westward to eastward (i.e. u goes from <= 0 to >= 0) """
+    new_QBO_cycle = np.zeros(u_smoothed.shape, dtype=bool)
+    new_QBO_cycle[1:] = (u_smoothed[1:] >= 0) & (u_smoothed[:-1] <= 0)
+    return new_QBO_cycle
+
+
+@instrumented
 def get_QBO_TT(u_zonal, return_variance=False, return_amplitude=False, return_cov=False):
     """ Function that returns QBO period using Transition Time (TT) method 
     Inputs: u_zonal (np array) zonal mean zonal wind at given height level, recommended 10hPa (MiMA index 13) 
     Outputs: period (flt) mean period in months 
              amplitude (flt)  absolute max. u within each QBO cycle"""
-    # Smooth with five-month centered running mean
-    u_smoothed = smooth(u_zonal)
+    # Smooth with five-month centered running mean (np.asarray reads netCDF or dask input)
+    u_smoothed = smooth(np.asarray(u_zonal))
 
     # Identify zero wind transitions from westward to eastward (i.e. -ve to +ve)
     # Note, we start in the +ve phase, so calculate no of QBOs from then
-    new_QBO_cycle = []
-    t = range(len(u_zonal))
-    # Go through time series and save each transition
-    for it in t[1:]:
-        if (u_smoothed[it] >=0 and u_smoothed[it-1] <= 0):
-            new_QBO_cycle.append(it)
-                   
+    new_QBO_cycle = np.flatnonzero(get_QBO_transitions(u_smoothed))
 
     print("QBO transition times:", new_QBO_cycle)
-    new_QBO_cycle = np.array(new_QBO_cycle)
     periods = new_QBO_cycle[1:] - new_QBO_cycle[:-1]
     periods_mon = periods/30.
     
@@ -31,12 +34,12 @@ def get_QBO_TT(u_zonal, return_variance=False, return_amplitude=False, return_co
     mean_period = np.mean(periods_mon)
     
     if return_amplitude:
-        amplitudes = np.zeros(len(periods))
-        for ic in range(len(periods)):
-            start_ind = new_QBO_cycle[ic]
-            end_ind = new_QBO_cycle[ic+1]
-            amplitudes[ic] = 0.5 * (np.max(u_smoothed[start_ind:end_ind] ) - 
-                                    np.min(u_smoothed[start_ind:end_ind] ) )
+        # Max and min within each cycle, segments run from one transition to the next
+        if len(new_QBO_cycle) > 0:
+            amplitudes = 0.5 * (np.maximum.reduceat(u_smoothed, new_QBO_cycle)[:-1] - 
+                                np.minimum.reduceat(u_smoothed, new_QBO_cycle)[:-1])
+        else:
+            amplitudes = np.zeros(0)
 
         # Calculate mean amplitude
         mean_amplitude = np.mean(amplitudes)
@@ -58,4 +61,45 @@ def get_QBO_TT(u_zonal, return_variance=False, return_amplitude=False, return_co
     else:
         return mean_period
 
-    
+
+@instrumented
+def get_QBO_TT_profile(u_zonal):
+    """ Transition Time (TT) method applied to every column at once, e.g. all pressure levels
+    (and latitudes) of a QBO profile without looping over levels.
+    Inputs: u_zonal (np array) zonal mean zonal wind, time on axis 0, e.g. (time, pfull) or 
+            (time, pfull, lat)
+    Outputs: period, amplitude, var_period, var_amplitude (np arrays of size u_zonal.shape[1:])
+             mean period (months), mean amplitude (half the range of u within each cycle) and 
+             their variances, matching get_QBO_TT for each column. NaN where there is no full cycle."""
+    u_smoothed = smooth(np.asarray(u_zonal))
+    n_time = u_smoothed.shape[0]
+    profile_shape = u_smoothed.shape[1:]
+
+    # One row per column so that flat indices run along time within a column
+    u_cols = np.ascontiguousarray(u_smoothed.reshape(n_time, -1).T)
+    n_cols = u_cols.shape[0]
+    transitions = np.flatnonzero(get_QBO_transitions(u_cols.T).T)
+    col = transitions // n_time
+    # A cycle is the segment between consecutive transitions in the same column
+    same_col = col[1:] == col[:-1]
+    cycle_col = col[:-1][same_col]
+    periods_mon = (np.diff(transitions)[same_col]) / 30.
+    if len(transitions) > 0:
+        u_flat = u_cols.ravel()
+        amplitudes = 0.5 * (np.maximum.reduceat(u_flat, transitions)[:-1] - 
+                            np.minimum.reduceat(u_flat, transitions)[:-1])[same_col]
+    else:
+        amplitudes = np.zeros(0)
+
+    # Segmented mean and variance over the cycles of each column
+    n_cycles = np.bincount(cycle_col, minlength=n_cols)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_period = np.bincount(cycle_col, periods_mon, minlength=n_cols) / n_cycles
+        mean_amplitude = np.bincount(cycle_col, amplitudes, minlength=n_cols) / n_cycles
+        var_period = np.bincount(cycle_col, (periods_mon - mean_period[cycle_col])**2, 
+                                 minlength=n_cols) / n_cycles
+        var_amplitude = np.bincount(cycle_col, (amplitudes - mean_amplitude[cycle_col])**2, 
+                                    minlength=n_cols) / n_cycles
+
+    return (mean_period.reshape(profile_shape), mean_amplitude.reshape(profile_shape), 
+            var_period.reshape(profile_shape), var_amplitude.reshape(profile_shape))
@@ -4,20 +4,29 @@ import netCDF4 as nc
 
 from clim_functions.smoothing import lp_filter
 from clim_functions.deseasonalize import deseasonalize
+from io_functions.instrument import instrumented
+from clim_functions.chunked import is_chunked, compute
 
-def get_QBO_amplitude_DD(u_zonal):
+@instrumented
+def get_QBO_amplitude_DD(u_zonal, climatology=None):
     """ Returns vertical amplitude of QBO using Dunkerton&Delisi method (DD)
     Inputs: u_mean (np array) zonal mean zonal wind at 20hPa (MiMA index 16) or 77hPa (MiMA index 22)
+            or any array with time on axis 0, e.g. (time, pfull, lat)
+            climatology (optional) monthly climatology to deseasonalize with, see deseasonalize
+            u_zonal can be a dask array (clim_functions.chunked), the amplitude is still returned 
+            as a numpy array
     Outputs: amplitude (flt) vertical amplitude at given height level estimated as sqrt(2)*stdev after 
     data is deseasonalized and filtered with a low-pass 9th order Butterworth filter with 120 day cutoff 
     """
-    # Deseasonalize
+    # Deseasonalize (one copy in the dtype of u_zonal)
     t = np.arange(u_zonal.shape[0])
-    u_deseason = deseasonalize(u_zonal, t) 
+    u_deseason = deseasonalize(u_zonal, t, climatology=climatology) 
     # Remove high freq. variability with low-pass filter, 9th order, cutoff 120 days
-    u_filtered = lp_filter(u_deseason)
+    # (written back into u_deseason, so the only full size copy of u_zonal is the deseasonalized one)
+    in_place = not is_chunked(u_deseason) and u_deseason.flags.c_contiguous
+    u_filtered = lp_filter(u_deseason, out=u_deseason if in_place else None)
     # Calculate amplitude metrics
-    stdev = np.std(u_filtered, axis=0)
+    stdev = compute(np.std(u_filtered, axis=0))
     # Multiply by sqrt 2
     amplitude = np.sqrt(2) * stdev
     return amplitude
@@ -1,15 +1,22 @@
 # Function to return period of QBO using FFT method
 import numpy as np
 import netCDF4 as nc
-from scipy.fft import fft, fftfreq
+from scipy.fft import fft, fftfreq, rfft, next_fast_len
+from io_functions.instrument import instrumented
 
 
-def get_QBO_period_FFT(u_zonal):
+@instrumented
+def get_QBO_period_FFT(u_zonal, method='pad'):
     """ Function that returns the QBO period calculated using the FFT method.
     Inputs: u_mean (np array) zonal mean zonal wind, typical to use at 27hPa (MiMA index 17)
+            method 'pad' (default) zero pads to 3x the length before a complex fft, 'rfft' uses
+            get_QBO_period_rFFT which is cheaper and interpolates the peak between bins
     Outputs: period (flt) period (period of peak power in fourier transformed zonal mean zonal wind at 27hPa)
-             in years/months/days?
-    """ 
+             in months
+    """
+    u_zonal = np.asarray(u_zonal)
+    if method == 'rfft':
+        return get_QBO_period_rFFT(u_zonal)
     # Calculate period
     # Remove mean
     u_zonal_demean = u_zonal - np.mean(u_zonal, axis=0)
@@ -24,4 +31,40 @@ def get_QBO_period_FFT(u_zonal):
     peak_freq = freqs[max_ind]
     period = 1/peak_freq
 
-    return period 
+    return period
+
+
+def get_QBO_period_rFFT(u_zonal, block_size=1024):
+    """ Returns the QBO period (months) from the peak of the power spectrum, like
+    get_QBO_period_FFT, but using a real FFT at a fast transform length (no 3x zero padding) and
+    refining the peak between frequency bins by fitting a parabola to the log power of the peak
+    bin and its two neighbours. A Hann window is applied first, which makes the peak close to
+    parabolic in log power so the interpolated period is accurate to a small fraction of a bin.
+    Inputs: u_zonal (np array) zonal mean zonal wind with time on axis 0, e.g. (time,),
+            (time, pfull) or (time, pfull, lat) to get a full period map in one call.
+            block_size, number of columns (levels x latitudes) transformed at once, to bound memory.
+    Outputs: period (np array of size u_zonal.shape[1:], or flt for 1-D input) in months """
+    u_zonal = np.asarray(u_zonal)
+    n_time = u_zonal.shape[0]
+    u_cols = u_zonal.reshape(n_time, -1)
+    n_fft = next_fast_len(n_time, real=True)
+    df = 30. / n_fft     # frequency bin spacing in cycles per month
+    window = np.hanning(n_time).astype(u_cols.dtype if u_cols.dtype == np.float32 else np.float64)
+
+    period = np.empty(u_cols.shape[1])
+    for c0 in range(0, u_cols.shape[1], block_size):
+        u_block = u_cols[:, c0:c0+block_size]
+        u_block = (u_block - np.mean(u_block, axis=0)) * window[:, None]
+        power_spec = np.abs(rfft(u_block, n=n_fft, axis=0))**2
+        # Peak away from the zero frequency and the last bin, so both neighbours exist
+        max_ind = np.argmax(power_spec[1:-1], axis=0) + 1
+        cols = np.arange(power_spec.shape[1])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            below, peak, above = (np.log(power_spec[max_ind + i, cols]) for i in (-1, 0, 1))
+            offset = 0.5 * (below - above) / (below - 2*peak + above)
+        offset = np.where(np.isfinite(offset), np.clip(offset, -0.5, 0.5), 0.)
+        period[c0:c0+block_size] = 1 / ((max_ind + offset) * df)
+
+    if u_zonal.ndim == 1:
+        return period[0]
+    return period.reshape(u_zonal.shape[1:])
@@ -0,0 +1,111 @@
+"""Persistent SSW/SPV event catalogue of a run, saved to rundir/CACHE/ (next to the zonal mean
+cache) with the SSW and SPV events and the vortex formation and final warming dates of every
+winter, as returned by find_SSW_events. Winters are independent (July 1 to June 30), so when a
+run is extended only the winters from the last incomplete one onwards are recomputed. A checksum
+of u10at60 up to the start of that winter is saved with the catalogue; if the earlier data has
+changed, or the time axis no longer lines up, the whole history is recomputed instead. e.g.
+    ssws, spvs, winters = update_catalogue(rundir, u10at60, get_dates(dataset['time'])) """
+import os
+import json
+import hashlib
+
+import numpy as np
+
+from clim_functions.datetime360 import date_to_day, DPY
+from SSW_metrics.get_SSWs import find_SSW_events
+from io_functions.instrument import instrumented
+
+DOY1 = [7, 1]   # first day of each winter, as in split_by_doy
+
+
+def catalogue_path(rundir, filename='atmos_daily'):
+    return os.path.join(rundir, 'CACHE', '{}_ssw_catalogue.npz'.format(filename))
+
+
+def checksum(values):
+    """ Checksum of an array's values, used to check earlier data is unchanged """
+    return hashlib.sha1(np.ascontiguousarray(values, dtype=np.float64).tobytes()).hexdigest()
+
+
+def get_final_ind(day_inds):
+    """ Returns the time index where the last incomplete winter starts, or len(day_inds) if the
+    data ends on the last day of a winter. Winters before this index can no longer change. """
+    winter_day = np.mod(day_inds - date_to_day([0, DOY1[0], DOY1[1]]), DPY)
+    if winter_day[-1] == DPY - 1:
+        return len(day_inds)
+    starts = np.flatnonzero(winter_day == 0)
+    return int(starts[-1]) if len(starts) else 0
+
+
+def load_catalogue(rundir, filename='atmos_daily'):
+    """ Returns (ssws, spvs, winters, meta) of the saved catalogue, or None if there is none """
+    path = catalogue_path(rundir, filename)
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as data:
+        return data['ssws'], data['spvs'], data['winters'], json.loads(str(data['meta']))
+
+
+def save_catalogue(rundir, ssws, spvs, winters, meta, filename='atmos_daily'):
+    save_as = catalogue_path(rundir, filename)
+    os.makedirs(os.path.dirname(save_as), exist_ok=True)
+    with open(save_as + '.tmp', 'wb') as f:
+        np.savez(f, ssws=ssws, spvs=spvs, winters=winters, meta=json.dumps(meta))
+    os.replace(save_as + '.tmp', save_as)
+    print("SSW catalogue saved as ", save_as)
+
+
+def _merge_records(old, new, keys):
+    """ Concatenates saved and recomputed records in the order of find_SSW_events """
+    records = np.concatenate((old, new))
+    return records[np.lexsort([records[key] for key in reversed(keys)])]
+
+
+@instrumented
+def update_catalogue(rundir, u10at60, datelist, filename='atmos_daily', save=True):
+    """ Returns ssws, spvs, winters (see find_SSW_events) for the whole of u10at60, updating the
+    run's saved catalogue with only the winters touched by days added since it was saved.
+    Args: u10at60 np array of zonal mean winds at 10 hPa, 60 degN [n_days] (or a batch
+                  [n_days, ...]) over the whole run so far
+          datelist dates of u10at60, e.g. get_dates(dataset['time']) """
+    u10at60 = np.asanyarray(u10at60)
+    day_inds = date_to_day(datelist)
+    n_time = len(day_inds)
+    meta = {'start_day': int(day_inds[0]), 'n_time': n_time, 'shape': list(u10at60.shape[1:]),
+            'final_ind': get_final_ind(day_inds)}
+    meta['checksum'] = checksum(u10at60[:meta['final_ind']])
+    meta['checksum_all'] = checksum(u10at60)
+
+    restart = 0
+    saved = load_catalogue(rundir, filename)
+    if saved is not None:
+        old_ssws, old_spvs, old_winters, old_meta = saved
+        old_final = old_meta['final_ind']
+        if old_meta == meta:
+            print("SSW catalogue is up to date")
+            return old_ssws, old_spvs, old_winters
+        if (old_meta['start_day'] == meta['start_day'] and old_meta['shape'] == meta['shape'] and
+                old_meta['n_time'] <= n_time and
+                old_meta['checksum'] == checksum(u10at60[:old_final])):
+            restart = old_final
+        else:
+            print("Earlier data has changed, recomputing the SSW catalogue")
+
+    if restart > 0:
+        # Keep the saved winters that were complete, recompute the rest. If the new days do not
+        # complete a winter there is nothing to recompute, only meta changes.
+        first_year = date_to_day(datelist[restart]) // DPY if restart < n_time else np.inf
+        keep = lambda records: records[records['year'] < first_year]
+        ssws, spvs, winters = keep(old_ssws), keep(old_spvs), keep(old_winters)
+        if meta['final_ind'] > restart:
+            new_ssws, new_spvs, new_winters = find_SSW_events(u10at60[restart:], datelist[restart:])
+            ssws = _merge_records(ssws, new_ssws, ['series', 'year', 'day'])
+            spvs = _merge_records(spvs, new_spvs, ['series', 'year', 'day'])
+            winters = _merge_records(winters, new_winters, ['series', 'year'])
+        print("Updated SSW catalogue from day {} of {}".format(restart, n_time))
+    else:
+        ssws, spvs, winters = find_SSW_events(u10at60, datelist)
+
+    if save:
+        save_catalogue(rundir, ssws, spvs, winters, meta, filename)
+    return ssws, spvs, winters
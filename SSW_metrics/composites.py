@@ -0,0 +1,78 @@
+"""Lagged composites of fields around events, e.g. SSWs from get_SSWs. The windows of all events
+are merged into ordered, non-overlapping ranges of days, so every day is read once, in time order,
+however many events or lags it belongs to. Each range is read chunk_size days at a time and
+reduced to zonal means straight away. The composite mean and spread over events are accumulated
+with RunningStats (clim_functions.online_stats), one (lag, pfull, lat) sample per event. e.g.
+    ssws, spvs = get_SSWs(u10at60, get_dates(dataset['time']))
+    event_inds = get_event_inds(ssws, dataset['time'])
+    composites, lags = lagged_composites(dataset, ['ucomp', 'temp', 'gwfu_cgwd'], event_inds)
+    u_composite, u_spread = composites['ucomp'].mean, composites['ucomp'].std """
+import numpy as np
+
+from clim_functions.datetime360 import get_day_inds, DATENUM_OFFSET
+from clim_functions.online_stats import RunningStats
+from io_functions.stream_reduce import iter_time_chunks
+from io_functions.instrument import instrumented
+
+
+def get_event_inds(datenums, time):
+    """ Returns time indices into a netCDF time variable of event datenums, e.g. from get_SSWs """
+    day_inds = get_day_inds(time)
+    event_days = np.floor(np.asarray(datenums, dtype=np.float64)).astype(np.int64) - DATENUM_OFFSET
+    inds = np.searchsorted(day_inds, event_days)
+    found = (inds < len(day_inds)) & (day_inds[np.minimum(inds, len(day_inds) - 1)] == event_days)
+    if not found.all():
+        raise ValueError("{} events are not in the time axis".format((~found).sum()))
+    return inds
+
+
+def merge_windows(event_inds, lags, n_time):
+    """ Returns the events whose windows event_ind + lags[0] to event_ind + lags[1] (inclusive)
+    lie within the n_time days, in time order, and the merged (t0, t1) ranges of days covering
+    all their windows. Overlapping or touching windows are merged. """
+    event_inds = np.sort(np.asarray(event_inds, dtype=int))
+    starts = event_inds + lags[0]
+    ends = event_inds + lags[1] + 1
+    complete = (starts >= 0) & (ends <= n_time)
+    if not complete.all():
+        print("Dropped {} events with windows outside the {} days".format((~complete).sum(), n_time))
+    event_inds, starts, ends = event_inds[complete], starts[complete], ends[complete]
+    ranges = []
+    for start, end in zip(starts, ends):
+        if ranges and start <= ranges[-1][1]:
+            ranges[-1][1] = max(ranges[-1][1], end)
+        else:
+            ranges.append([start, end])
+    return event_inds, [tuple(r) for r in ranges]
+
+
+def _read_zonal_mean(variable, t0, t1, chunk_size):
+    """ Reads variable[t0:t1] in chunks, returns its zonal mean (t1-t0, ...) if it has a lon axis """
+    zonal_axis = -1 if len(variable.shape) == 4 else None
+    chunks = []
+    for c0, c1 in iter_time_chunks(t1, chunk_size, t_start=t0):
+        chunk = np.asarray(variable[c0:c1])
+        chunks.append(chunk.mean(axis=zonal_axis) if zonal_axis is not None else chunk)
+    return np.concatenate(chunks, axis=0)
+
+
+@instrumented
+def lagged_composites(dataset, varnames, event_inds, lags=(-30, 60), chunk_size=90):
+    """ Returns lagged composites of varnames around event time indices, from lags[0] to lags[1]
+    days after each event (inclusive), and the lags. dataset is anything indexed by variable
+    name, e.g. a netCDF Dataset (4-D variables are zonal averaged) or a dict of cached zonal
+    means (time, pfull, lat). Events whose window is not all in the data are dropped.
+    Returns composites, dict of RunningStats per variable with mean, std etc. of shape
+    (lag, pfull, lat) over events, and lags (n_lag,) """
+    lags = np.arange(lags[0], lags[1] + 1)
+    n_time = dataset[varnames[0]].shape[0]
+    event_inds, ranges = merge_windows(event_inds, (lags[0], lags[-1]), n_time)
+    composites = {varname: RunningStats() for varname in varnames}
+    for t0, t1 in ranges:
+        in_range = event_inds[(event_inds + lags[0] >= t0) & (event_inds + lags[-1] < t1)]
+        for varname in varnames:
+            fields = _read_zonal_mean(dataset[varname], t0, t1, chunk_size)
+            windows = np.stack([fields[ind + lags[0] - t0:ind + lags[-1] + 1 - t0] for ind in in_range])
+            composites[varname].update(windows)
+        print("Read days {} to {} for {} events".format(t0, t1, len(in_range)))
+    return composites, lags
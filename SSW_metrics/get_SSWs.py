@@ -1,46 +1,8 @@
 import numpy as np
 
 from clim_functions.datetime360 import *
-
-def split_by_doy( data, datelist, DOY1 = [7, 1] ):
-    """Rearranges data to be split by DOY1, which should be selected in summer (e.g. default July 1)
-    to ensure winter months are consecutive for SSW counting
-    Original code written by Michael Goss (bydntobydoy), adapted by Laura Mansfield 07/12/2021 for use
-    with 360 day years (removed leap year needs, etc.) and translated into python 25/01/2022.
-    Args: data: data array size [NY*360, ...] 
-          datelist: vector of dates in datetime format (e.g. [[2000, 1, 1], [2000, 1, 2] , ... ])
-          DOY1: Date of splitting the years, default [7, 1]
-    Out:
-        outdata: New data array that will be of size [NY+1, 360, ...] where NY is number of years in original data (padded with NaNs)
-        yearlist: Years"""
-    DPY = 360
-    sz = data.shape
-    ND = data.ndim     ## Note this only works for ND = 1
-    
-    # Convert datenumbers into datetimes using 360 day calendar
-    yy = datelist[:, 0].copy()
-
-    # Get days since DOY1 (so first half of year is -ve, second half is +ve, allowing us to split easily)
-    doy1s = np.stack((yy, DOY1[0]*np.ones(len(yy)), DOY1[1]*np.ones(len(yy))), axis=-1)  
-    days_since_doy = datenum360(datelist) - datenum360(doy1s)
-
-    yy[days_since_doy < 1] = yy[days_since_doy < 1] - 1   # Move -ve values into previous 'year' (e.g. winter 2019 includes Jan/Feb of 2020)
-    days_since_doy[days_since_doy < 1] = days_since_doy[days_since_doy < 1] + DPY 
-
-    yearlist = np.arange(min(yy), max(yy)+1)
-    NY = len(yearlist)
-    padnanb = int(days_since_doy[0] )               # Pad with nans at begining
-    padnane = int(DPY - days_since_doy[-1] - 1)     # Pad with nans at end
-    
-    # Add NaNs from DOY1 until Dec of year 1 and from Jan until DOY1 of last year
-    padnanb_matrix = np.nan * np.ones((padnanb)) 
-    padnane_matrix = np.nan * np.ones((padnane))
-    outdata = np.concatenate((padnanb_matrix, data, padnane_matrix))
-    
-    # Reshape data to separate the years out
-    outdata = np.reshape(outdata, (NY, DPY))  
-    
-    return(outdata, yearlist)
+from SSW_metrics.split_by_doy import split_by_doy
+from io_functions.instrument import instrumented
 
 
 def get_consec_counts(vec):
@@ -68,82 +30,165 @@ def get_consec_counts(vec):
     
     return (counts, start_inds)
 
+## Constants
+USSWTHRESH = 0         # Threshold of u for sudden stratospheric warming
+USPVTHRESH = 48        # Threshold of u for strong polar vortex
+MINCONSECS = 20        # Min. number of consecutive days 
+INITWESTERLIES = 10    # Number of consecutive days to say the season for SSWs has started (polar vortex formed)
+FINALEASTERLIES = 10   # Number of consecutive days to say the season for SSWs has finished (final warming occurred)
+
+# Structured arrays returned by find_SSW_events. series is the flat index over the trailing 
+# (non-time) dimensions of u10at60, year is the winter from yearlist, day is days since DOY1.
+event_dtype = np.dtype([('series', int), ('year', int), ('day', int), ('datenum', float)])
+winter_dtype = np.dtype([('series', int), ('year', int), 
+                         ('pv_init_day', int), ('pv_init_datenum', float),
+                         ('final_warming_day', int), ('final_warming_datenum', float),
+                         ('n_ssw', int), ('n_spv', int)])
+
+
+def get_runs(condition):
+    """ Run length encoding of a boolean array along its last axis (e.g. days of each winter).
+    Args: condition = boolean np array of size [N, ND]
+    Returns: starts  = np array [N, max_runs] of index where each run of True starts, -1 if no run
+             lengths = np array [N, max_runs] of the number of consecutive True in each run, 0 if no run
+             n_runs  = np array [N] of number of runs in each row """
+    condition = np.asarray(condition, dtype=bool)
+    n_rows, n_days = condition.shape
+    is_start = condition.copy()
+    is_start[:, 1:] &= ~condition[:, :-1]
+    is_end = condition.copy()
+    is_end[:, :-1] &= ~condition[:, 1:]
+
+    n_runs = is_start.sum(axis=1)
+    max_runs = max(n_runs.max(initial=0), 1)
+    # Ordinal of each run within its row
+    run_number = np.cumsum(is_start, axis=1) - 1
+    rows, start_days = np.nonzero(is_start)
+    _, end_days = np.nonzero(is_end)
+    starts = np.full((n_rows, max_runs), -1)
+    lengths = np.zeros((n_rows, max_runs), dtype=int)
+    starts[rows, run_number[rows, start_days]] = start_days
+    lengths[rows, run_number[rows, start_days]] = end_days - start_days + 1
+    return starts, lengths, n_runs
+
+
+def _take_runs(values, n_runs, cols):
+    """ Returns values[:, cols] and a mask of which of these exist (cols < n_runs), with -1 where 
+    the run does not exist """
+    exists = cols[None, :] < n_runs[:, None]
+    taken = np.full((values.shape[0], len(cols)), -1)
+    in_range = cols < values.shape[1]
+    taken[:, in_range] = values[:, cols[in_range]]
+    taken[~exists] = -1
+    return taken, exists
+
+
+@instrumented
+def find_SSW_events(u10at60, datelist):
+    """ Finds SSWs, strong polar vortex (SPV) events, polar vortex formation and final warming 
+    dates for every winter at once, using run length encoding of the winds split by day of year.
+    Gives the same events as the original year by year loop in get_SSWs, but winters where no 
+    vortex formation or final warming is found are recorded with day -1 instead of raising.
+    Only complete winters (no NaN padding from split_by_doy) are used.
+    Args: u10at60 np array of mean zonal winds at 10 hPa, 60 degN, size [n_days] or a batch 
+                  [n_days, ...] e.g. stacked from many runs, or zonal mean u (time, pfull, lat)
+                  to get events at every level and latitude, time on axis 0
+          datelist list of dates, e.g. get_dates(dataset['time']) or createyear360(n_years, 2000)
+    Returns: ssws, spvs structured arrays of event_dtype, one record per event 
+             winters    structured array of winter_dtype, one record per series and winter """
+    u10at60 = np.asanyarray(u10at60)
+    n_series = int(np.prod(u10at60.shape[1:]))
+
+    # Separate years so that winter runs consecutive, keeping only complete (unpadded) years
+    doy_data, yearlist = split_by_doy(u10at60, datelist)
+    datenum = datenum360(datelist)
+    doy_dates, _ = split_by_doy(datenum, datelist)
+    complete = ~np.isnan(doy_dates).any(axis=1)
+    doy_dates = doy_dates[complete]
+    years = yearlist[complete]
+    n_years = len(years)
+    if n_years == 0:
+        return np.zeros(0, dtype=event_dtype), np.zeros(0, dtype=event_dtype), np.zeros(0, dtype=winter_dtype)
+    # One row per (series, winter)
+    doy_data = doy_data[complete].reshape(n_years, doy_data.shape[1], n_series)
+    cdata = np.moveaxis(doy_data, -1, 0).reshape(n_series * n_years, -1)
+    row_series = np.repeat(np.arange(n_series), n_years)
+    row_year = np.tile(np.arange(n_years), n_series)
+    rows = np.arange(len(cdata))
+
+    #### Zonal mean wind speed conditions, NaN padding satisfies neither
+    sub_ssw_start, _, n_sub_ssw = get_runs(cdata < USSWTHRESH)
+    sup_ssw_start, sup_ssw_consecs, n_sup_ssw = get_runs(cdata >= USSWTHRESH)
+
+    #### Initial and final dates of the SSW season
+    # First date where us are westerly for at least INITWESTERLIES days
+    init_runs = sup_ssw_consecs >= INITWESTERLIES
+    has_init = init_runs.any(axis=1)
+    pv_init_i = np.where(has_init, sup_ssw_start[rows, np.argmax(init_runs, axis=1)], -1)
+    # Final warming date is the start of the easterlies that follow the last run of westerlies 
+    # lasting at least FINALEASTERLIES days
+    final_runs = sup_ssw_consecs >= FINALEASTERLIES
+    final_sup_ssw = final_runs.shape[1] - 1 - np.argmax(final_runs[:, ::-1], axis=1)
+    has_final = final_runs.any(axis=1) & (final_sup_ssw + 1 < n_sub_ssw)
+    final_warming_i = np.where(has_final, 
+                               sub_ssw_start[rows, np.minimum(final_sup_ssw + 1, sub_ssw_start.shape[1] - 1)], -1)
+    has_season = has_init & has_final
+
+    #### SSW conditions, for each return to westerlies pci after the first
+    pci = np.arange(1, sup_ssw_start.shape[1])
+    start_n, exists_n = _take_runs(sub_ssw_start, n_sub_ssw, pci)      # Date of start of negative winds, (cni in MG code)
+    start_p, exists_p = _take_runs(sup_ssw_start, n_sup_ssw, pci)      # Date of return to positive, (cpi in MG code)
+    prev_p = sup_ssw_start[:, :-1]                                    # Date of previous positive ind, (ppi in MG code)
+    pv_init_c = pv_init_i[:, None]
+    final_warming_c = final_warming_i[:, None]
+    is_ssw = (has_season[:, None] & exists_n & exists_p & 
+              (start_n > pv_init_c) & (start_n < final_warming_c) & 
+              (start_n - prev_p >= MINCONSECS) & (final_warming_c - start_p >= MINCONSECS))
+    ssw_rows, ssw_cols = np.nonzero(is_ssw)
+    ssw_days = start_n[ssw_rows, ssw_cols]
+
+    #### Strong Polar Vortex conditions, for each run of winds below the SPV threshold but the last
+    sub_spv_start, _, n_sub_spv = get_runs(cdata <= USPVTHRESH)
+    sup_spv_start, _, n_sup_spv = get_runs(cdata > USPVTHRESH)
+    pci = np.arange(sub_spv_start.shape[1])
+    start_n, exists_n = _take_runs(sub_spv_start, n_sub_spv - 1, pci)  # Date of start of negative SPV ind (cni in MG code)
+    start_p, exists_p = _take_runs(sup_spv_start, n_sup_spv, pci)      # Date of start of positive SPV ind (cpi in MG code)
+    is_spv = (has_init[:, None] & exists_n & exists_p & 
+              (start_p >= pv_init_c) & (start_p - start_n >= MINCONSECS))
+    spv_rows, spv_cols = np.nonzero(is_spv)
+    spv_days = start_p[spv_rows, spv_cols]
+
+    def events(event_rows, event_days):
+        out = np.zeros(len(event_rows), dtype=event_dtype)
+        out['series'] = row_series[event_rows]
+        out['year'] = years[row_year[event_rows]]
+        out['day'] = event_days
+        out['datenum'] = doy_dates[row_year[event_rows], event_days]
+        return out
+
+    def dates_of(days):
+        return np.where(days >= 0, doy_dates[row_year, np.maximum(days, 0)], np.nan)
+
+    winters = np.zeros(len(cdata), dtype=winter_dtype)
+    winters['series'] = row_series
+    winters['year'] = years[row_year]
+    winters['pv_init_day'] = pv_init_i
+    winters['pv_init_datenum'] = dates_of(pv_init_i)
+    winters['final_warming_day'] = final_warming_i
+    winters['final_warming_datenum'] = dates_of(final_warming_i)
+    winters['n_ssw'] = np.bincount(ssw_rows, minlength=len(cdata))
+    winters['n_spv'] = np.bincount(spv_rows, minlength=len(cdata))
+
+    return events(ssw_rows, ssw_days), events(spv_rows, spv_days), winters
+
+
+@instrumented
 def get_SSWs(u10at60, datelist):
     """ Get SSWs 
     Args: u10at60 np array of mean zonal winds at 10 hPa, 60 degN
-          datelist list of dates, e.g. createyear360(len(u10at60), 2000)
+          datelist list of dates, e.g. get_dates(dataset['time']) or createyear360(n_years, 2000)
+    Returns lists of datenums of SSWs and of strong polar vortex events. See find_SSW_events
+    for all winters and runs at once, and for vortex formation and final warming dates.
      """
-        
-    ## Constants
-    USSWTHRESH = 0         # Threshold of u for sudden stratospheric warming
-    USPVTHRESH = 48        # Threshold of u for strong polar vortex
-    MINCONSECS = 20        # Min. number of consecutive days 
-    INITWESTERLIES = 10    # Number of consecutive days to say the season for SSWs has started (polar vortex formed)
-    FINALEASTERLIES = 10   # Number of consecutive days to say the season for SSWs has finished (final warming occurred)
-    
-    # Separate year so that winter runs consecutive
-    doy_data, yearlist = split_by_doy(u10at60, datelist)
-    datenum = datenum360(datelist)
-    doy_dates, _ = split_by_doy(datenum, datelist)
-    
-    # Get SSWs
-    pv_init_dates = []
-    final_warming_dates = []
-    ssw_dates = []
-    spv_dates = []
-    pvactive_dates = []
-    ssw_count = 0
-    for yi in np.arange(1,len(yearlist)-1):
-        cyr = yearlist[yi]
-        print(yi, " YEAR: ", cyr)
-        cdata = doy_data[yi, :]
-        cdates = doy_dates[yi, :]
-
-        ### Check for zonal mean wind speed conditions
-        # Get inds where data is sub and sup u SSW threshold (u=0)
-        sub_ssw_inds = np.argwhere(cdata < USSWTHRESH)  
-        sup_ssw_inds = np.argwhere(cdata >= USSWTHRESH)
-        # Get starting inds and counts no. of consecutive days
-        sub_ssw_consecs, sub_ssw_start = get_consec_counts(sub_ssw_inds)    
-        sup_ssw_consecs, sup_ssw_start = get_consec_counts(sup_ssw_inds)
-
-        #### Get initial and final dates of the SSW season
-        # Find first date where us are westerly for at least INITWESTERLIES days
-        first_sup_ssw = np.argwhere(sup_ssw_consecs >= INITWESTERLIES).reshape(-1)[0]
-        pv_init_i = sup_ssw_inds[sup_ssw_start[first_sup_ssw]].squeeze()
-        # Find final warming date where us are easterly for at least FINALEASTERLIES days
-        final_sup_ssw = np.argwhere(sup_ssw_consecs >= FINALEASTERLIES).reshape(-1)[-1]
-        final_warming_i = sub_ssw_inds[sub_ssw_start[final_sup_ssw+1]].squeeze()
-        # All SSW events must occur between pv_init_i and final_warming_i
-        print("PV init on day ", pv_init_i, ". Final warming on day ", final_warming_i)
-
-        #### Count number of times SSW conditions are met
-        for pci in range(1, len(sup_ssw_consecs)):
-            start_n = sub_ssw_inds[sub_ssw_start[pci]].squeeze()     # Date of start of negative winds, (cni in MG code)
-            start_p = sup_ssw_inds[sup_ssw_start[pci]].squeeze()     # Date of return to positive, (cpi in MG code)
-            prev_p = sup_ssw_inds[sup_ssw_start[pci-1]].squeeze()    # Date of previous positive ind, (ppi in MG code)
-            if start_n>pv_init_i and start_n<final_warming_i and start_n-prev_p>=MINCONSECS and final_warming_i-start_p >= MINCONSECS:
-                print("!!! SSW !!! on day", start_n, ". Days after previous +ve wind: " , start_n-prev_p, ". Days until final warming:", final_warming_i-prev_p)
-                ssw_count += 1
-                datenum_ssw = cdates[start_n]
-                ssw_dates.append(datenum_ssw)
-
-        #### Check for Strong Polar Vortex conditions
-        # Get inds where data is sub and sup SPV threshold (u=48m/s)
-        sub_spv_inds = np.argwhere(cdata <= USPVTHRESH)  
-        sup_spv_inds = np.argwhere(cdata > USPVTHRESH)
-        # Get starting inds and counts no. of consecutive days
-        sub_spv_consecs, sub_spv_start = get_consec_counts(sub_spv_inds)    
-        sup_spv_consecs, sup_spv_start = get_consec_counts(sup_spv_inds)
-        
-        #### Count number of times SPV conditions are met
-        if (len(sub_spv_consecs)>=1):
-            for pci in range(len(sub_spv_consecs)-1):
-                start_p = sup_spv_inds[sup_spv_start[pci]].squeeze()     # Date of start of positive SPV ind (cpi in MG code)
-                start_n = sub_spv_inds[sub_spv_start[pci]].squeeze()     # Date of start of negative SPV ind (cni in MG code)
-                if ( start_p >= pv_init_i ) and ( start_p - start_n >= MINCONSECS ):
-                    print(""" SPV SATISFIED""")
-                    datenum_spv = cdates[start_p]
-                    spv_dates.append(datenum_spv)
-          
-    return ssw_dates, spv_dates
+    ssws, spvs, _ = find_SSW_events(u10at60, datelist)
+    return list(ssws['datenum']), list(spvs['datenum'])
@@ -1,6 +1,6 @@
 import numpy as np
 
-from clim_functions.datetime360 import *
+from clim_functions.datetime360 import date_to_day
 
 
 def split_by_doy( data, datelist, DOY1 = [7, 1] ):
@@ -8,37 +8,39 @@ def split_by_doy( data, datelist, DOY1 = [7, 1] ):
     to ensure winter months are consecutive for SSW counting
     Original code written by Michael Goss (bydntobydoy), adapted by Laura Mansfield 07/12/2021 for use
     with 360 day years (removed leap year needs, etc.) and translated into python 25/01/2022.
-    Args: data: data array size [NY*360, ...] 
-          datelist: vector of dates in datetime format (e.g. [[2000, 1, 1], [2000, 1, 2] , ... ])
+    Args: data: data array size [NT, ...] of consecutive days, time on axis 0, e.g. (time, pfull, lat)
+          datelist: vector of dates in datetime format (e.g. [[2000, 1, 1], [2000, 1, 2] , ... ]),
+                    e.g. get_dates(dataset['time']) or createyear360(n_years, 2000)
           DOY1: Date of splitting the years, default [7, 1]
     Out:
-        outdata: New data array that will be of size [NY+1, 360, ...] where NY is number of years in original data (padded with NaNs)
-        yearlist: Years"""
+        outdata: New data array that will be of size [NY, 360, ...] where NY is number of years
+                 (winters) touched by the data, padded with NaNs before the first and after the last
+                 day. If no padding is needed (data starts on DOY1 and ends the day before) this is
+                 a view of data, otherwise data is copied once into a preallocated buffer.
+        yearlist: Years, where year y runs from DOY1 of y to the day before DOY1 of y+1"""
     DPY = 360
-    sz = data.shape
-    ND = data.ndim     ## Note this only works for ND = 1
-    
-    # Convert datenumbers into datetimes using 360 day calendar
-    yy = datelist[:, 0].copy()
+    data = np.asanyarray(data)
+    datelist = np.asarray(datelist)
+    NT = data.shape[0]
 
-    # Get days since DOY1 (so first half of year is -ve, second half is +ve, allowing us to split easily)
-    doy1s = np.stack((yy, DOY1[0]*np.ones(len(yy)), DOY1[1]*np.ones(len(yy))), axis=-1)  
-    days_since_doy = datenum360(datelist) - datenum360(doy1s)
+    # Get days since DOY1, days before DOY1 go into the previous 'year' (e.g. winter 2019 includes
+    # Jan/Feb of 2020)
+    days_since = date_to_day(datelist) - date_to_day([0, DOY1[0], DOY1[1]])
+    yy, days_since_doy = np.divmod(days_since, DPY)
 
-    yy[days_since_doy < 1] = yy[days_since_doy < 1] - 1   # Move -ve values into previous 'year' (e.g. winter 2019 includes Jan/Feb of 2020)
-    days_since_doy[days_since_doy < 1] = days_since_doy[days_since_doy < 1] + DPY 
-
-    yearlist = np.arange(min(yy), max(yy)+1)
-    NY = len(yearlist)
-    padnanb = int(days_since_doy[0] )               # Pad with nans at begining
+    padnanb = int(days_since_doy[0])               # Pad with nans at begining
     padnane = int(DPY - days_since_doy[-1] - 1)     # Pad with nans at end
-    
-    # Add NaNs from DOY1 until Dec of year 1 and from Jan until DOY1 of last year
-    padnanb_matrix = np.nan * np.ones((padnanb)) 
-    padnane_matrix = np.nan * np.ones((padnane))
-    outdata = np.concatenate((padnanb_matrix, data, padnane_matrix))
-    
+    NY = (padnanb + NT + padnane) // DPY
+    yearlist = np.arange(yy[0], yy[0] + NY)
+
     # Reshape data to separate the years out
-    outdata = np.reshape(outdata, (NY, DPY))  
-    
+    if padnanb == 0 and padnane == 0:
+        outdata = data.reshape((NY, DPY) + data.shape[1:])
+    else:
+        # Add NaNs from DOY1 until start of data in year 1 and from end of data until DOY1 of last year
+        dtype = data.dtype if np.issubdtype(data.dtype, np.floating) else np.float64
+        outdata = np.full((NY * DPY,) + data.shape[1:], np.nan, dtype=dtype)
+        outdata[padnanb:padnanb + NT] = data
+        outdata = outdata.reshape((NY, DPY) + data.shape[1:])
+
     return(outdata, yearlist)
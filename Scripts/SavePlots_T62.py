@@ -4,15 +4,16 @@
 
 import os
 import glob
-import netCDF4 as nc
 import numpy as np
 import matplotlib.pyplot as plt
 import cartopy.crs as ccrs
 
 from plot_functions.plot_ubar import plot_ubar_seasonal , plot_ubar_annual, plot_ubar_daily
 from plot_functions.make_gif import make_gif
-
-from clim_functions.mean_lat_weighted import mean_lat_weighted
+from io_functions.multifile import open_run
+from io_functions.stream_reduce import stream_reduce
+from io_functions.shard_reduce import load_sharded_products
+from io_functions.instrument import report_at_exit
 from plot_functions.plot_map import plot_map
 
 
@@ -24,7 +25,7 @@ print(rundir)
 
 print(glob.glob(rundir+'*.nc'))
 filename = 'atmos_daily'
-dataset = nc.Dataset(rundir+filename+'.nc', 'r')
+dataset = open_run(rundir, filename)
 
 lon = dataset['lon']
 lat = dataset['lat']
@@ -37,11 +38,21 @@ if not os.path.exists(rundir+'PLOTS/'):
     os.makedirs(rundir+'PLOTS/')
     print('New dir created: '+rundir+'PLOTS/')
 
+# Per-stage timing and memory report, written to rundir if MIMA_INSTRUMENT=1 is set
+report_at_exit(rundir)
+
+# Read ucomp and GW drag once, accumulating all the products plotted below.
+# If the reduction was split over a Slurm array (io_functions.shard_reduce), use its merged results.
+print("Reducing...")
+products = load_sharded_products(rundir)
+if products is None:
+    products = stream_reduce(dataset)
+
 # Plot zonal means
 print("Plotting...")
-plot_ubar_annual(lat, pfull, ucomp, rundir)
+plot_ubar_annual(lat, pfull, ucomp, rundir, ubar=products['ubar_annual'])
 print("Annual plot done")
-plot_ubar_seasonal(lat, pfull, ucomp, rundir)
+plot_ubar_seasonal(lat, pfull, ucomp, rundir, ubar_seasonal=products['ubar_seasonal'])
 print("Seasonal plot done")
 #plot_ubar_daily(lat, pfull, ucomp, rundir, dday=15)
 #print("Daily plots done")
@@ -50,7 +61,7 @@ print("Seasonal plot done")
 
 # Plot QBO
 # Plot contours of zonal mean wind speeds in 4degS-4degN region (inds 30-34)
-u_zonal = mean_lat_weighted( ucomp[:, :, 30:34, :].mean(axis=(-1)), lat[30:34], axis=(-1) )
+u_zonal = products['u_equator']
 t = (time[:]-time[0])/360.
 
 nrows = 1
@@ -77,8 +88,7 @@ plt.savefig(rundir+'PLOTS/QBO_zonalmean_vs_time.png')
 # Extract zonal mean u at 10hPa, 60N (59.99702 - 62.787354)
 model_level = 13
 lat_level = 53
-u10at60 = mean_lat_weighted(ucomp[:, model_level, 53:55, :].mean(axis=(-1)), 
-                                    lat[53:55], axis=(-1) )    # Zonal mean
+u10at60 = products['u10at60']    # Zonal mean
 
 fig = plt.figure(figsize=(10, 6))
 plt.plot(t, np.zeros(len(u10at60)), 'k--')
@@ -90,13 +100,10 @@ plt.savefig(rundir+'PLOTS/SSW_ubar_10hPa_60N.png')
 
 
 # Plot parameterized GW drag
-gwfu_cgwd = dataset['gwfu_cgwd']
-gwfv_cgwd = dataset['gwfv_cgwd']
-
-model_level = 23
+model_level = products['gwd_level']    # 100hPa
 model_height = pfull[model_level]
-gwd_u = gwfu_cgwd[:, model_level, :, :].mean(axis=0)
-gwd_v = gwfv_cgwd[:, model_level, :, :].mean(axis=0)
+gwd_u = products['gwd_u_map']
+gwd_v = products['gwd_v_map']
 
 
 nrows = 1
@@ -122,7 +129,7 @@ plt.savefig(rundir+'PLOTS/cgwd_lonlat_{:.2g}hPa.png'.format(model_height))
 
 # Plot QBO drag
 # Plot contours of zonal mean zonal drag in 4degS-4degN region (inds 30-34)
-gwdu_zonal = mean_lat_weighted( gwfu_cgwd[:, :, 30:34, :].mean(axis=(-1)), lat[30:34], axis=(-1) )
+gwdu_zonal = products['gwdu_equator']
 levels = np.linspace(-5e-5, 5e-5, 100)
 nrows = 1
 ncols = 1
@@ -142,7 +149,7 @@ plt.savefig(rundir+'PLOTS/QBO_cgwd.png')
 
 # Plot SSW drag
 # Plot contours of zonal mean wind speeds in 60N region (inds 53:55)
-gwdu_zonal = mean_lat_weighted( gwfu_cgwd[:, :, 53:55, :].mean(axis=(-1)), lat[53:55], axis=(-1) )
+gwdu_zonal = products['gwdu_60N']
 levels = np.linspace(-1e-5, 1e-5, 100)
 
 nrows = 1
@@ -10,6 +10,7 @@ import matplotlib.pyplot as plt
 
 from plot_functions.plot_ubar import plot_ubar_seasonal , plot_ubar_annual, plot_ubar_daily
 from plot_functions.make_gif import make_gif
+from io_functions.multifile import open_run
 
 # Select run to plot
 run = '038'
@@ -19,7 +20,7 @@ print(rundir)
 
 print(glob.glob(rundir+'*.nc'))
 filename = 'atmos_daily'
-dataset = nc.Dataset(rundir+filename+'.nc', 'r')
+dataset = open_run(rundir, filename)
 
 lon = dataset['lon']
 lat = dataset['lat']
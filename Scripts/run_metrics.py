@@ -0,0 +1,147 @@
+### Script to compute the full metric set for many MiMA runs in parallel
+### Run as main from parent directory, e.g.
+### python -m Scripts.run_metrics $SCRATCH/MiMA/runs/0* --output metrics.csv --workers 8
+### Runs whose atmos_daily.nc is unchanged since the last call are read back from the table.
+
+import os
+import csv
+import glob
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from io_functions.zonal_cache import get_zonal_mean, source_key
+from io_functions.multifile import get_run_files, open_run
+from clim_functions.mean_lat_weighted import mean_lat_weighted
+from clim_functions.datetime360 import get_dates
+from QBO_metrics.get_QBO_TT_metrics import get_QBO_TT
+from QBO_metrics.get_QBO_period_FFT import get_QBO_period_FFT
+from QBO_metrics.get_QBO_amplitude_DD import get_QBO_amplitude_DD
+from SSW_metrics.catalogue import update_catalogue
+from jet_metrics.jet_latitude import jet_latitude, jet_latitude_means
+from clim_functions.MiMA_height_indices import get_level_index, get_lat_slice
+
+
+filename = 'atmos_daily'
+key_headers = ['run', 'rundir', 'source_size', 'source_mtime_ns']
+metric_headers = ['QBO_period_TT', 'QBO_period_TT_var', 'QBO_period_FFT',
+                  'QBO_amplitude_DD_20hPa', 'QBO_amplitude_DD_77hPa',
+                  'SSW_per_year', 'SPV_per_year', 'n_winters',
+                  'jet_lat_NH', 'jet_lat_NH_var', 'jet_lat_SH', 'jet_lat_SH_var']
+headers = key_headers + metric_headers
+
+
+def run_key(rundir):
+    """ Returns the table columns identifying a run and the state of its atmos_daily file(s) """
+    key = source_key(get_run_files(rundir, filename), 'ucomp')
+    return {'run': os.path.basename(os.path.normpath(rundir)), 'rundir': rundir,
+            'source_size': str(key['size']), 'source_mtime_ns': str(key['mtime_ns'])}
+
+
+def compute_run_metrics(rundir):
+    """ Computes QBO, SSW and jet metrics for one run from its cached zonal mean ucomp """
+    row = run_key(rundir)
+    with open_run(rundir, filename) as dataset:
+        lat = dataset['lat'][:]
+        pfull = dataset['pfull'][:]
+        dates = get_dates(dataset['time'])
+    ubar = get_zonal_mean(rundir, 'ucomp', filename)
+    eq = get_lat_slice(lat, 'equator')
+    lat60N = get_lat_slice(lat, '60N')
+    level = {key: get_level_index(pfull, key) for key in ['10hPa', '20hPa', '27hPa', '77hPa']}
+
+    # QBO metrics from 4degS-4degN zonal mean winds
+    u_zonal = mean_lat_weighted(ubar[:, :, eq], lat[eq], axis=-1)
+    period_TT, period_TT_var = get_QBO_TT(u_zonal[:, level['10hPa']], return_variance=True)
+    period_FFT = get_QBO_period_FFT(u_zonal[:, level['27hPa']])
+    amplitude_DD = get_QBO_amplitude_DD(u_zonal[:, [level['20hPa'], level['77hPa']]])
+
+    # SSW and SPV frequency from zonal mean u at 10hPa, 60N
+    u10at60 = mean_lat_weighted(ubar[:, level['10hPa'], lat60N], lat[lat60N], axis=-1)
+    ssws, spvs, winters = update_catalogue(rundir, u10at60, dates, filename)
+    n_winters = len(winters)
+
+    # Jet latitude in each hemisphere
+    jet_lat, jet_lat_SH = jet_latitude(ubar, lat, return_SH_jet=True, pfull=pfull)
+    jet_lat_mean, jet_lat_var = jet_latitude_means(jet_lat, return_variance=True)
+    jet_lat_SH_mean, jet_lat_SH_var = jet_latitude_means(jet_lat_SH, return_variance=True)
+
+    row.update({'QBO_period_TT': period_TT, 'QBO_period_TT_var': period_TT_var,
+                'QBO_period_FFT': period_FFT,
+                'QBO_amplitude_DD_20hPa': amplitude_DD[0], 'QBO_amplitude_DD_77hPa': amplitude_DD[1],
+                'SSW_per_year': len(ssws) / n_winters if n_winters else np.nan,
+                'SPV_per_year': len(spvs) / n_winters if n_winters else np.nan,
+                'n_winters': n_winters,
+                'jet_lat_NH': jet_lat_mean, 'jet_lat_NH_var': jet_lat_var,
+                'jet_lat_SH': jet_lat_SH_mean, 'jet_lat_SH_var': jet_lat_SH_var})
+    return row
+
+
+def read_table(output):
+    """ Returns existing table rows keyed by rundir """
+    if not os.path.exists(output):
+        return {}
+    with open(output, newline='') as f:
+        return {row['rundir']: row for row in csv.DictReader(f)}
+
+
+def write_table(output, rows):
+    with open(output + '.tmp', 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=headers)
+        writer.writeheader()
+        for row in sorted(rows, key=lambda row: row['run']):
+            writer.writerow({header: row[header] for header in headers})
+    os.replace(output + '.tmp', output)
+
+
+def expand_rundirs(patterns):
+    """ Expands glob patterns to a sorted list of run directories containing atmos_daily files """
+    rundirs = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        rundirs += [os.path.join(os.path.normpath(rundir), '') for rundir in matches
+                    if get_run_files(rundir, filename)]
+    return sorted(set(rundirs))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compute QBO, SSW and jet metrics for MiMA runs')
+    parser.add_argument('rundirs', nargs='+', help='run directories or glob patterns')
+    parser.add_argument('--output', default='metrics.csv', help='consolidated table (csv)')
+    parser.add_argument('--workers', type=int, default=None, help='number of processes, default all cores')
+    args = parser.parse_args()
+
+    rundirs = expand_rundirs(args.rundirs)
+    existing = read_table(args.output)
+    rows, todo = [], []
+    for rundir in rundirs:
+        key = run_key(rundir)
+        old_row = existing.get(rundir)
+        if old_row is not None and all(old_row[k] == key[k] for k in key_headers):
+            rows.append(old_row)
+        else:
+            todo.append(rundir)
+    print("{} runs, {} unchanged, {} to compute".format(len(rundirs), len(rows), len(todo)))
+
+    start = time.time()
+    with ProcessPoolExecutor(args.workers) as pool:
+        futures = {pool.submit(compute_run_metrics, rundir): rundir for rundir in todo}
+        for i, future in enumerate(as_completed(futures)):
+            rundir = futures[future]
+            try:
+                rows.append(future.result())
+                status = 'done'
+            except Exception as e:
+                status = 'FAILED ({})'.format(e)
+            print("[{}/{}] {} {} ({:.0f}s elapsed)".format(i + 1, len(todo), rundir, status,
+                                                          time.time() - start))
+            # Rewrite the table as we go so finished runs are kept if the job is killed
+            write_table(args.output, rows)
+    write_table(args.output, rows)
+    print("Metrics saved as ", args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,246 @@
+### Benchmarks of the metric functions and plotting pipeline on synthetic MiMA output
+### Run as main from parent directory, e.g.
+### python -m benchmarks.run_benchmarks --resolution T42 --years 10 50 100
+### python -m benchmarks.run_benchmarks --compare              (last two commits benchmarked)
+### Results are saved per commit as benchmarks/results/<commit>.json. Synthetic files are kept in
+### --workdir and reused. Full T42 files are ~5 GB per variable per 10 years, use --n-lon to
+### make smaller ones or --suite metrics to skip the file based cases.
+
+import os
+import json
+import time
+import functools
+import socket
+import argparse
+import platform
+import tracemalloc
+import subprocess
+
+import numpy as np
+import netCDF4 as nc
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import cartopy.crs as ccrs
+
+from benchmarks.synthetic_data import synthetic_ubar, make_synthetic_run, get_lat, get_pfull, grids
+from clim_functions.datetime360 import createyear360
+from clim_functions.deseasonalize import deseasonalize
+from clim_functions.mean_lat_weighted import mean_lat_weighted
+from clim_functions.MiMA_height_indices import get_level_index, get_lat_slice
+from QBO_metrics.get_QBO_TT_metrics import get_QBO_TT, get_QBO_TT_profile
+from QBO_metrics.get_QBO_period_FFT import get_QBO_period_FFT
+from QBO_metrics.get_QBO_amplitude_DD import get_QBO_amplitude_DD
+from SSW_metrics.get_SSWs import get_SSWs, find_SSW_events
+from jet_metrics.jet_latitude import jet_latitude
+from io_functions.stream_reduce import stream_reduce
+from io_functions.zonal_cache import get_zonal_mean, cache_paths
+from plot_functions.plot_ubar import plot_ubar_annual, plot_ubar_seasonal, ubar_daily_frames
+from plot_functions.plot_ubar import plot_ubar_daily_parallel
+from plot_functions.make_gif import make_gif_from_frames
+from plot_functions.plot_map import plot_map
+
+
+results_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'results')
+
+
+def measure(func, repeat=1, setup=None):
+    """ Returns best wall time (s) of repeat calls of func and the peak memory (MB) traced by
+    tracemalloc during one more call. numpy allocations are traced, memory used in child
+    processes or by netCDF/HDF5 internally is not. setup is called first, untimed. """
+    if setup is not None:
+        setup()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(times), peak / 1e6
+
+
+def metric_cases(n_years, resolution, seed=0):
+    """ Returns dict of benchmark name: function for the metric functions, run on in memory
+    synthetic zonal means """
+    n_lat, _ = grids[resolution]
+    lat = get_lat(n_lat)
+    pfull = get_pfull()
+    ubar = synthetic_ubar(n_years, lat, pfull, seed=seed)
+    eq, lat60N = get_lat_slice(lat, 'equator'), get_lat_slice(lat, '60N')
+    level = {key: get_level_index(pfull, key) for key in ['10hPa', '20hPa', '27hPa', '77hPa']}
+    u_zonal = mean_lat_weighted(ubar[:, :, eq], lat[eq], axis=-1)
+    u10at60 = mean_lat_weighted(ubar[:, level['10hPa'], lat60N], lat[lat60N], axis=-1)
+    datelist = createyear360(n_years, 2000)
+    time_days = np.arange(ubar.shape[0])
+    return {'get_SSWs': lambda: get_SSWs(u10at60, datelist),
+            'find_SSW_events_profile': lambda: find_SSW_events(ubar[:, :, lat60N], datelist),
+            'get_QBO_TT': lambda: get_QBO_TT(u_zonal[:, level['10hPa']], return_variance=True),
+            'get_QBO_TT_profile': lambda: get_QBO_TT_profile(u_zonal),
+            'get_QBO_period_FFT': lambda: get_QBO_period_FFT(u_zonal[:, level['27hPa']]),
+            'get_QBO_period_rFFT_profile': lambda: get_QBO_period_FFT(u_zonal, method='rfft'),
+            'get_QBO_amplitude_DD': lambda: get_QBO_amplitude_DD(u_zonal[:, [level['20hPa'], level['77hPa']]]),
+            'deseasonalize': lambda: deseasonalize(ubar, time_days),
+            'jet_latitude': lambda: jet_latitude(ubar, lat, return_SH_jet=True, pfull=pfull)}
+
+
+def plot_cases(dataset, rundir, n_workers=None):
+    """ Returns dict of benchmark name: function for the file based pipeline of the SavePlots
+    scripts (reduction, zonal mean cache, plots) on the open rundir/atmos_daily.nc, and dict of
+    benchmark name: setup function for the cases that need the reduced products or zonal means.
+    These are only made when a selected case needs them. """
+    lat, lon, pfull = dataset['lat'][:], dataset['lon'][:], dataset['pfull'][:]
+    ucomp = dataset['ucomp']
+    products = functools.lru_cache()(lambda: stream_reduce(dataset))
+    ubar = functools.lru_cache()(lambda: get_zonal_mean(rundir, 'ucomp'))
+    frames_dir = os.path.join(rundir, 'BENCH', '')
+    os.makedirs(frames_dir + 'PLOTS', exist_ok=True)
+
+    def rebuild_zonal_mean():
+        for path in cache_paths(rundir, 'ucomp'):
+            if os.path.exists(path):
+                os.remove(path)
+        get_zonal_mean(rundir, 'ucomp', mmap=False)
+
+    def plot_gwd_map():
+        fig, ax = plt.subplots(subplot_kw={'projection': ccrs.PlateCarree()})
+        plot_map(lon, lat, products()['gwd_u_map'], ax=ax, levels=np.linspace(-2e-6, 2e-6, 100))
+        fig.savefig(frames_dir + 'PLOTS/gwd.png')
+        plt.close('all')
+
+    def plot_annual_seasonal():
+        plot_ubar_annual(lat, pfull, ucomp, frames_dir, ubar=products()['ubar_annual'])
+        plot_ubar_seasonal(lat, pfull, ucomp, frames_dir, ubar_seasonal=products()['ubar_seasonal'])
+        plt.close('all')
+
+    cases = {'stream_reduce': lambda: stream_reduce(dataset),
+             'zonal_mean_cache_build': rebuild_zonal_mean,
+             'zonal_mean_cache_load': lambda: np.asarray(get_zonal_mean(rundir, 'ucomp', mmap=False)),
+             'plot_ubar_annual_seasonal': plot_annual_seasonal,
+             'plot_map_gwd': plot_gwd_map,
+             'ubar_daily_gif_monthly': lambda: make_gif_from_frames(
+                 ubar_daily_frames(lat, pfull, ubar(), dday=30), frames_dir + 'PLOTS/ubar.gif'),
+             'plot_ubar_daily_parallel_monthly': lambda: plot_ubar_daily_parallel(
+                 lat, pfull, ubar(), frames_dir, dday=30, n_workers=n_workers)}
+    setups = {'plot_ubar_annual_seasonal': products, 'plot_map_gwd': products,
+              'ubar_daily_gif_monthly': ubar, 'plot_ubar_daily_parallel_monthly': ubar}
+    return cases, setups
+
+
+def get_commit():
+    """ Returns short hash of HEAD, with -dirty appended if there are uncommitted changes """
+    repo = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=repo).decode().strip()
+        dirty = subprocess.call(['git', 'diff', '--quiet', 'HEAD', '--', '.', ':!benchmarks/results'], cwd=repo)
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+    return commit + ('-dirty' if dirty else '')
+
+
+def save_results(records, commit):
+    """ Adds records to results/<commit>.json, replacing earlier records of the same case """
+    os.makedirs(results_dir, exist_ok=True)
+    save_as = os.path.join(results_dir, commit + '.json')
+    old_records = []
+    if os.path.exists(save_as):
+        with open(save_as) as f:
+            old_records = json.load(f)['records']
+    case_key = lambda record: (record['case'], record['resolution'], record['n_years'])
+    new_keys = set(case_key(record) for record in records)
+    records = [record for record in old_records if case_key(record) not in new_keys] + records
+    with open(save_as, 'w') as f:
+        json.dump({'commit': commit, 'host': socket.gethostname(), 'python': platform.python_version(),
+                   'numpy': np.__version__, 'records': records}, f, indent=1)
+    print("Results saved as ", save_as)
+
+
+def compare(commits=None):
+    """ Prints time and peak memory of commits[1] relative to commits[0], default the two most
+    recently saved result files """
+    if not commits:
+        files = sorted(glob_results(), key=os.path.getmtime)[-2:]
+    else:
+        files = [os.path.join(results_dir, commit + '.json') for commit in commits]
+    if len(files) < 2:
+        print("Need results for two commits to compare")
+        return
+    tables = []
+    for path in files:
+        with open(path) as f:
+            tables.append({(r['case'], r['resolution'], r['n_years']): r for r in json.load(f)['records']})
+    names = [os.path.basename(path)[:-len('.json')] for path in files]
+    print("{:<36} {:>5} {:>5} {:>10} {:>10} {:>7} {:>10} {:>10} {:>7}".format(
+          'case', 'res', 'years', names[0][:10], names[1][:10], 'ratio', 'MB', 'MB', 'ratio'))
+    for key in sorted(set(tables[0]) & set(tables[1])):
+        old, new = tables[0][key], tables[1][key]
+        print("{:<36} {:>5} {:>5} {:>10.3f} {:>10.3f} {:>7.2f} {:>10.1f} {:>10.1f} {:>7.2f}".format(
+              key[0], key[1], key[2], old['time_s'], new['time_s'], new['time_s'] / max(old['time_s'], 1e-9),
+              old['peak_MB'], new['peak_MB'], new['peak_MB'] / max(old['peak_MB'], 1e-9)))
+
+
+def glob_results():
+    if not os.path.exists(results_dir):
+        return []
+    return [os.path.join(results_dir, name) for name in os.listdir(results_dir) if name.endswith('.json')]
+
+
+def run_cases(cases, setups, args, resolution, n_years):
+    """ Measures the cases selected by args.cases (all by default), returns list of records """
+    records = []
+    for name, func in cases.items():
+        if args.cases and name not in args.cases:
+            continue
+        try:
+            time_s, peak_MB = measure(func, args.repeat, setup=setups.get(name))
+        except Exception as e:
+            print("{:<36} {} {:>4}yr FAILED ({})".format(name, resolution, n_years, e))
+            continue
+        print("{:<36} {} {:>4}yr {:10.3f}s {:10.1f}MB".format(name, resolution, n_years, time_s, peak_MB))
+        records.append({'case': name, 'resolution': resolution, 'n_years': n_years,
+                        'time_s': time_s, 'peak_MB': peak_MB, 'date': time.strftime('%Y-%m-%d %H:%M')})
+    return records
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark MiMA analysis on synthetic runs')
+    parser.add_argument('--resolution', nargs='+', default=['T42', 'T62'], choices=sorted(grids))
+    parser.add_argument('--years', nargs='+', type=int, default=[10, 50, 100])
+    parser.add_argument('--suite', nargs='+', default=['metrics', 'plots'], choices=['metrics', 'plots'])
+    parser.add_argument('--cases', nargs='+', default=None, help='only run benchmarks with these names')
+    parser.add_argument('--repeat', type=int, default=3, help='timed repeats, the best is recorded')
+    parser.add_argument('--workdir', default=os.path.join(os.environ.get('SCRATCH', '/tmp'), 'MiMA_benchmarks'),
+                        help='where synthetic runs are written and kept')
+    parser.add_argument('--n-lon', type=int, default=None, help='longitudes in synthetic files, default full grid')
+    parser.add_argument('--workers', type=int, default=None, help='processes for parallel plotting')
+    parser.add_argument('--compare', nargs='*', default=None, metavar='COMMIT',
+                        help='compare saved results of two commits instead of running')
+    args = parser.parse_args()
+
+    if args.compare is not None:
+        compare(args.compare)
+        return
+
+    commit = get_commit()
+    print("Benchmarking commit", commit)
+    for resolution in args.resolution:
+        for n_years in args.years:
+            records = []
+            if 'metrics' in args.suite:
+                records += run_cases(metric_cases(n_years, resolution), {}, args, resolution, n_years)
+            if 'plots' in args.suite:
+                rundir = os.path.join(args.workdir, '{}_{}yr_{}lon'.format(
+                                      resolution, n_years, args.n_lon or grids[resolution][1]), '')
+                if not os.path.exists(rundir + 'atmos_daily.nc'):
+                    make_synthetic_run(rundir, n_years, resolution, n_lon=args.n_lon)
+                with nc.Dataset(rundir + 'atmos_daily.nc', 'r') as dataset:
+                    cases, setups = plot_cases(dataset, rundir, args.workers)
+                    records += run_cases(cases, setups, args, resolution, n_years)
+            # Save as we go so long runs keep finished results
+            save_results(records, commit)
+
+
+if __name__ == '__main__':
+    main()
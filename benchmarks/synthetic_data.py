@@ -0,0 +1,144 @@
+"""Synthetic MiMA output for benchmarking. Zonal mean winds have a descending QBO-like oscillation
+at the equator (period ~28 months, jittered from cycle to cycle), subtropical jets, and a polar
+vortex that is westerly in winter and easterly in summer with random SSW-like breakdowns in NH
+winter. make_synthetic_run writes these to atmos_daily.nc on the T42 or T62 grid, one year at a
+time, so files much larger than memory can be made. e.g.
+    make_synthetic_run('/tmp/bench/T42_10yr/', n_years=10, resolution='T42') """
+import os
+
+import numpy as np
+import netCDF4 as nc
+from scipy import signal
+
+
+# Number of (lat, lon) points in MiMA output at each resolution
+grids = {'T42': (64, 128),
+         'T62': (94, 192)}
+n_pfull = 40
+
+
+def get_pfull():
+    """ Returns the 40 MiMA full pressure levels (hPa), matching MiMA_height_indices """
+    inds = [0, 13, 16, 17, 19, 22, 23, 27, 37, 39]
+    pressures = [0.02, 10., 20., 27., 40., 77., 100., 200., 850., 990.]
+    return np.exp(np.interp(np.arange(n_pfull), inds, np.log(pressures)))
+
+
+def get_lat(n_lat):
+    """ Returns Gaussian latitudes (degrees, increasing) as used by the spectral dynamical core """
+    x, _ = np.polynomial.legendre.leggauss(n_lat)
+    return np.degrees(np.arcsin(x))
+
+
+def iter_synthetic_ubar(n_years, lat, pfull, seed=0, qbo_period=840.):
+    """ Yields synthetic zonal mean zonal wind (360, pfull, lat) in m/s, float32, one year of 360
+    days at a time starting on 1 Jan. The QBO phase, SSW breakdowns and red noise carry on from
+    one year to the next, so only one year is ever held in memory. """
+    rng = np.random.default_rng(seed)
+    t = np.arange(360)
+    logp = np.log(pfull)[None, :, None]
+    lat = np.asarray(lat)[None, None, :]
+
+    # The seasonal cycle and the vertical and latitudinal profiles are the same every year.
+    # Subtropical jets, shifting poleward in summer
+    season = np.cos(2 * np.pi * (t - 15) / 360.)[:, None, None]
+    jet_lat_NH = 38. - 5. * season
+    jet_lat_SH = -38. - 5. * season
+    jet_profile = 30. * np.exp(-((logp - np.log(200.)) / 0.8)**2)
+    jets = jet_profile * (np.exp(-((lat - jet_lat_NH) / 10.)**2) + np.exp(-((lat - jet_lat_SH) / 10.)**2))
+
+    # Polar vortices, westerly in winter and easterly in summer, strongest in the upper stratosphere
+    vortex_profile = np.clip((np.log(1000.) - logp) / (np.log(1000.) - np.log(10.)), 0, None)**2
+    vortex_NH = (15. + 30. * season) * np.exp(-((lat - 62.) / 12.)**2)
+    vortex_SH = (15. - 45. * season) * np.exp(-((lat + 62.) / 12.)**2)
+    vortex = vortex_profile * (vortex_NH + vortex_SH)
+    qbo_profile = 20. * np.exp(-((logp - np.log(20.)) / 1.2)**2) * np.exp(-(lat / 12.)**2)
+    ssw_profile = vortex_profile * np.exp(-((lat - 62.) / 12.)**2)
+    noise_profile = (1. + 4. * (np.abs(lat) / 90.)) * vortex_profile
+    decay = np.exp(-np.arange(360) / 30.)
+
+    # State carried between years: QBO phase, breakdown at the end of the year, last noise value
+    # (a unit normal start is close to the stationary spread of the AR(1) noise)
+    qbo_phase0 = 0.
+    breakdown0 = 0.
+    noise0 = rng.standard_normal()
+    for year in range(n_years):
+        # QBO: jittered period, phase descending with height, equatorially confined
+        period = qbo_period * (1 + 0.1 * rng.standard_normal())
+        qbo_phase = qbo_phase0 + 2 * np.pi * (t + 1) / period
+        qbo_phase0 = qbo_phase[-1]
+        qbo = qbo_profile * np.sin(qbo_phase[:, None, None] + 1.5 * (logp - np.log(10.)))
+
+        # SSW like breakdowns: ~0.6 per winter, between Nov and Mar, recovering over ~30 days
+        breakdown = breakdown0 * np.exp(-(t + 1) / 30.)
+        for _ in range(rng.poisson(0.6)):
+            day = int(rng.integers(-60, 90)) % 360
+            breakdown[day:] += 55. * decay[:360 - day]
+        breakdown0 = breakdown[-1]
+        ssws = -breakdown[:, None, None] * ssw_profile
+
+        # Red noise, AR(1) with coefficient 0.9, larger at high latitudes
+        noise, _ = signal.lfilter([0.44], [1., -0.9], rng.standard_normal(360), zi=[0.9 * noise0])
+        noise0 = noise[-1]
+        noise = noise[:, None, None] * noise_profile
+
+        yield (qbo + jets + vortex + ssws + noise).astype(np.float32)
+
+
+def synthetic_ubar(n_years, lat, pfull, seed=0, qbo_period=840.):
+    """ Returns synthetic zonal mean zonal wind (time, pfull, lat) in m/s, float32, for n_years
+    of 360 days starting on 1 Jan, see iter_synthetic_ubar """
+    return np.concatenate(list(iter_synthetic_ubar(n_years, lat, pfull, seed, qbo_period)), axis=0)
+
+
+def make_synthetic_run(rundir, n_years=10, resolution='T42', n_lon=None, seed=0,
+                       variables=('ucomp', 'gwfu_cgwd', 'gwfv_cgwd')):
+    """ Writes a synthetic rundir/atmos_daily.nc with dimensions (time, pfull, lat, lon) at the
+    given resolution ('T42' or 'T62'), n_lon can be reduced to make smaller files. Zonal means of
+    ucomp are synthetic_ubar, zonal waves 1-3 are added so that the fields vary in longitude.
+    Returns path to the file. """
+    n_lat, n_lon_grid = grids[resolution]
+    n_lon = n_lon_grid if n_lon is None else n_lon
+    if not os.path.exists(rundir):
+        os.makedirs(rundir)
+    save_as = os.path.join(rundir, 'atmos_daily.nc')
+    lat = get_lat(n_lat)
+    lon = np.arange(n_lon) * 360. / n_lon
+    pfull = get_pfull()
+    n_time = n_years * 360
+    print("Writing {} years at {} ({:.1f} GB per variable) to {}".format(
+          n_years, resolution, n_time * n_pfull * n_lat * n_lon * 4 / 1e9, save_as))
+
+    rng = np.random.default_rng(seed + 1)
+    with nc.Dataset(save_as + '.tmp', 'w') as dataset:
+        dataset.createDimension('time', None)
+        dataset.createDimension('pfull', n_pfull)
+        dataset.createDimension('lat', n_lat)
+        dataset.createDimension('lon', n_lon)
+        time = dataset.createVariable('time', 'f8', ('time',))
+        time.units = 'days since 0001-01-01 00:00:00'
+        time.calendar = '360_day'
+        time[:] = np.arange(n_time) + 361.
+        dataset.createVariable('pfull', 'f4', ('pfull',))[:] = pfull
+        dataset.createVariable('lat', 'f8', ('lat',))[:] = lat
+        dataset.createVariable('lon', 'f8', ('lon',))[:] = lon
+        fields = {varname: dataset.createVariable(varname, 'f4', ('time', 'pfull', 'lat', 'lon'),
+                                                  chunksizes=(1, n_pfull, n_lat, n_lon))
+                  for varname in variables}
+
+        waves = np.stack([np.cos(k * np.radians(lon)) for k in (1, 2, 3)])   # (3, lon)
+        for t0, ubar_year in zip(range(0, n_time, 360), iter_synthetic_ubar(n_years, lat, pfull, seed=seed)):
+            amplitude = rng.standard_normal((ubar_year.shape[0], 1, 1, 3)).astype(np.float32)
+            eddies = (amplitude * 5.) @ waves.astype(np.float32)    # (time, 1, 1, lon)
+            for varname, field in fields.items():
+                if varname == 'ucomp':
+                    field[t0:t0 + 360] = ubar_year[..., None] + eddies
+                elif varname == 'temp':
+                    field[t0:t0 + 360] = 220. + 0.5 * ubar_year[..., None] + eddies
+                else:
+                    # GW drag, roughly the tendency of the QBO winds, m/s^2
+                    drag = np.gradient(ubar_year, axis=0)[..., None] / 86400.
+                    field[t0:t0 + 360] = drag + 1e-7 * eddies
+            print("Written year {} of {}".format(t0 // 360 + 1, n_years))
+    os.replace(save_as + '.tmp', save_as)
+    return save_as
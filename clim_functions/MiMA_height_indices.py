@@ -1,4 +1,6 @@
 """For reference, the approx. model indices needed to get given height level in atmosphere """
+import numpy as np
+
 MiMA_height_indices = {'10hPa': 13,
                        '20hPa': 16,
                        '27hPa': 17,
@@ -8,3 +10,35 @@ MiMA_height_indices = {'10hPa': 13,
                        '200hPa':27,
                        '850hPa':37}
 
+# Latitude bands (degrees) used in the analysis. At T42 these select the same points as the
+# indices 30:34 (4degS-4degN) and 53:55 (59.99702 - 62.787354) used in the scripts.
+MiMA_lat_bands = {'equator': (-5., 5.),
+                  '60N': (59., 63.)}
+
+
+def get_level_index(pfull, level):
+    """ Returns index of the model level closest to level, given either in hPa (e.g. 10) or as a
+    key of MiMA_height_indices (e.g. '10hPa'), using the pfull coordinate so that it works for
+    any resolution. """
+    if isinstance(level, str):
+        level = float(level.replace('hPa', ''))
+    return int(np.argmin(np.abs(np.log(np.asarray(pfull[:])) - np.log(level))))
+
+
+def get_lat_slice(lat, lat_band):
+    """ Returns slice of latitude indices with lat_band[0] <= lat <= lat_band[1], where lat_band is
+    (lat_min, lat_max) in degrees or a key of MiMA_lat_bands (e.g. 'equator'). lat must be
+    increasing, as in MiMA output. """
+    if isinstance(lat_band, str):
+        lat_band = MiMA_lat_bands[lat_band]
+    lat = np.asarray(lat[:])
+    return slice(int(np.searchsorted(lat, lat_band[0], side='left')),
+                 int(np.searchsorted(lat, lat_band[1], side='right')))
+
+
+def get_level_slice(pfull, level_band):
+    """ Returns slice of model level indices with level_band[0] <= pfull <= level_band[1] (hPa).
+    pfull must be increasing, as in MiMA output (top of the model first). """
+    pfull = np.asarray(pfull[:])
+    return slice(int(np.searchsorted(pfull, level_band[0], side='left')),
+                 int(np.searchsorted(pfull, level_band[1], side='right')))
@@ -0,0 +1,58 @@
+"""Support for lazily chunked (dask) arrays. dask is optional: without it everything here returns
+its input unchanged and the analysis functions only see NumPy arrays. With it, a netCDF variable
+can be wrapped as a chunked array and passed to mean_lat_weighted, deseasonalize, smooth,
+lp_filter, get_QBO_amplitude_DD or the plot_ubar functions, which then build task graphs that run
+out of core on all cores of the node. e.g.
+    ucomp = from_netcdf(dataset['ucomp'], time_chunk=360)
+    ubar = ucomp.mean(axis=-1)                                     # lazy (time, pfull, lat)
+    u_zonal = mean_lat_weighted(ubar[:, :, eq], lat[eq], axis=-1)  # lazy (time, pfull)
+    amplitude = get_QBO_amplitude_DD(u_zonal[:, [16, 22]])         # computed, as NumPy path """
+import numpy as np
+
+try:
+    import dask.array as da
+except ImportError:
+    da = None
+
+
+def is_chunked(variable):
+    """ True if variable is a dask array """
+    return da is not None and isinstance(variable, da.Array)
+
+
+def from_netcdf(variable, time_chunk=360):
+    """ Wraps a netCDF variable (time, ...) as a dask array with chunks of time_chunk days.
+    Reads are serialised with a lock as netCDF4/HDF5 is not thread safe. """
+    if da is None:
+        raise ImportError("from_netcdf needs dask, e.g. pip install dask")
+    chunks = (time_chunk,) + tuple(variable.shape[1:])
+    return da.from_array(variable, chunks=chunks, lock=True, asarray=True)
+
+
+def map_along_time(func, variable, dtype=None):
+    """ Applies func, which works along axis 0 (time) of a NumPy array, e.g. a filter, to each
+    block of variable after rechunking so that every block holds the whole time series (the
+    other axes are split to keep blocks at dask's default chunk size) """
+    chunks = {0: -1}
+    chunks.update({axis: 'auto' for axis in range(1, variable.ndim)})
+    variable = variable.rechunk(chunks)
+    return variable.map_blocks(func, dtype=variable.dtype if dtype is None else dtype)
+
+
+def compute(variable):
+    """ Computes variable if it is a dask array, otherwise returns it as is """
+    if is_chunked(variable):
+        return variable.compute()
+    return variable
+
+
+def compute_dict(products):
+    """ Computes all dask arrays in a dict together, so inputs shared between them are read once """
+    keys = [key for key, value in products.items() if is_chunked(value)]
+    if not keys:
+        return products
+    import dask
+    computed = dask.compute(*[products[key] for key in keys])
+    products = dict(products)
+    products.update(zip(keys, computed))
+    return products
@@ -1,60 +1,105 @@
 """Datetime module containing datetime functions set up for a 360 day year
-e.g. to convert from datenum to datetime and visa versa """
+e.g. to convert from datenum to datetime and visa versa. Every conversion is plain integer
+arithmetic on whole arrays (no loops) and inputs are never modified. Three representations are
+used:
+    day index   days since 0000-01-01, day = year*360 + (month-1)*30 + (day of month-1)
+    datetime    array [n_dates, 3] of (year, month, day), e.g. [[2000, 1, 1], [2000, 1, 2]]
+    datenum     day index + 31, as datenum360 has always counted (0000-01-01 is datenum 31)
+Dates of a MiMA file come straight from its time variable with get_dates(dataset['time']). """
+import re
+
 import numpy as np
 
+DPY = 360   # days per year
+DPM = 30    # days per month
+DATENUM_OFFSET = 31     # datenum of day index 0 (0000-01-01)
+
+time_scales = {'days': 1., 'day': 1., 'd': 1.,
+               'hours': 1. / 24, 'hour': 1. / 24, 'h': 1. / 24,
+               'minutes': 1. / 1440, 'minute': 1. / 1440,
+               'seconds': 1. / 86400, 'second': 1. / 86400, 's': 1. / 86400}
+calendars_360 = ['360_day', '360', 'thirty_day_months']
+
+
+def day_to_date(day):
+    """ Converts day indices (days since 0000-01-01) to datetimes [n, 3] of (year, month, day) """
+    day = np.floor(np.asarray(day)).astype(np.int64)
+    years, day_of_year = np.divmod(day, DPY)
+    months, days = np.divmod(day_of_year, DPM)
+    return np.stack((years, months + 1, days + 1), axis=-1)
+
+
+def date_to_day(datetimes):
+    """ Converts datetimes [n, 3] of (year, month, day) to day indices (days since 0000-01-01) """
+    datetimes = np.asarray(datetimes, dtype=np.int64)
+    return datetimes[..., 0]*DPY + (datetimes[..., 1] - 1)*DPM + datetimes[..., 2] - 1
+
+
+def day_of_year(day):
+    """ Returns day of the year (0-359) of day indices """
+    return np.mod(np.asarray(day), DPY).astype(int)
+
+
+def month_of_day(day):
+    """ Returns month index (0-11) of day indices """
+    return (np.mod(np.asarray(day), DPY) // DPM).astype(int)
+
 
 def createyear360(n_year, start_year = 2000):
     """Creates a list of datetimes in the form yyyy-mm-dd for a 360 day year
     Args: n_year = number of years
           start_year = starting year, default = 2000"""
-    ys = np.arange(start_year, start_year + n_year) 
-    year360 = np.zeros((n_year*360, 3), dtype=int)
-    for i in range(n_year):
-        years = np.repeat(ys[i], 360) 
-        months = np.repeat(np.arange(1,13), 30)  
-        days   = np.tile(np.arange(1, 31), 12)
-        year360[i*360:(i+1)*360,:] = np.stack((years, months, days), axis=-1) 
-    return(year360)
+    return day_to_date(np.arange(n_year*DPY) + start_year*DPY)
 
 
 def datenum360(datetimes):
     """Calculates datetimes as datenum when using 360 day years
     datetimes is a np array of datetimes of form (year, mon, day)
     Shape is [n_dates, 3], e.g. array([[2000, 1, 1], [2000, 1, 2]]) """
-    start_date = [0, 1, 1]
-    years = datetimes[:,0]
-    months = datetimes[:,1]
-    days = datetimes[:,2]
-    days_since = years*360 + months*30 + days   # days since 0000-01-01
-    return(days_since)
+    return date_to_day(datetimes) + DATENUM_OFFSET
 
 
 def datetime360(datenum):
-    """Calculates datetime from datenums when using 360 day years"""
-    # First check for nans, note that these result in datetime [-3, 2, 20]
-    datenum[np.isnan(datenum)] = -1e3
-
-    start_date = [0, 1, 1]
-    # Years are divided by 360 and floor-ed
-    years = np.floor(datenum/360.0)
-
-    # Months we take the remainder and do the same with 30 days
-    datenum1 = np.mod(datenum, 360);
-    months = np.floor((datenum1-1)/30.0);    
-    # Month = 0 should be Month = 12 of previous year
-    years[months==0] = years[months==0] - 1;
-    months[months==0] = 12;
-    
-    # Days we take the remainder again
-    days = np.mod(datenum1, 30);
-    #print(days)
-    # Day = 0  should be Day = 30 of previous month
-    days[(days==0)] = 30
-    
-    # Check all are ints
-    years = np.ndarray.astype(years, int) 
-    months = np.ndarray.astype(months, int) 
-    days = np.ndarray.astype(days, int) 
-    datetime = np.stack((years, months, days), axis=-1) 
-    
-    return(datetime)
+    """Calculates datetime from datenums when using 360 day years, the inverse of datenum360.
+    Fractions of a day are dropped. NaNs give datetime [-3, 2, 20] as before (datenum -1000),
+    without changing datenum."""
+    datenum = np.asarray(datenum, dtype=np.float64)
+    datenum = np.where(np.isnan(datenum), -1e3, datenum)
+    return day_to_date(datenum - DATENUM_OFFSET)
+
+
+def parse_time_units(units):
+    """ Parses CF time units, e.g. 'days since 0001-01-01 00:00:00', into the length of one unit
+    in days and the reference time as a (fractional) day index """
+    match = re.match(r'\s*(\w+)\s+since\s+(-?\d+)-(\d+)-(\d+)(?:[ T](\d+):(\d+)(?::(\d+(?:\.\d*)?))?)?', units)
+    if match is None or match.group(1).lower() not in time_scales:
+        raise ValueError("cannot parse time units '{}'".format(units))
+    year, month, day = (int(match.group(i)) for i in (2, 3, 4))
+    hour, minute, second = (float(match.group(i) or 0) for i in (5, 6, 7))
+    reference = date_to_day([year, month, day]) + (hour + minute/60. + second/3600.) / 24.
+    return time_scales[match.group(1).lower()], reference
+
+
+def time_to_day(time, units='days since 0001-01-01 00:00:00'):
+    """ Converts time values in units to day indices. Each value is taken as the end or middle
+    of a daily average, as written by MiMA (e.g. 361 or 360.5 days since 0001-01-01 are both
+    day 720, 0002-01-01). """
+    scale, reference = parse_time_units(units)
+    days = reference + np.asarray(time, dtype=np.float64) * scale
+    # Small tolerance so values on the end of a day are not rounded into the next one
+    return (np.ceil(days - 1e-6) - 1).astype(np.int64)
+
+
+def get_day_inds(time):
+    """ Returns day indices (days since 0000-01-01) of a netCDF time variable, using its units
+    and checking its calendar has 360 day years """
+    calendar = getattr(time, 'calendar', '360_day')
+    if calendar.lower() not in calendars_360:
+        raise ValueError("time has calendar '{}', not a 360 day calendar".format(calendar))
+    return time_to_day(np.ma.getdata(time[:]), time.units)
+
+
+def get_dates(time):
+    """ Returns datetimes [n_time, 3] of a netCDF time variable, e.g. for split_by_doy or
+    find_SSW_events: dates = get_dates(dataset['time']) """
+    return day_to_date(get_day_inds(time))
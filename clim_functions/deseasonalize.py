@@ -1,22 +1,104 @@
 import numpy as np
+from io_functions.instrument import instrumented
+from clim_functions.chunked import is_chunked
+from clim_functions.datetime360 import month_of_day
 
 
-def deseasonalize(variable, time):
-    """Deseasonalize data, given time series of data. Monthly means over the 
+def get_month_inds(time):
+    """ Returns month index (0-11) of each time (in days) for 360 day years of 30 day months """
+    return month_of_day(time)
+
+
+def _month_runs(month_inds):
+    """ Groups a time series of month indices into runs of consecutive days in the same month.
+    Returns start inds, end inds and month of each run. """
+    change = np.flatnonzero(month_inds[1:] != month_inds[:-1]) + 1
+    starts = np.concatenate(([0], change))
+    ends = np.concatenate((change, [len(month_inds)]))
+    return starts, ends, month_inds[starts]
+
+
+def _float_dtype(variable):
+    """ Keeps float32/float64 input as is, anything else is computed in float64 """
+    if np.issubdtype(variable.dtype, np.floating):
+        return variable.dtype
+    return np.dtype(np.float64)
+
+
+def monthly_climatology(variable, time):
+    """ Returns the monthly climatology of variable, array of size [12, ...] containing the mean
+    of each month over the whole time series, with the same dtype as variable (float64 for
+    non-float input). Months with no data are NaN. Sums are accumulated in float64 one month
+    at a time, so no copy of variable is made.
+    Arguments: variable, array of any size, as long as time is on axis 0.
+               time,     time vector (days), same length as axis 0 of variable. """
+    if is_chunked(variable):
+        return _monthly_climatology_chunked(variable, time)
+    variable = np.asanyarray(variable)
+    month_inds = get_month_inds(time)
+    starts, ends, run_months = _month_runs(month_inds)
+
+    sums = np.zeros((12,) + variable.shape[1:])
+    for start, end, month in zip(starts, ends, run_months):
+        sums[month] += variable[start:end].sum(axis=0, dtype=np.float64)
+    counts = np.bincount(month_inds, minlength=12).reshape((12,) + (1,) * (variable.ndim - 1))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        climatology = sums / counts
+    return climatology.astype(_float_dtype(variable))
+
+
+def _monthly_climatology_chunked(variable, time):
+    """ monthly_climatology of a dask array, lazy (12, ...) """
+    import dask.array as da
+    month_inds = get_month_inds(time)
+    climatology = []
+    for month in range(12):
+        in_month = (month_inds == month)
+        if in_month.any():
+            climatology.append(variable[in_month].mean(axis=0, dtype=np.float64))
+        else:
+            climatology.append(da.full(variable.shape[1:], np.nan, chunks=variable.chunks[1:]))
+    return da.stack(climatology).astype(_float_dtype(variable))
+
+
+@instrumented
+def deseasonalize(variable, time, climatology=None, inplace=False, return_climatology=False):
+    """Deseasonalize data, given time series of data. Monthly means over the
     time series are computed and subtracted from the data.
-    Arguments: variable, array of any size, as long as time is on axis 0. 
-               time,     time vector which indicates which day corresponds 
-               to the data variable. Must be same length as axis 0 of variable. 
-    Returns variable_deseasonalized, array of same size as original variable 
-               but with the mean of each month subtracted. """
-    variable_deseasonalized = np.zeros(variable.shape)
-    for i in range(12):
-        # Get month indices
-        month_i = list(range(i*30, (i+1) * 30))
-        inds_month_i =  np.isin( time%360 , month_i )
-        # Get variable data for this month
-        variable_month = variable[inds_month_i]
-        variable_month_mean = np.mean(variable_month, axis=0)
-        # Deseasonalize 
-        variable_deseasonalized[inds_month_i] = variable_month - variable_month_mean
-    return variable_deseasonalized
\ No newline at end of file
+    Arguments: variable, array of any size, as long as time is on axis 0.
+               time,     time vector which indicates which day corresponds
+               to the data variable. Must be same length as axis 0 of variable.
+               climatology, optional [12, ...] monthly means to subtract instead of those of
+               variable, e.g. from monthly_climatology of an earlier time chunk or another run.
+               inplace, if True the result is written into variable (which must be a float
+               array) instead of a new array.
+               return_climatology, if True also return the monthly climatology used.
+    Returns variable_deseasonalized, array of same size and dtype (float64 for non-float input)
+               as original variable but with the mean of each month subtracted.
+    variable can also be a dask array (see clim_functions.chunked), the result is then a lazy
+    dask array and inplace is ignored. """
+    if climatology is None:
+        climatology = monthly_climatology(variable, time)
+    if is_chunked(variable):
+        deseasonalized = (variable - climatology[get_month_inds(time)]).astype(_float_dtype(variable))
+        if return_climatology:
+            return deseasonalized, climatology
+        return deseasonalized
+    variable = np.asanyarray(variable)
+    if inplace:
+        if not np.issubdtype(variable.dtype, np.floating):
+            raise ValueError("inplace deseasonalize needs a float array, got {}".format(variable.dtype))
+        variable_deseasonalized = variable
+    else:
+        # C order, so the result can be filtered in place (see smoothing.apply_in_tiles) even if
+        # variable is a strided view, e.g. ubar[:, [16, 22]]
+        variable_deseasonalized = np.empty_like(variable, dtype=_float_dtype(variable), order='C')
+
+    # Subtract one run of consecutive days in the same month at a time, avoiding full size temporaries
+    starts, ends, run_months = _month_runs(get_month_inds(time))
+    for start, end, month in zip(starts, ends, run_months):
+        variable_deseasonalized[start:end] = variable[start:end] - climatology[month]
+
+    if return_climatology:
+        return variable_deseasonalized, climatology
+    return variable_deseasonalized
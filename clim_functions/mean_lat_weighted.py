@@ -2,6 +2,7 @@
 import numpy as np
 
 def mean_lat_weighted(variable, lats, axis=(0)):
-    """Area weighted mean, where weighting is proportional to the cosine of latitude"""
+    """Area weighted mean, where weighting is proportional to the cosine of latitude. Works on
+    dask arrays too (np.average dispatches to dask), returning a lazy result"""
     return np.average(variable, weights=np.cos(lats*np.pi/180.), axis=axis)
 
@@ -0,0 +1,156 @@
+"""Online (streaming) statistics over time chunks. Accumulators keep the count, mean and sums of
+squared deviations (Welford), are updated with whole chunks at a time and merged with Chan et
+al.'s pairwise formulas, so statistics from different chunks, processes or run segments combine
+to the same result as one pass over the whole time series (up to rounding). e.g.
+    stats = RunningStats()
+    for t0, t1 in iter_time_chunks(n_time, 360):
+        stats.update(ucomp[t0:t1].mean(axis=-1))
+    ubar, ubar_var = stats.mean, stats.var
+    total = merge_stats([stats_run1, stats_run2])
+Time is on axis 0 of every chunk, statistics have the shape of the other axes. """
+import numpy as np
+
+
+class RunningStats:
+    """ Running count, mean, variance, min and max of chunks with time on axis 0 """
+    def __init__(self):
+        self.count = 0
+        self.mean = None
+        self.m2 = None      # sum of squared deviations from the mean
+        self.min = None
+        self.max = None
+
+    def update(self, chunk):
+        """ Adds a chunk (time, ...) to the statistics """
+        chunk = np.asarray(chunk, dtype=np.float64)
+        if chunk.shape[0] == 0:
+            return self
+        chunk_stats = RunningStats()
+        chunk_stats.count = chunk.shape[0]
+        chunk_stats.mean = chunk.mean(axis=0)
+        chunk_stats.m2 = ((chunk - chunk_stats.mean)**2).sum(axis=0)
+        chunk_stats.min = chunk.min(axis=0)
+        chunk_stats.max = chunk.max(axis=0)
+        return self.merge(chunk_stats)
+
+    def merge(self, other):
+        """ Merges the statistics of other into these, returns self """
+        if other.count == 0:
+            return self
+        if self.count == 0:
+            self.count = other.count
+            self.mean, self.m2 = np.copy(other.mean), np.copy(other.m2)
+            self.min, self.max = np.copy(other.min), np.copy(other.max)
+            return self
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta * (other.count / count)
+        self.m2 = self.m2 + other.m2 + delta**2 * (self.count * other.count / count)
+        self.min = np.minimum(self.min, other.min)
+        self.max = np.maximum(self.max, other.max)
+        self.count = count
+        return self
+
+    @property
+    def var(self):
+        """ Population variance (ddof=0, as np.var) """
+        return self.m2 / self.count
+
+    @property
+    def std(self):
+        return np.sqrt(self.var)
+
+    def sample_var(self):
+        """ Sample variance (ddof=1) """
+        return self.m2 / (self.count - 1)
+
+    def state(self):
+        """ Returns the accumulator as a dict of arrays, e.g. to save with np.savez """
+        return {'count': self.count, 'mean': self.mean, 'm2': self.m2, 'min': self.min, 'max': self.max}
+
+    @classmethod
+    def from_state(cls, state):
+        stats = cls()
+        stats.count = int(state['count'])
+        if stats.count > 0:
+            stats.mean, stats.m2 = np.asarray(state['mean']), np.asarray(state['m2'])
+            stats.min, stats.max = np.asarray(state['min']), np.asarray(state['max'])
+        return stats
+
+
+class RunningCovariance:
+    """ Running means of x and y and their covariance, for chunks with time on axis 0 """
+    def __init__(self):
+        self.count = 0
+        self.mean_x = None
+        self.mean_y = None
+        self.c = None       # sum of products of deviations from the means
+
+    def update(self, x, y):
+        """ Adds chunks x and y (time, ...), which must have the same length in time """
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        if x.shape[0] != y.shape[0]:
+            raise ValueError("x and y chunks have different lengths {} and {}".format(x.shape[0], y.shape[0]))
+        if x.shape[0] == 0:
+            return self
+        chunk_cov = RunningCovariance()
+        chunk_cov.count = x.shape[0]
+        chunk_cov.mean_x, chunk_cov.mean_y = x.mean(axis=0), y.mean(axis=0)
+        chunk_cov.c = ((x - chunk_cov.mean_x) * (y - chunk_cov.mean_y)).sum(axis=0)
+        return self.merge(chunk_cov)
+
+    def merge(self, other):
+        """ Merges the covariance of other into this one, returns self """
+        if other.count == 0:
+            return self
+        if self.count == 0:
+            self.count = other.count
+            self.mean_x, self.mean_y, self.c = np.copy(other.mean_x), np.copy(other.mean_y), np.copy(other.c)
+            return self
+        count = self.count + other.count
+        delta_x = other.mean_x - self.mean_x
+        delta_y = other.mean_y - self.mean_y
+        self.c = self.c + other.c + delta_x * delta_y * (self.count * other.count / count)
+        self.mean_x = self.mean_x + delta_x * (other.count / count)
+        self.mean_y = self.mean_y + delta_y * (other.count / count)
+        self.count = count
+        return self
+
+    @property
+    def cov(self):
+        """ Population covariance (ddof=0) """
+        return self.c / self.count
+
+    def sample_cov(self):
+        """ Sample covariance (ddof=1, as np.cov) """
+        return self.c / (self.count - 1)
+
+    def state(self):
+        return {'count': self.count, 'mean_x': self.mean_x, 'mean_y': self.mean_y, 'c': self.c}
+
+    @classmethod
+    def from_state(cls, state):
+        cov = cls()
+        cov.count = int(state['count'])
+        if cov.count > 0:
+            cov.mean_x, cov.mean_y = np.asarray(state['mean_x']), np.asarray(state['mean_y'])
+            cov.c = np.asarray(state['c'])
+        return cov
+
+
+def merge_stats(accumulators):
+    """ Merges a list of RunningStats or RunningCovariance in order, returns a new accumulator """
+    merged = type(accumulators[0])()
+    for accumulator in accumulators:
+        merged.merge(accumulator)
+    return merged
+
+
+def running_stats(variable, chunk_size=360):
+    """ Returns RunningStats of variable (time, ...), which can be a netCDF variable, read
+    chunk_size days at a time """
+    stats = RunningStats()
+    for t0 in range(0, variable.shape[0], chunk_size):
+        stats.update(variable[t0:t0 + chunk_size])
+    return stats
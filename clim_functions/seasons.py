@@ -1,19 +1,22 @@
 import numpy as np
 
+from clim_functions.datetime360 import month_of_day
+
 months = ['Jan','Feb','Mar','Apr','May','Jun','Jul','Aug','Sep','Oct','Nov','Dec']
+seasons = ['DJF', 'MAM', 'JJA', 'SON']
+
+def get_seasonal_inds(n_days, start_day=0):
+    """ Returns 4 arrays of indicies for DJF, MAM, JJA and SON to allow quick sub-selection
+    over variables for each season. Assumes time series starts in Jan, or give the day index
+    of its first day as start_day, e.g. get_day_inds(dataset['time'])[0] """
+    season_of_day = get_season_of_day(np.arange(start_day, start_day + n_days))
+    DJF_inds, MAM_inds, JJA_inds, SON_inds = (np.flatnonzero(season_of_day == i) for i in range(4))
 
-def get_seasonal_inds(n_days):
-    """ Returns 4 lists of indicies for DJF, MAM, JJA and SON to allow quick sub-selection
-    over variables for each season. Assumes time series starts in Jan"""
-    DJF = list(range(0, 60)) + list(range(330, 360))
-    MAM = list(range(60, 150))
-    JJA = list(range(150, 240))
-    SON = list(range(240, 330))
-    DJF_inds = [i for i in range(n_days) if i%360 in DJF]
-    MAM_inds = [i for i in range(n_days) if i%360 in MAM]
-    JJA_inds = [i for i in range(n_days) if i%360 in JJA]
-    SON_inds = [i for i in range(n_days) if i%360 in SON]
-    
     return DJF_inds, MAM_inds, JJA_inds, SON_inds
 
 
+def get_season_of_day(day_inds):
+    """ Returns the index into seasons (0=DJF, 1=MAM, 2=JJA, 3=SON) for each day index, using 
+    the same convention as get_seasonal_inds (time series starts in Jan). Works on any chunk 
+    of the time axis, e.g. get_season_of_day(np.arange(t0, t1)) """
+    return ((month_of_day(day_inds) + 1) // 3) % 4
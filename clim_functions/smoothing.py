@@ -1,17 +1,75 @@
 import numpy as np
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 from scipy.ndimage import uniform_filter1d
 from scipy import signal
+from io_functions.instrument import instrumented
+from clim_functions.chunked import is_chunked, map_along_time
 
 
-def lp_filter(u, n_months=4):
-    """ Removes high freq. variability with Butterworth low-pass filter, 9th order, cutoff 120 days (4 months) """
+@lru_cache(maxsize=None)
+def butter_sos(n_days, order=9):
+    """ Returns Butterworth low-pass filter coefficients (second order sections) with cutoff
+    n_days. Cached, so repeated calls with the same cutoff do not redesign the filter. """
+    return signal.butter(N=order, Wn=1/n_days, btype='low', output='sos')
+
+
+def apply_in_tiles(func, u, out=None, n_workers=1, max_tile_bytes=2**28):
+    """ Applies func, which filters along axis 0 (time), to tiles of the other axes of u so that
+    only about max_tile_bytes of float64 work space is used per worker. Tiles are processed by
+    n_workers threads. The result has the dtype of u (float64 for non-float input) and is 
+    written into out if given, which may be u itself. 
+    If u is a dask array the result is a lazy dask array, filtered block by block with the whole 
+    time series in each block, and out is not used. """
+    if is_chunked(u):
+        dtype = u.dtype if np.issubdtype(u.dtype, np.floating) else np.float64
+        return map_along_time(lambda block: apply_in_tiles(func, block, max_tile_bytes=max_tile_bytes),
+                              u, dtype=dtype)
+    u = np.asarray(u)
+    n_time = u.shape[0]
+    if out is None:
+        dtype = u.dtype if np.issubdtype(u.dtype, np.floating) else np.float64
+        out = np.empty(u.shape, dtype=dtype)
+    u_cols = u.reshape(n_time, -1)
+    out_cols = out.reshape(n_time, -1)
+    if not np.shares_memory(out_cols, out):
+        raise ValueError("out must be a contiguous array so that tiles can be written into it")
+
+    # Filters copy the tile a few times internally, allow for that in the tile width
+    tile_cols = max(1, max_tile_bytes // (3 * 8 * max(n_time, 1)))
+    tiles = [slice(c0, c0 + tile_cols) for c0 in range(0, u_cols.shape[1], tile_cols)]
+
+    def filter_tile(tile):
+        out_cols[:, tile] = func(u_cols[:, tile].astype(np.float64))
+
+    if n_workers == 1 or len(tiles) == 1:
+        for tile in tiles:
+            filter_tile(tile)
+    else:
+        with ThreadPoolExecutor(n_workers) as pool:
+            list(pool.map(filter_tile, tiles))
+    return out
+
+
+@instrumented
+def lp_filter(u, n_months=4, zero_phase=False, n_workers=1, out=None, max_tile_bytes=2**28):
+    """ Removes high freq. variability with Butterworth low-pass filter, 9th order, cutoff 120 days (4 months).
+    u can be any size with time on axis 0, e.g. (time, pfull, lat, lon); it is filtered in tiles
+    (see apply_in_tiles) and float32 input gives float32 output. zero_phase=True filters forwards
+    and backwards (sosfiltfilt) so the QBO phase is not shifted, default is the causal sosfilt. """
     n_days = n_months*30    # default 4 month
-    sos = signal.butter(N=9, Wn=1/n_days, btype='low', output='sos')
-    u_filtered = signal.sosfilt(sos, u, axis=0)
+    sos = butter_sos(n_days)
+    if zero_phase:
+        func = lambda u_tile: signal.sosfiltfilt(sos, u_tile, axis=0)
+    else:
+        func = lambda u_tile: signal.sosfilt(sos, u_tile, axis=0)
+    u_filtered = apply_in_tiles(func, u, out=out, n_workers=n_workers, max_tile_bytes=max_tile_bytes)
     return u_filtered
 
-def smooth(u, n_months=5):
-    """ Smooth with five-month centered running mean """
+@instrumented
+def smooth(u, n_months=5, n_workers=1, out=None, max_tile_bytes=2**28):
+    """ Smooth with five-month centered running mean. Tiled like lp_filter. """
     n_days = n_months*30     # default 5 month
-    u_smoothed = uniform_filter1d(u, n_days, axis=0)
+    func = lambda u_tile: uniform_filter1d(u_tile, n_days, axis=0)
+    u_smoothed = apply_in_tiles(func, u, out=out, n_workers=n_workers, max_tile_bytes=max_tile_bytes)
     return u_smoothed
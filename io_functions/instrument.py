@@ -0,0 +1,211 @@
+"""Opt-in instrumentation of analysis stages. When enabled (set MIMA_INSTRUMENT=1 in the
+environment, or call enable()), every instrumented function or stage records wall time, CPU time
+(own and of finished child processes), peak RSS and bytes read during the stage, and a JSON report
+is written to rundir/instrument_report.json (next to PLOTS/). When disabled the decorators only
+check a flag. e.g. in a script
+    report_at_exit(rundir)
+    with stage('QBO contour plot'):
+        ...
+and in modules
+    @instrumented
+    def stream_reduce(...):
+Bytes read are from /proc/self/io: rchar counts everything read by the process (netCDF/HDF5 reads
+make up almost all of it in these scripts), read_bytes only what actually came from disk rather
+than the page cache. Peak RSS is per stage on Linux (the high water mark is reset at the start of
+each stage), elsewhere it is the process peak so far. """
+import os
+import sys
+import json
+import time
+import atexit
+import signal
+import socket
+import resource
+import functools
+
+enabled = bool(os.environ.get('MIMA_INSTRUMENT'))
+report_name = 'instrument_report.json'
+
+_records = []
+_active = []
+_start_time = time.time()
+_report_path = None
+# Resetting the high water mark also resets ru_maxrss, so the process peak is tracked here
+_process_peak = 0
+
+
+def enable():
+    global enabled
+    enabled = True
+
+
+def disable():
+    global enabled
+    enabled = False
+
+
+def reset():
+    """ Discards recorded stages """
+    del _records[:]
+
+
+def _read_io():
+    """ Returns (rchar, read_bytes) of this process, or (None, None) if /proc is not available """
+    try:
+        with open('/proc/self/io') as f:
+            fields = dict(line.split(':') for line in f.read().splitlines())
+        return int(fields['rchar']), int(fields['read_bytes'])
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+
+def _read_rss():
+    """ Returns (current RSS, peak RSS since last reset) in bytes, from /proc if available """
+    try:
+        with open('/proc/self/status') as f:
+            fields = dict(line.split(':', 1) for line in f.read().splitlines() if ':' in line)
+        return int(fields['VmRSS'].split()[0]) * 1024, int(fields['VmHWM'].split()[0]) * 1024
+    except (OSError, KeyError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in kB on Linux, bytes on macOS
+        peak = peak if sys.platform == 'darwin' else peak * 1024
+        return None, peak
+
+
+def _reset_peak_rss():
+    """ Resets the RSS high water mark (Linux >= 4.0). Returns True if it was reset. """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _fold_peak():
+    """ Updates the peak RSS of all active stages with the current high water mark """
+    global _process_peak
+    _, peak = _read_rss()
+    _process_peak = max(_process_peak, peak)
+    for record in _active:
+        record['peak_rss'] = max(record['peak_rss'], peak)
+
+
+def _start_stage(name):
+    # The parent stage must see the peak so far before the high water mark is reset
+    _fold_peak()
+    per_stage = _reset_peak_rss()
+    rss, peak = _read_rss()
+    rchar, read_bytes = _read_io()
+    times = os.times()
+    record = {'name': name, 'parent': _active[-1]['name'] if _active else None, 'depth': len(_active),
+              'start_s': time.time() - _start_time, 'wall': time.perf_counter(),
+              'cpu': times.user + times.system, 'children_cpu': times.children_user + times.children_system,
+              'rss_start': rss, 'peak_rss': peak, 'per_stage_peak': per_stage,
+              'rchar': rchar, 'read_bytes': read_bytes}
+    _active.append(record)
+    return record
+
+
+def _end_stage(record):
+    _fold_peak()
+    _active.remove(record)
+    rss, _ = _read_rss()
+    rchar, read_bytes = _read_io()
+    times = os.times()
+    MB = 1e-6
+    _records.append({'name': record['name'], 'parent': record['parent'], 'depth': record['depth'],
+                     'start_s': round(record['start_s'], 3),
+                     'wall_s': time.perf_counter() - record['wall'],
+                     'cpu_s': times.user + times.system - record['cpu'],
+                     'children_cpu_s': times.children_user + times.children_system - record['children_cpu'],
+                     'rss_start_MB': None if record['rss_start'] is None else record['rss_start'] * MB,
+                     'rss_end_MB': None if rss is None else rss * MB,
+                     'peak_rss_MB': record['peak_rss'] * MB,
+                     'peak_rss_scope': 'stage' if record['per_stage_peak'] else 'process',
+                     'bytes_read': None if rchar is None else rchar - record['rchar'],
+                     'disk_bytes_read': None if read_bytes is None else read_bytes - record['read_bytes']})
+    # Keep the report on disk up to date, so it survives the job being killed
+    if _report_path is not None and not _active:
+        write_report(*_report_path, verbose=False)
+
+
+class stage:
+    """ Context manager recording the enclosed block as a stage called name, if enabled """
+    def __init__(self, name):
+        self.name = name
+        self.record = None
+
+    def __enter__(self):
+        if enabled:
+            self.record = _start_stage(self.name)
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.record is not None:
+            _end_stage(self.record)
+            self.record = None
+        return False
+
+
+def instrumented(func):
+    """ Decorator recording each call of func as a stage named module.function, if enabled """
+    name = '{}.{}'.format(func.__module__.split('.')[-1], func.__name__)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not enabled:
+            return func(*args, **kwargs)
+        with stage(name):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def get_report():
+    """ Returns the report as a dict: the recorded stages in the order they finished and a
+    summary of calls, total wall time and largest peak RSS per stage name """
+    summary = {}
+    for record in _records:
+        entry = summary.setdefault(record['name'], {'calls': 0, 'wall_s': 0., 'cpu_s': 0.,
+                                                    'peak_rss_MB': 0., 'bytes_read': 0})
+        entry['calls'] += 1
+        entry['wall_s'] += record['wall_s']
+        entry['cpu_s'] += record['cpu_s'] + record['children_cpu_s']
+        entry['peak_rss_MB'] = max(entry['peak_rss_MB'], record['peak_rss_MB'])
+        entry['bytes_read'] += record['bytes_read'] or 0
+    _fold_peak()
+    max_rss_children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    scale = 1e-6 if sys.platform == 'darwin' else 1024e-6
+    running = [{'name': record['name'], 'wall_s': time.perf_counter() - record['wall']}
+               for record in _active]
+    return {'command': sys.argv, 'host': socket.gethostname(),
+            'started': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(_start_time)),
+            'total_wall_s': time.time() - _start_time,
+            'max_rss_MB': _process_peak * 1e-6, 'max_rss_children_MB': max_rss_children * scale,
+            'summary': summary, 'stages': list(_records), 'running': running}
+
+
+def write_report(rundir, filename=report_name, verbose=True):
+    """ Writes the report to rundir/filename, returns the path """
+    save_as = os.path.join(rundir, filename)
+    with open(save_as + '.tmp', 'w') as f:
+        json.dump(get_report(), f, indent=1)
+    os.replace(save_as + '.tmp', save_as)
+    if verbose:
+        print("Instrumentation report saved as ", save_as)
+    return save_as
+
+
+def report_at_exit(rundir, filename=report_name):
+    """ Writes the report to rundir/filename when the script exits, if instrumentation is
+    enabled by then, and after every top level stage. SIGTERM (sent by Slurm at the time limit)
+    exits through atexit so the stages still running are recorded too. """
+    global _report_path
+    _report_path = (rundir, filename)
+
+    def write_if_enabled():
+        if enabled and (_records or _active):
+            write_report(rundir, filename)
+    atexit.register(write_if_enabled)
+    if enabled and signal.getsignal(signal.SIGTERM) == signal.SIG_DFL:
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
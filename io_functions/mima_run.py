@@ -0,0 +1,155 @@
+"""Lazy, coordinate aware access to a MiMA run. Pressure levels and latitude bands are resolved to
+indices from the file's own pfull and lat coordinates (so the same code works for T42 and T62),
+only the hyperslabs needed are read, and derived fields are memoized in an LRU cache with a memory
+cap so repeated notebook cells do not re-read the file. e.g.
+    run = MiMARun(rundir)
+    u10at60 = run.band_mean('ucomp', '60N', level='10hPa')
+    u_zonal = run.band_mean('ucomp', 'equator')               # (time, pfull)
+    gwd_u = run.time_mean('gwfu_cgwd', level='100hPa')         # (lat, lon) """
+from collections import OrderedDict
+
+import numpy as np
+
+from clim_functions.mean_lat_weighted import mean_lat_weighted
+from clim_functions.MiMA_height_indices import get_level_index, get_lat_slice
+from io_functions.stream_reduce import iter_time_chunks
+from io_functions.read_planner import read_hyperslabs
+from io_functions.multifile import open_run
+
+
+class LRUCache:
+    """ Least recently used cache of arrays, evicting the oldest entries once the total size of
+    the cached arrays exceeds max_bytes. Arrays larger than max_bytes are not cached. """
+    def __init__(self, max_bytes=2**30):
+        self.max_bytes = max_bytes
+        self.n_bytes = 0
+        self.entries = OrderedDict()
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key):
+        self.entries.move_to_end(key)
+        return self.entries[key]
+
+    def put(self, key, value):
+        size = np.asarray(value).nbytes
+        if size > self.max_bytes:
+            return value
+        if key in self.entries:
+            self.n_bytes -= np.asarray(self.entries.pop(key)).nbytes
+        self.entries[key] = value
+        self.n_bytes += size
+        while self.n_bytes > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.n_bytes -= np.asarray(evicted).nbytes
+        return value
+
+    def clear(self):
+        self.entries.clear()
+        self.n_bytes = 0
+
+
+def _memoized(method):
+    """ Caches the result of a MiMARun method in run.cache, keyed on its name and arguments """
+    def wrapper(self, *args, **kwargs):
+        key = (method.__name__,) + tuple(_hashable(arg) for arg in args) + \
+              tuple(sorted((k, _hashable(v)) for k, v in kwargs.items()))
+        if key in self.cache:
+            return self.cache.get(key)
+        result = method(self, *args, **kwargs)
+        if isinstance(result, np.ndarray):
+            # Shared between callers, so must not be modified in place
+            result.flags.writeable = False
+        return self.cache.put(key, result)
+    wrapper.__name__ = method.__name__
+    wrapper.__doc__ = method.__doc__
+    return wrapper
+
+
+def _hashable(arg):
+    if isinstance(arg, (list, np.ndarray)):
+        return tuple(np.asarray(arg).tolist())
+    return arg
+
+
+class MiMARun:
+    """ A MiMA run directory, opened lazily. Levels can be given as integer model indices, in hPa
+    as a float (e.g. 10.) or as keys of MiMA_height_indices (e.g. '10hPa'); latitude bands as
+    (lat_min, lat_max) or keys of MiMA_lat_bands (e.g. 'equator', '60N'). Results are cached up
+    to cache_bytes and returned read-only. """
+    def __init__(self, rundir, filename='atmos_daily', cache_bytes=2**30, chunk_size=360):
+        self.rundir = rundir
+        self.filename = filename
+        self.chunk_size = chunk_size
+        self.dataset = open_run(rundir, filename)
+        self.lon = self.dataset['lon'][:]
+        self.lat = self.dataset['lat'][:]
+        self.pfull = self.dataset['pfull'][:]
+        self.time = self.dataset['time'][:]
+        self.cache = LRUCache(cache_bytes)
+
+    def __getitem__(self, varname):
+        return self.dataset[varname]
+
+    def close(self):
+        self.cache.clear()
+        self.dataset.close()
+
+    def level_index(self, level):
+        """ Returns model level index for an index, pressure (hPa) or '10hPa' style key, or a list """
+        if isinstance(level, (list, tuple, np.ndarray)):
+            return [self.level_index(lev) for lev in level]
+        if isinstance(level, (int, np.integer)):
+            return int(level)
+        return get_level_index(self.pfull, level)
+
+    def lat_slice(self, lat_band):
+        """ Returns slice of latitude indices for (lat_min, lat_max) or a MiMA_lat_bands key """
+        if lat_band is None:
+            return slice(None)
+        return get_lat_slice(self.lat, lat_band)
+
+    def read_many(self, varname, requests, verbose=False):
+        """ Reads a dict of {key: index} hyperslabs of varname together, so chunks shared by
+        several requests are only read once (see ReadPlanner). Results are not cached. """
+        return read_hyperslabs(self.dataset[varname], requests, verbose=verbose)
+
+    def _read(self, varname, level_inds, lat_inds, reduce, time_range=None):
+        """ Reads varname[t, level_inds, lat_inds] in time chunks and applies reduce to each """
+        variable = self.dataset[varname]
+        t_start, t_stop = (0, variable.shape[0]) if time_range is None else time_range
+        chunks = [reduce(variable[t0:t1, level_inds, lat_inds])
+                  for t0, t1 in iter_time_chunks(variable.shape[0], self.chunk_size, t_start, t_stop)]
+        return np.concatenate(chunks, axis=0)
+
+    @_memoized
+    def zonal_mean(self, varname, level=None, lat_band=None, time_range=None):
+        """ Zonal mean of varname, (time, pfull, lat), or (time, lat) for a single level, over the
+        given level(s), latitude band and (start, stop) time index range """
+        level_inds = slice(None) if level is None else self.level_index(level)
+        if varname + '_zonalmean' in self.dataset.variables:
+            # Transcoded run, see io_functions.transcode
+            return self._read(varname + '_zonalmean', level_inds, self.lat_slice(lat_band),
+                              np.asarray, time_range)
+        return self._read(varname, level_inds, self.lat_slice(lat_band),
+                          lambda chunk: chunk.mean(axis=-1), time_range)
+
+    @_memoized
+    def band_mean(self, varname, lat_band, level=None, time_range=None):
+        """ Zonal mean of varname averaged (cos lat weighted) over lat_band, (time, pfull), or
+        (time,) for a single level """
+        lat_inds = self.lat_slice(lat_band)
+        zonal_mean = self.zonal_mean(varname, level=level, lat_band=lat_band, time_range=time_range)
+        return mean_lat_weighted(zonal_mean, self.lat[lat_inds], axis=-1)
+
+    @_memoized
+    def time_mean(self, varname, level, time_range=None):
+        """ Time mean map of varname at level, (lat, lon) """
+        level_ind = self.level_index(level)
+        variable = self.dataset[varname]
+        t_start, t_stop = (0, variable.shape[0]) if time_range is None else time_range
+        total = np.zeros((len(self.lat), len(self.lon)))
+        for t0, t1 in iter_time_chunks(variable.shape[0], self.chunk_size, t_start, t_stop):
+            total += variable[t0:t1, level_ind].sum(axis=0)
+        return total / (t_stop - t_start)
@@ -0,0 +1,291 @@
+"""Virtual concatenation of the output files of a MiMA run that was restarted in segments. The
+segment files are found next to the usual atmos_daily.nc (atmos_daily_1.nc, 00020101.atmos_daily.nc)
+or in numbered restart directories (RESTART_1/atmos_daily.nc). Other subdirectories are not
+searched, so stray copies of atmos_daily.nc (backups, test subsets) are never taken for
+segments. The files are ordered by their first time and checked once to have the same
+coordinates and variables and a continuous 360 day time axis. MultiFileDataset then reads like a
+netCDF Dataset with one long time axis: indexing a variable only opens and reads the files the
+time indices fall in, nothing is copied to disk or loaded up front. If the run has been transcoded (io_functions.transcode) and is
+unchanged since, open_run opens the transcoded file instead. e.g.
+    dataset = open_run(rundir)          # netCDF Dataset if there is only one file
+    ucomp = dataset['ucomp']            # (time, pfull, lat, lon) over all segments
+    u10 = ucomp[:, 13].mean(axis=-1) """
+import os
+import glob
+import json
+from collections import OrderedDict
+
+import numpy as np
+import netCDF4 as nc
+
+from clim_functions.datetime360 import get_day_inds, parse_time_units
+
+# Where segment files of a run are looked for, e.g. atmos_daily.nc, atmos_daily_1.nc,
+# 00020101.atmos_daily.nc or RESTART_1/atmos_daily.nc (only restart style subdirectories)
+segment_patterns = ['{filename}.nc', '{filename}_[0-9]*.nc', '[0-9]*.{filename}.nc',
+                    'RESTART_[0-9]*/{filename}.nc']
+
+
+def find_segment_files(rundir, filename='atmos_daily'):
+    """ Returns sorted list of paths of all segment files of a run """
+    paths = set()
+    for pattern in segment_patterns:
+        paths.update(glob.glob(os.path.join(rundir, pattern.format(filename=filename))))
+    return sorted(paths)
+
+
+def transcoded_path(rundir, filename='atmos_daily'):
+    """ Path of the run transcoded for time series access, see io_functions.transcode """
+    return os.path.join(rundir, filename + '_ts.nc')
+
+
+def files_key(paths):
+    """ Returns name, size and mtime of each of paths as a JSON string, saved with products made
+    from them (e.g. the transcoded file) to tell whether they are up to date """
+    stats = [os.stat(path) for path in paths]
+    return json.dumps([[os.path.basename(path), stat.st_size, stat.st_mtime_ns] for path, stat in zip(paths, stats)])
+
+
+def find_transcoded(rundir, filename='atmos_daily'):
+    """ Returns path of the transcoded run if there is one made from the current segment files
+    with all their variables (or the segment files have been removed), otherwise None """
+    path = transcoded_path(rundir, filename)
+    if not os.path.exists(path):
+        return None
+    paths = find_segment_files(rundir, filename)
+    if paths:
+        with nc.Dataset(path, 'r') as dataset, nc.Dataset(paths[0], 'r') as first:
+            if getattr(dataset, 'source_files', None) != files_key(paths):
+                print("Ignoring {}, it is older than the run's {} files".format(path, filename))
+                return None
+            if set(first.variables) - set(dataset.variables):
+                print("Ignoring {}, it only has some of the variables".format(path))
+                return None
+    return path
+
+
+def get_run_files(rundir, filename='atmos_daily'):
+    """ Returns the segment files of a run, or the transcoded file if only that is left """
+    paths = find_segment_files(rundir, filename)
+    if not paths and os.path.exists(transcoded_path(rundir, filename)):
+        paths = [transcoded_path(rundir, filename)]
+    return paths
+
+
+def open_files(paths):
+    """ Opens one file as a netCDF Dataset, or several as a MultiFileDataset """
+    if isinstance(paths, str):
+        paths = [paths]
+    if len(paths) == 1:
+        return nc.Dataset(paths[0], 'r')
+    return MultiFileDataset(paths)
+
+
+def open_run(rundir, filename='atmos_daily', transcoded=True):
+    """ Opens all segment files of a run as one dataset, see find_segment_files, or the
+    transcoded copy of the run if it is up to date (unless transcoded=False) """
+    path = find_transcoded(rundir, filename) if transcoded else None
+    if path is not None:
+        return nc.Dataset(path, 'r')
+    paths = find_segment_files(rundir, filename)
+    if not paths:
+        raise FileNotFoundError("no {} files in {}".format(filename, rundir))
+    return open_files(paths)
+
+
+class MultiFileVariable:
+    """ A time dependent variable over all files of a MultiFileDataset. Supports the indexing of
+    netCDF variables on the time axis (int, slice, index list or boolean mask) followed by any
+    index of the other dimensions. """
+    def __init__(self, dataset, name, variable):
+        self.dataset = dataset
+        self.name = name
+        self.dimensions = variable.dimensions
+        self.dtype = variable.dtype
+        self.shape = (dataset.n_time,) + variable.shape[1:]
+        self.ndim = len(self.shape)
+        self._attributes = {attr: variable.getncattr(attr) for attr in variable.ncattrs()}
+        self._chunking = variable.chunking()
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getattr__(self, attr):
+        if attr.startswith('_') or attr not in self._attributes:
+            raise AttributeError(attr)
+        return self._attributes[attr]
+
+    def ncattrs(self):
+        return list(self._attributes)
+
+    def getncattr(self, attr):
+        return self._attributes[attr]
+
+    def chunking(self):
+        return self._chunking
+
+    def __array__(self, dtype=None):
+        return np.asarray(self[:], dtype=dtype)
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        if any(k is Ellipsis for k in key):
+            i = [k is Ellipsis for k in key].index(True)
+            key = key[:i] + (slice(None),) * (self.ndim - len(key) + 1) + key[i + 1:]
+        time_key, rest = (key[0] if key else slice(None)), key[1:]
+        n_time = self.shape[0]
+
+        if isinstance(time_key, (int, np.integer)):
+            t = int(time_key) + n_time if time_key < 0 else int(time_key)
+            if not 0 <= t < n_time:
+                raise IndexError("time index {} out of range for {} days".format(time_key, n_time))
+            i = self.dataset.file_of(t)
+            return self.dataset.read(i, self.name, (t - self.dataset.offsets[i],) + rest)
+
+        if isinstance(time_key, slice):
+            inds = np.arange(*time_key.indices(n_time))
+        else:
+            inds = np.asarray(time_key)
+            inds = np.flatnonzero(inds) if inds.dtype == bool else np.where(inds < 0, inds + n_time, inds)
+        if len(inds) and (inds.min() < 0 or inds.max() >= n_time):
+            raise IndexError("time indices out of range for {} days".format(n_time))
+        if len(inds) == 0:
+            return self.dataset.read(0, self.name, (slice(0, 0),) + rest)
+
+        # Read each file's part of the unique, sorted indices, then reorder if needed
+        unique, inverse = np.unique(inds, return_inverse=True)
+        file_inds = self.dataset.file_of(unique)
+        parts = []
+        for i in np.unique(file_inds):
+            local = unique[file_inds == i] - self.dataset.offsets[i]
+            parts.append(self.dataset.read(i, self.name, (_as_slice(local),) + rest))
+        concatenate = np.ma.concatenate if any(np.ma.isMaskedArray(p) for p in parts) else np.concatenate
+        data = parts[0] if len(parts) == 1 else concatenate(parts, axis=0)
+        if len(unique) != len(inds) or (unique != inds).any():
+            data = data[inverse.reshape(-1)]
+        return data
+
+
+def _as_slice(local):
+    """ Returns a sorted index array as a slice if it is evenly spaced, which netCDF reads faster """
+    if len(local) == 1:
+        return slice(int(local[0]), int(local[0]) + 1)
+    steps = np.diff(local)
+    if (steps == steps[0]).all():
+        return slice(int(local[0]), int(local[-1]) + 1, int(steps[0]))
+    return local
+
+
+class MultiFileDataset:
+    """ Several segment files of one run presented as one dataset with a continuous time axis.
+    Variables without a time dimension (lat, pfull, ...) come from the first file. At most max_open
+    files are kept open, the least recently used is closed when another one is needed. """
+    def __init__(self, paths, max_open=32, time_dim='time'):
+        self.max_open = max(max_open, 2)
+        self.time_dim = time_dim
+        self._handles = OrderedDict()
+        # Order the files by their first day, reading only the time coordinate
+        day_inds = {}
+        for path in paths:
+            with nc.Dataset(path, 'r') as dataset:
+                day_inds[path] = get_day_inds(dataset[time_dim])
+        self.paths = sorted(paths, key=lambda path: day_inds[path][0])
+        self.day_inds = [day_inds[path] for path in self.paths]
+        lengths = [len(days) for days in self.day_inds]
+        self.offsets = np.concatenate(([0], np.cumsum(lengths)))
+        self.n_time = int(self.offsets[-1])
+        self._validate()
+
+        first = self._open(0)
+        self.dimensions = OrderedDict((name, len(dim)) for name, dim in first.dimensions.items())
+        self.dimensions[time_dim] = self.n_time
+        self.variables = OrderedDict()
+        for name, variable in first.variables.items():
+            if name == time_dim:
+                self.variables[name] = _TimeVariable(self, variable)
+            elif variable.dimensions[:1] == (time_dim,):
+                self.variables[name] = MultiFileVariable(self, name, variable)
+            else:
+                self.variables[name] = variable
+
+    def _validate(self):
+        """ Checks that all files have the same coordinates and variables and that their time axes
+        join up without gaps or overlaps. Raises ValueError otherwise. """
+        with nc.Dataset(self.paths[0], 'r') as first:
+            reference = {name: (variable.dimensions, variable.shape[1:] if variable.dimensions[:1] == (self.time_dim,)
+                                else variable.shape) for name, variable in first.variables.items()}
+            coords = {name: first[name][:] for name in first.dimensions if name in first.variables and name != self.time_dim}
+        for i, path in enumerate(self.paths):
+            days = self.day_inds[i]
+            if len(days) > 1 and (np.diff(days) != 1).any():
+                raise ValueError("time axis of {} is not daily".format(path))
+            if i > 0 and days[0] != self.day_inds[i - 1][-1] + 1:
+                raise ValueError("{} does not continue from {} (day {} after day {})".format(
+                                 path, self.paths[i - 1], days[0], self.day_inds[i - 1][-1]))
+            if i == 0:
+                continue
+            with nc.Dataset(path, 'r') as dataset:
+                for name, (dims, shape) in reference.items():
+                    if name not in dataset.variables:
+                        raise ValueError("{} has no variable {}".format(path, name))
+                    variable = dataset[name]
+                    other = variable.shape[1:] if dims[:1] == (self.time_dim,) else variable.shape
+                    if variable.dimensions != dims or other != shape:
+                        raise ValueError("{} in {} has a different shape".format(name, path))
+                for name, values in coords.items():
+                    if not np.array_equal(dataset[name][:], values):
+                        raise ValueError("coordinate {} of {} differs from {}".format(name, path, self.paths[0]))
+
+    def _open(self, i):
+        """ Returns the open Dataset of file i, opening it (and closing the least recently used
+        file if too many are open) if needed """
+        if i in self._handles:
+            self._handles.move_to_end(i)
+            return self._handles[i]
+        if len(self._handles) >= self.max_open:
+            # The first file stays open, its variables are handed out directly
+            oldest = next(j for j in self._handles if j != 0)
+            self._handles.pop(oldest).close()
+        self._handles[i] = nc.Dataset(self.paths[i], 'r')
+        return self._handles[i]
+
+    def file_of(self, t):
+        """ Returns index of the file holding time index (or indices) t """
+        return np.searchsorted(self.offsets, t, side='right') - 1
+
+    def read(self, i, name, key):
+        return self._open(int(i))[name][key]
+
+    def __getitem__(self, name):
+        return self.variables[name]
+
+    def close(self):
+        for handle in self._handles.values():
+            handle.close()
+        self._handles.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class _TimeVariable(MultiFileVariable):
+    """ The time coordinate over all files, read once and converted to the units of the first file """
+    def __init__(self, dataset, variable):
+        super().__init__(dataset, variable.name, variable)
+        scale, reference = parse_time_units(variable.units)
+        parts = []
+        for path in dataset.paths:
+            with nc.Dataset(path, 'r') as file:
+                file_scale, file_reference = parse_time_units(file[self.name].units)
+                values = file[self.name][:]
+            if (file_scale, file_reference) != (scale, reference):
+                values = (file_reference + values * file_scale - reference) / scale
+            parts.append(values)
+        self._values = np.ma.concatenate(parts)
+
+    def __getitem__(self, key):
+        return self._values[key]
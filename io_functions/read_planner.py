@@ -0,0 +1,204 @@
+"""Read planner for netCDF hyperslabs. Declare every slice of a variable needed up front, then the
+planner merges them into a small set of boxes and reads each box once. Two boxes are merged when
+reading the chunk-aligned union touches no more chunks than reading them separately, so netCDF
+chunks are only read and decompressed once. With MiMA's one day chunks (1, pfull, lat, lon) this
+merges any requests over the same days into a box as large as the whole variable, so boxes are
+read in chunk-aligned blocks of days of at most max_box_bytes, and each request's part of a block
+is copied into its own preallocated array. e.g.
+    planner = ReadPlanner(dataset['ucomp'])
+    planner.add('u10', (slice(None), 13))                          # (time, lat, lon)
+    planner.add('u_eq', (slice(None), slice(None), slice(30, 34)))  # (time, pfull, 4, lon)
+    planner.add('u_60N', (slice(None), [13, 16, 17], slice(53, 55)))
+    data = planner.read()
+    u10 = data['u10'] """
+import numpy as np
+
+
+def _normalize(index, shape):
+    """ Returns index padded to len(shape) with one entry per dimension, each converted to a
+    (start, stop, local) triple where local indexes the box start:stop (int, slice or array) """
+    if not isinstance(index, tuple):
+        index = (index,)
+    if len(index) > len(shape):
+        raise IndexError("too many indices for variable of shape {}".format(shape))
+    index = index + (slice(None),) * (len(shape) - len(index))
+    dims = []
+    for ind, n in zip(index, shape):
+        if isinstance(ind, (int, np.integer)):
+            ind = int(ind) + n if ind < 0 else int(ind)
+            if not 0 <= ind < n:
+                raise IndexError("index {} out of range for dimension of size {}".format(ind, n))
+            dims.append((ind, ind + 1, 0))
+        elif isinstance(ind, slice):
+            start, stop, step = ind.indices(n)
+            if step < 0:
+                raise IndexError("negative steps are not supported")
+            stop = max(stop, start)
+            n_ind = len(range(start, stop, step))
+            stop = start + (n_ind - 1) * step + 1 if n_ind else start
+            dims.append((start, stop, slice(0, stop - start, step)))
+        else:
+            ind = np.asarray(ind, dtype=int)
+            ind = np.where(ind < 0, ind + n, ind)
+            if ind.ndim != 1 or ind.size == 0 or ind.min() < 0 or ind.max() >= n:
+                raise IndexError("index list must be 1-D, non-empty and within range")
+            dims.append((int(ind.min()), int(ind.max()) + 1, ind - ind.min()))
+    return dims
+
+
+def get_chunk_shape(variable):
+    """ Returns the netCDF chunk shape of variable. Contiguous variables are read row by row,
+    so are treated as chunked by single elements in all but the last dimension. """
+    chunking = variable.chunking() if hasattr(variable, 'chunking') else 'contiguous'
+    if chunking == 'contiguous' or chunking is None:
+        return tuple([1] * (len(variable.shape) - 1) + [variable.shape[-1]])
+    return tuple(chunking)
+
+
+def aligned_size(box, chunk_shape, shape):
+    """ Returns number of elements in the chunks touched by box, a list of (start, stop) """
+    size = 1
+    for (start, stop), c, n in zip(box, chunk_shape, shape):
+        size *= min(-(-stop // c) * c, n) - (start // c) * c
+    return size
+
+
+def box_size(box):
+    """ Returns number of elements in box, a list of (start, stop) """
+    return int(np.prod([stop - start for start, stop in box]))
+
+
+def _days(dim):
+    """ Returns the time indices of a normalized time index (start, stop, local), in order """
+    start, stop, ind = dim
+    if isinstance(ind, int):
+        return np.array([start + ind])
+    if isinstance(ind, slice):
+        return np.arange(start + ind.start, start + ind.stop, ind.step)
+    return start + ind
+
+
+def plan_boxes(boxes, chunk_shape, shape):
+    """ Greedily merges boxes, each a list of (start, stop) per dimension, while the chunk
+    aligned union of a pair is no larger than the pair read separately. Returns the merged boxes
+    and, for each input box, the index of the merged box that contains it. """
+    merged = [list(box) for box in boxes]
+    members = [[i] for i in range(len(boxes))]
+    merging = True
+    while merging:
+        merging = False
+        for i in range(len(merged)):
+            for j in range(i + 1, len(merged)):
+                union = [(min(a0, b0), max(a1, b1)) for (a0, a1), (b0, b1) in zip(merged[i], merged[j])]
+                if aligned_size(union, chunk_shape, shape) <= \
+                   aligned_size(merged[i], chunk_shape, shape) + aligned_size(merged[j], chunk_shape, shape):
+                    merged[i] = union
+                    members[i] += members.pop(j)
+                    merged.pop(j)
+                    merging = True
+                    break
+            if merging:
+                break
+    owner = np.zeros(len(boxes), dtype=int)
+    for k, inds in enumerate(members):
+        owner[inds] = k
+    return merged, owner
+
+
+class ReadPlanner:
+    """ Collects hyperslab requests on a netCDF variable (or anything with .shape and numpy style
+    slicing) and reads them with as few, chunk aligned, reads as possible. Each read is at most
+    max_box_bytes (default 64 MB), or one time chunk of the box if that is larger. """
+    def __init__(self, variable, max_box_bytes=2**26):
+        self.variable = variable
+        self.shape = tuple(variable.shape)
+        self.chunk_shape = get_chunk_shape(variable)
+        self.max_box_bytes = max_box_bytes
+        self.requests = {}
+
+    def add(self, key, index):
+        """ Adds a request for variable[index]. index may contain ints, slices with positive steps
+        and lists of indices, one per dimension (trailing dimensions default to the full range) """
+        self.requests[key] = (index, _normalize(index, self.shape))
+
+    def plan(self):
+        """ Returns the merged boxes and the box index of each request """
+        boxes = [[(start, stop) for start, stop, _ in dims] for _, dims in self.requests.values()]
+        return plan_boxes(boxes, self.chunk_shape, self.shape)
+
+    def read(self, verbose=False):
+        """ Reads each planned box once and returns a dict of arrays per request key """
+        boxes, owner = self.plan()
+        if verbose:
+            naive = sum(aligned_size([(d[0], d[1]) for d in dims], self.chunk_shape, self.shape)
+                        for _, dims in self.requests.values())
+            merged = sum(aligned_size(box, self.chunk_shape, self.shape) for box in boxes)
+            print("{} requests read as {} boxes, {} chunk elements instead of {}".format(
+                  len(self.requests), len(boxes), merged, naive))
+        requests = list(self.requests.items())
+        results = {key: None for key in self.requests}
+        for k, box in enumerate(boxes):
+            members = [requests[i] for i in np.flatnonzero(owner == k)]
+            # Days of each request (in output order) and the box indices of the other dimensions
+            days = {key: _days(dims[0]) for key, (_, dims) in members}
+            for t0, t1 in self.time_blocks(box):
+                data = self.variable[(slice(t0, t1),) + tuple(slice(start, stop) for start, stop in box[1:])]
+                for key, (_, dims) in members:
+                    inds = np.flatnonzero((days[key] >= t0) & (days[key] < t1))
+                    if len(inds) == 0:
+                        continue
+                    local = [days[key][inds] - t0]
+                    for (start, stop, ind), (box_start, _) in zip(dims[1:], box[1:]):
+                        offset = start - box_start
+                        if isinstance(ind, int):
+                            local.append(offset)
+                        elif isinstance(ind, slice):
+                            local.append(slice(ind.start + offset, ind.stop + offset, ind.step))
+                        else:
+                            local.append(ind + offset)
+                    part = _take(data, local)
+                    if results[key] is None:
+                        empty = np.ma.empty if np.ma.isMaskedArray(part) else np.empty
+                        results[key] = empty((len(days[key]),) + part.shape[1:], dtype=part.dtype)
+                    elif np.ma.isMaskedArray(part) and not np.ma.isMaskedArray(results[key]):
+                        results[key] = np.ma.asarray(results[key])
+                    results[key][inds] = part
+                del data
+        # An int time index drops the time axis
+        return {key: results[key][0] if isinstance(dims[0][2], int) else results[key]
+                for key, (_, dims) in requests}
+
+    def time_blocks(self, box):
+        """ Returns (t0, t1) blocks of the days of box, starting on time chunk boundaries, each of
+        at most max_box_bytes or one time chunk """
+        (start, stop), chunk = box[0], self.chunk_shape[0]
+        n_days = stop - start
+        if self.max_box_bytes is not None:
+            day_bytes = box_size(box[1:]) * np.dtype(self.variable.dtype).itemsize
+            n_days = max(chunk, self.max_box_bytes // max(day_bytes, 1) // chunk * chunk)
+        edges = np.arange(start // chunk * chunk, stop, n_days)[1:]
+        edges = [start] + [int(edge) for edge in edges] + [stop]
+        return list(zip(edges[:-1], edges[1:]))
+
+
+def _take(array, local):
+    """ Indexes array with one entry per dimension, applying lists of indices one axis at a time
+    (outer indexing, as netCDF4 does) rather than numpy's broadcast fancy indexing """
+    basic = tuple(ind if not isinstance(ind, np.ndarray) else slice(None) for ind in local)
+    result = array[basic]
+    axis = 0
+    for ind in local:
+        if isinstance(ind, int):
+            continue
+        if isinstance(ind, np.ndarray):
+            result = np.take(result, ind, axis=axis)
+        axis += 1
+    return result
+
+
+def read_hyperslabs(variable, requests, verbose=False, max_box_bytes=2**26):
+    """ Reads a dict of {key: index} requests on variable with a ReadPlanner """
+    planner = ReadPlanner(variable, max_box_bytes)
+    for key, index in requests.items():
+        planner.add(key, index)
+    return planner.read(verbose=verbose)
@@ -0,0 +1,212 @@
+"""Sharded version of stream_reduce for Slurm job arrays. The time axis of a run is split into
+n_segments segments on stream_reduce's chunk boundaries. Each array task (or local process)
+reduces one segment and writes the partial sums of each of its chunks to
+rundir/SHARDS/<filename>_seg<i>_of<n>.npz. The merge step then adds the partials up chunk by chunk
+in time order, exactly as stream_reduce does in one process, so the merged products are
+identical to stream_reduce(dataset). Run as main from parent directory, e.g.
+    python -m io_functions.shard_reduce $RUNDIR --segments 16 --segment $SLURM_ARRAY_TASK_ID
+    python -m io_functions.shard_reduce $RUNDIR --segments 16 --merge
+or all segments in a local process pool
+    python -m io_functions.shard_reduce $RUNDIR --segments 16 --local --workers 4
+The SavePlots scripts pick up merged products with load_sharded_products. """
+import os
+import glob
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from io_functions.stream_reduce import iter_time_chunks, resolve_inds, reduce_chunk, combine_partials
+from io_functions.zonal_cache import source_key
+from io_functions.multifile import get_run_files, open_run
+from io_functions.instrument import instrumented
+
+series_keys = ['u_equator', 'u10at60', 'gwdu_equator', 'gwdu_60N']
+
+
+def shard_dir(rundir):
+    return os.path.join(rundir, 'SHARDS')
+
+
+def segment_path(rundir, segment, n_segments, filename='atmos_daily'):
+    return os.path.join(shard_dir(rundir), '{}_seg{:03d}_of{:03d}.npz'.format(filename, segment, n_segments))
+
+
+def products_path(rundir, filename='atmos_daily'):
+    return os.path.join(shard_dir(rundir), '{}_products.npz'.format(filename))
+
+
+def get_segment_chunks(n_time, n_segments, chunk_size=90):
+    """ Returns list of the (t0, t1) chunks of each segment, splitting the chunks of
+    iter_time_chunks as evenly as possible between n_segments """
+    chunks = list(iter_time_chunks(n_time, chunk_size))
+    if n_segments > len(chunks):
+        raise ValueError("{} segments for only {} chunks of {} days".format(n_segments, len(chunks), chunk_size))
+    return [[chunks[i] for i in inds] for inds in np.array_split(np.arange(len(chunks)), n_segments)]
+
+
+def _meta(dataset, source, chunk_size, n_segments, inds, gwd):
+    """ Metadata saved with each segment, which must agree between segments to merge them """
+    key = source_key(source, 'ucomp')
+    return {'size': key['size'], 'mtime_ns': key['mtime_ns'], 'n_time': dataset['ucomp'].shape[0],
+            'chunk_size': chunk_size, 'n_segments': n_segments, 'gwd': gwd,
+            'eq_inds': [inds['eq_inds'].start, inds['eq_inds'].stop],
+            'polar_inds': [inds['polar_inds'].start, inds['polar_inds'].stop],
+            'u_level': inds['u_level'], 'gwd_level': inds['gwd_level']}
+
+
+@instrumented
+def reduce_segment(rundir, segment, n_segments, filename='atmos_daily', chunk_size=90, gwd=True):
+    """ Reduces segment (0 to n_segments-1) of the run and saves the partial sums of each chunk
+    and the segment's part of the time series. Returns path to the saved partials. """
+    source = get_run_files(rundir, filename)
+    os.makedirs(shard_dir(rundir), exist_ok=True)
+    with open_run(rundir, filename) as dataset:
+        inds = resolve_inds(dataset)
+        meta = _meta(dataset, source, chunk_size, n_segments, inds, gwd)
+        chunks = get_segment_chunks(meta['n_time'], n_segments, chunk_size)[segment]
+        partials = []
+        for t0, t1 in chunks:
+            partials.append(reduce_chunk(dataset, t0, t1, inds, gwd=gwd))
+            print("Segment {}: reduced days {} to {}".format(segment, t0, t1))
+
+    # Sums are kept per chunk (stacked on axis 0) so the merge can add them in the original order
+    arrays = {}
+    for key in partials[0]:
+        if key in series_keys:
+            arrays[key] = np.concatenate([partial[key] for partial in partials], axis=0)
+        else:
+            arrays[key] = np.stack([partial[key] for partial in partials])
+    meta['segment'] = segment
+    meta['chunks'] = chunks
+    save_as = segment_path(rundir, segment, n_segments, filename)
+    with open(save_as + '.tmp', 'wb') as f:
+        np.savez(f, meta=json.dumps(meta), **arrays)
+    os.replace(save_as + '.tmp', save_as)
+    print("Segment {} of {} saved as {}".format(segment, n_segments, save_as))
+    return save_as
+
+
+def _segment_partials(segments):
+    """ Yields per chunk partial dicts from loaded segments, in time order """
+    for arrays in segments:
+        n_chunks = arrays['ubar_sum'].shape[0]
+        for j in range(n_chunks):
+            partial = {key: arrays[key][j] for key in arrays if key not in series_keys}
+            if j == 0:
+                partial.update({key: arrays[key] for key in series_keys if key in arrays})
+            yield partial
+
+
+@instrumented
+def merge_segments(rundir, n_segments, filename='atmos_daily', save=True):
+    """ Merges the partials of all n_segments segments into the products of stream_reduce.
+    Raises ValueError if a segment is missing or was made from a different file or setup. """
+    source = get_run_files(rundir, filename)
+    key = source_key(source, 'ucomp')
+    segments, metas = [], []
+    for segment in range(n_segments):
+        path = segment_path(rundir, segment, n_segments, filename)
+        if not os.path.exists(path):
+            raise ValueError("segment {} of {} is missing: {}".format(segment, n_segments, path))
+        with np.load(path) as data:
+            meta = json.loads(str(data['meta']))
+            segments.append({name: data[name] for name in data.files if name != 'meta'})
+        if (meta['size'], meta['mtime_ns']) != (key['size'], key['mtime_ns']):
+            raise ValueError("segment {} was made from an older version of {}".format(segment, key['source']))
+        metas.append(meta)
+    shared = ['n_time', 'chunk_size', 'gwd', 'eq_inds', 'polar_inds', 'u_level', 'gwd_level']
+    if any(meta[k] != metas[0][k] for meta in metas for k in shared):
+        raise ValueError("segments were reduced with different settings")
+
+    products = combine_partials(_segment_partials(segments), metas[0]['n_time'], metas[0]['gwd_level'])
+    if save:
+        save_products(products, rundir, filename, key)
+    return products
+
+
+def save_products(products, rundir, filename, key):
+    """ Saves merged products with the source key they were made from """
+    arrays = {name: value for name, value in products.items() if name != 'ubar_seasonal'}
+    arrays.update({'ubar_seasonal_' + season: value for season, value in products['ubar_seasonal'].items()})
+    save_as = products_path(rundir, filename)
+    with open(save_as + '.tmp', 'wb') as f:
+        np.savez(f, key=json.dumps(key), **arrays)
+    os.replace(save_as + '.tmp', save_as)
+    print("Merged products saved as ", save_as)
+
+
+def load_sharded_products(rundir, filename='atmos_daily', gwd=True):
+    """ Returns the products of a sharded reduction of the run if there is one for the current
+    file: the saved merged products, or a merge of a complete set of segments. With gwd=True (as
+    the SavePlots scripts need) products reduced with gwd=False are not used. Otherwise None,
+    e.g. products = load_sharded_products(rundir) or stream_reduce(dataset) """
+    source = get_run_files(rundir, filename)
+    key = source_key(source, 'ucomp')
+    path = products_path(rundir, filename)
+    if os.path.exists(path):
+        with np.load(path) as data:
+            if gwd and 'gwd_u_map' not in data.files:
+                print("Not using {}, it was reduced without GW drag".format(path))
+            elif json.loads(str(data['key'])) == key:
+                products = {name: data[name] for name in data.files if name != 'key'}
+                products['ubar_seasonal'] = {name[len('ubar_seasonal_'):]: products.pop(name)
+                                             for name in list(products) if name.startswith('ubar_seasonal_')}
+                if 'gwd_level' in products:
+                    products['gwd_level'] = int(products['gwd_level'])
+                print("Loaded merged products from ", path)
+                return products
+    # Otherwise merge the largest complete set of segments, if any
+    pattern = os.path.join(shard_dir(rundir), '{}_seg*_of*.npz'.format(filename))
+    n_options = sorted(set(int(path[-7:-4]) for path in glob.glob(pattern)), reverse=True)
+    for n_segments in n_options:
+        try:
+            products = merge_segments(rundir, n_segments, filename)
+        except ValueError as e:
+            print("Not using {} segments: {}".format(n_segments, e))
+            continue
+        if gwd and 'gwd_u_map' not in products:
+            print("Not using {} segments: they were reduced without GW drag".format(n_segments))
+            continue
+        return products
+    return None
+
+
+def _reduce_segment_task(args):
+    return reduce_segment(*args)
+
+
+def sharded_reduce(rundir, n_segments, n_workers=None, filename='atmos_daily', chunk_size=90, gwd=True):
+    """ Reduces all segments in a local pool of n_workers processes and merges them, the
+    same as a Slurm array followed by the merge. Returns the products. """
+    tasks = [(rundir, segment, n_segments, filename, chunk_size, gwd) for segment in range(n_segments)]
+    with ProcessPoolExecutor(n_workers) as pool:
+        list(pool.map(_reduce_segment_task, tasks))
+    return merge_segments(rundir, n_segments, filename)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Sharded single pass reduction of a MiMA run')
+    parser.add_argument('rundir')
+    parser.add_argument('--segments', type=int, required=True, help='number of time segments')
+    parser.add_argument('--segment', type=int, default=None, help='segment to reduce, e.g. $SLURM_ARRAY_TASK_ID')
+    parser.add_argument('--merge', action='store_true', help='merge all segments')
+    parser.add_argument('--local', action='store_true', help='reduce all segments in a process pool and merge')
+    parser.add_argument('--workers', type=int, default=None, help='processes for --local, default all cores')
+    parser.add_argument('--filename', default='atmos_daily')
+    parser.add_argument('--chunk-size', type=int, default=90)
+    args = parser.parse_args()
+
+    if args.local:
+        sharded_reduce(args.rundir, args.segments, args.workers, args.filename, args.chunk_size)
+    elif args.merge:
+        merge_segments(args.rundir, args.segments, args.filename)
+    elif args.segment is not None:
+        reduce_segment(args.rundir, args.segment, args.segments, args.filename, args.chunk_size)
+    else:
+        parser.error("give --segment, --merge or --local")
+
+
+if __name__ == '__main__':
+    main()
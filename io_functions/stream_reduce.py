@@ -0,0 +1,150 @@
+"""Single pass streaming reduction of atmos_daily.nc. The time axis is walked once in chunks of
+chunk_size days and every product needed by the SavePlots scripts is accumulated on the way,
+so peak memory is a couple of chunks of the 4-D fields rather than the whole variable. """
+import numpy as np
+
+from clim_functions.mean_lat_weighted import mean_lat_weighted
+from clim_functions.seasons import seasons, get_season_of_day
+from clim_functions.MiMA_height_indices import get_level_index, get_lat_slice
+from io_functions.instrument import instrumented
+
+
+def iter_time_chunks(n_time, chunk_size=90, t_start=0, t_stop=None):
+    """ Yields (t0, t1) index pairs covering t_start:t_stop in blocks of chunk_size days. """
+    if t_stop is None:
+        t_stop = n_time
+    for t0 in range(t_start, t_stop, chunk_size):
+        yield t0, min(t0 + chunk_size, t_stop)
+
+
+def _level_index(pfull, level):
+    """ Integer levels are model indices, anything else is resolved from pfull """
+    if isinstance(level, (int, np.integer)):
+        return int(level)
+    return get_level_index(pfull, level)
+
+
+def _lat_inds(lat, lat_band):
+    """ Slices are latitude indices, anything else is a band resolved from lat """
+    if isinstance(lat_band, slice):
+        return lat_band
+    return get_lat_slice(lat, lat_band)
+
+
+def resolve_inds(dataset, eq_inds='equator', polar_inds='60N', u_level='10hPa', gwd_level='100hPa'):
+    """ Returns dict of the latitude slices and level indices used by stream_reduce """
+    lat = dataset['lat'][:]
+    pfull = dataset['pfull'][:]
+    return {'eq_inds': _lat_inds(lat, eq_inds), 'polar_inds': _lat_inds(lat, polar_inds),
+            'u_level': _level_index(pfull, u_level), 'gwd_level': _level_index(pfull, gwd_level)}
+
+
+def zonal_mean_chunk(dataset, varname, t0, t1):
+    """ Zonal mean of varname[t0:t1], read from the precomputed zonal means of a transcoded run
+    if there are any (see io_functions.transcode) """
+    zonal_name = varname + '_zonalmean'
+    if zonal_name in dataset.variables:
+        return dataset[zonal_name][t0:t1]
+    return dataset[varname][t0:t1].mean(axis=-1)
+
+
+def reduce_chunk(dataset, t0, t1, inds, gwd=True):
+    """ Returns the partial products of days t0:t1 (sums over the chunk for the means, and the
+    chunk's part of the time series), see stream_reduce. inds is from resolve_inds. """
+    lat = dataset['lat'][:]
+    eq_inds, polar_inds = inds['eq_inds'], inds['polar_inds']
+    # Zonal mean of this chunk, (t1-t0, pfull, lat)
+    ubar = zonal_mean_chunk(dataset, 'ucomp', t0, t1)
+    partial = {'ubar_sum': ubar.sum(axis=0),
+               'ubar_seasonal_sum': np.zeros((len(seasons),) + ubar.shape[1:]),
+               'seasonal_counts': np.zeros(len(seasons), dtype=int)}
+    season_of_day = get_season_of_day(np.arange(t0, t1))
+    for i in range(len(seasons)):
+        in_season = (season_of_day == i)
+        if in_season.any():
+            partial['ubar_seasonal_sum'][i] = ubar[in_season].sum(axis=0)
+            partial['seasonal_counts'][i] = in_season.sum()
+    partial['u_equator'] = mean_lat_weighted(ubar[:, :, eq_inds], lat[eq_inds], axis=-1)
+    partial['u10at60'] = mean_lat_weighted(ubar[:, inds['u_level'], polar_inds], lat[polar_inds], axis=-1)
+    del ubar
+
+    if gwd:
+        if 'gwfu_cgwd_zonalmean' in dataset.variables:
+            # Transcoded run: read the one level and the stored zonal mean
+            partial['gwd_u_sum'] = dataset['gwfu_cgwd'][t0:t1, inds['gwd_level']].sum(axis=0)
+            gwdu_bar = dataset['gwfu_cgwd_zonalmean'][t0:t1]
+        else:
+            # Otherwise read the full field once for both
+            gwfu = dataset['gwfu_cgwd'][t0:t1]
+            partial['gwd_u_sum'] = gwfu[:, inds['gwd_level']].sum(axis=0)
+            gwdu_bar = gwfu.mean(axis=-1)
+            del gwfu
+        partial['gwdu_equator'] = mean_lat_weighted(gwdu_bar[:, :, eq_inds], lat[eq_inds], axis=-1)
+        partial['gwdu_60N'] = mean_lat_weighted(gwdu_bar[:, :, polar_inds], lat[polar_inds], axis=-1)
+        partial['gwd_v_sum'] = dataset['gwfv_cgwd'][t0:t1, inds['gwd_level']].sum(axis=0)
+    return partial
+
+
+def combine_partials(partials, n_time, gwd_level=None):
+    """ Combines partial products of consecutive chunks, in time order, into the products of
+    stream_reduce. Sums are accumulated chunk by chunk in order, so the result does not depend on
+    how the chunks were shared out between processes. """
+    sums = {}
+    series = {}
+    for partial in partials:
+        for key, value in partial.items():
+            if key in ('u_equator', 'u10at60', 'gwdu_equator', 'gwdu_60N'):
+                series.setdefault(key, []).append(value)
+            else:
+                if key not in sums:
+                    # Float sums are accumulated in float64 (counts stay int)
+                    dtype = np.asarray(value).dtype
+                    sums[key] = np.zeros(np.shape(value), dtype=np.float64 if dtype.kind == 'f' else dtype)
+                sums[key] += value
+    series = {key: np.concatenate(values, axis=0) for key, values in series.items()}
+    if len(series['u10at60']) != n_time:
+        raise ValueError("partials cover {} days, expected {}".format(len(series['u10at60']), n_time))
+
+    counts = sums['seasonal_counts']
+    products = {'ubar_annual': sums['ubar_sum'] / n_time,
+                'ubar_seasonal': {seasons[i]: sums['ubar_seasonal_sum'][i] / counts[i]
+                                  for i in range(len(seasons)) if counts[i] > 0},
+                'u_equator': series['u_equator'],
+                'u10at60': series['u10at60']}
+    if 'gwd_u_sum' in sums:
+        products.update({'gwdu_equator': series['gwdu_equator'],
+                         'gwdu_60N': series['gwdu_60N'],
+                         'gwd_u_map': sums['gwd_u_sum'] / n_time,
+                         'gwd_v_map': sums['gwd_v_sum'] / n_time,
+                         'gwd_level': gwd_level})
+    return products
+
+
+@instrumented
+def stream_reduce(dataset, chunk_size=90, eq_inds='equator', polar_inds='60N',
+                  u_level='10hPa', gwd_level='100hPa', gwd=True):
+    """ Reads ucomp (and gwfu_cgwd, gwfv_cgwd if gwd=True) from an open atmos_daily dataset in
+    a single pass over time and returns a dict of products:
+        ubar_annual   (pfull, lat)  annual mean zonal mean zonal wind
+        ubar_seasonal dict of (pfull, lat) zonal means for 'DJF', 'MAM', 'JJA', 'SON'
+        u_equator     (time, pfull) zonal mean u, lat weighted over eq_inds (default 4S-4N)
+        u10at60       (time,)       zonal mean u at u_level (10hPa), lat weighted over polar_inds (60N)
+    and if gwd=True
+        gwdu_equator  (time, pfull) zonal mean gwfu_cgwd over eq_inds
+        gwdu_60N      (time, pfull) zonal mean gwfu_cgwd over polar_inds
+        gwd_u_map     (lat, lon)    time mean gwfu_cgwd at gwd_level (100hPa)
+        gwd_v_map     (lat, lon)    time mean gwfv_cgwd at gwd_level
+        gwd_level     index of the gwd level
+    Latitudes can be slices of indices or bands (see MiMA_lat_bands) and levels indices or
+    pressures (see get_level_index), so the defaults pick the same points at T42 and T62.
+    Time series are assumed to start in Jan, as in get_seasonal_inds. 
+    The time axis can also be split between processes, see io_functions.shard_reduce. """
+    inds = resolve_inds(dataset, eq_inds, polar_inds, u_level, gwd_level)
+    n_time = dataset['ucomp'].shape[0]
+
+    def partials():
+        for t0, t1 in iter_time_chunks(n_time, chunk_size):
+            yield reduce_chunk(dataset, t0, t1, inds, gwd=gwd)
+            print("Reduced days {} to {} of {}".format(t0, t1, n_time))
+
+    return combine_partials(partials(), n_time, inds['gwd_level'])
@@ -0,0 +1,136 @@
+"""Transcodes a MiMA run into a layout for time series access. MiMA writes one time step per
+record, so e.g. a 10 hPa, 60N time series touches every record of atmos_daily.nc. The transcoded
+file rundir/<filename>_ts.nc stores every variable as compressed float32 in chunks of
+time_chunk days (default 90, the chunk size stream_reduce reads) x 1 level x a quarter of the
+latitudes x all longitudes, so a time series at a few levels or latitudes reads a handful of
+chunks, while a full map of one day needs n_levels x 4 chunks. Zonal means (time, pfull, lat) of the 4-D variables are stored as well
+(<varname>_zonalmean), which stream_reduce, MiMARun and the zonal mean cache read instead of
+averaging the full field. open_run uses the transcoded file as long as the run's own files have
+not changed since (or have been deleted to save scratch space). Run as main from parent
+directory, e.g.
+    python -m io_functions.transcode $RUNDIR
+    python -m io_functions.transcode $RUNDIR --variables ucomp gwfu_cgwd --no-zonal-means """
+import os
+import argparse
+
+import numpy as np
+import netCDF4 as nc
+
+from io_functions.multifile import find_segment_files, open_files, transcoded_path, files_key
+from io_functions.stream_reduce import iter_time_chunks
+from io_functions.instrument import instrumented
+
+
+def get_chunk_shape(shape, time_chunk=90, n_lat_chunks=4):
+    """ Returns chunk shape for a (time, ...) variable: time_chunk days, and for 4-D variables
+    1 level and 1/n_lat_chunks of the latitudes, everything else whole """
+    chunks = [min(time_chunk, shape[0])] + list(shape[1:])
+    if len(shape) == 4:
+        chunks[1] = 1
+        chunks[2] = -(-shape[2] // n_lat_chunks)
+    return tuple(max(c, 1) for c in chunks)
+
+
+def _output_dtype(variable):
+    """ Floating point fields are stored as float32, 1-D variables (e.g. time bounds) as they are """
+    if np.issubdtype(variable.dtype, np.floating) and len(variable.shape) > 1:
+        return np.float32
+    return variable.dtype
+
+
+def _create_like(output, variable, name, dtype, dimensions=None, chunks=None, complevel=4, long_name=None,
+                 significant_digits=None):
+    """ Creates variable name in output with the attributes of variable, compressed if chunked """
+    attrs = {attr: variable.getncattr(attr) for attr in variable.ncattrs() if attr != '_FillValue'}
+    if long_name is not None:
+        attrs['long_name'] = long_name
+    new = output.createVariable(name, dtype, variable.dimensions if dimensions is None else dimensions,
+                                zlib=chunks is not None, complevel=complevel, shuffle=True,
+                                chunksizes=chunks, fill_value=getattr(variable, '_FillValue', None),
+                                significant_digits=significant_digits)
+    new.setncatts(attrs)
+    return new
+
+
+@instrumented
+def transcode_run(rundir, filename='atmos_daily', varnames=None, zonal_means=True, time_chunk=90,
+                  complevel=4, significant_digits=None, max_block_bytes=2**28):
+    """ Writes the run (all its segment files) to rundir/<filename>_ts.nc, see module docstring.
+    varnames selects time dependent variables (default all), and blocks of at most
+    max_block_bytes are read at a time. Storage is lossless float32 unless significant_digits is
+    given, which quantizes fields to that many significant digits so they compress much better.
+    Returns path to the transcoded file. """
+    paths = find_segment_files(rundir, filename)
+    if not paths:
+        raise FileNotFoundError("no {} files in {}".format(filename, rundir))
+    save_as = transcoded_path(rundir, filename)
+    tmp_file = save_as + '.tmp'
+    with open_files(paths) as source, nc.Dataset(tmp_file, 'w', format='NETCDF4') as output:
+        n_time = source['time'].shape[0]
+        for name, dim in source.dimensions.items():
+            # netCDF Dimensions, or sizes for a MultiFileDataset
+            output.createDimension(name, None if name == 'time' else (dim if isinstance(dim, int) else len(dim)))
+        output.setncattr('source_files', files_key(paths))
+
+        # Coordinates and small variables are copied whole
+        if varnames is None:
+            varnames = [name for name, variable in source.variables.items()
+                        if variable.dimensions[:1] == ('time',) and name not in source.dimensions]
+        for name, variable in source.variables.items():
+            if name in varnames:
+                continue
+            if name in source.dimensions or variable.dimensions[:1] != ('time',):
+                _create_like(output, variable, name, variable.dtype)[:] = variable[:]
+
+        for name in varnames:
+            variable = source[name]
+            shape = variable.shape
+            chunks = get_chunk_shape(shape, time_chunk)
+            dtype = _output_dtype(variable)
+            digits = significant_digits if dtype == np.float32 else None
+            out = _create_like(output, variable, name, dtype, chunks=chunks, complevel=complevel,
+                               significant_digits=digits)
+            zonal = None
+            if zonal_means and len(shape) == 4:
+                zonal = _create_like(output, variable, name + '_zonalmean', np.float32, variable.dimensions[:-1],
+                                     chunks[:2] + (shape[2],), complevel,
+                                     long_name=getattr(variable, 'long_name', name) + ' (zonal mean)',
+                                     significant_digits=significant_digits)
+            # Blocks of time_chunk days and as many levels as fit, so each chunk is written whole
+            bytes_per_level = time_chunk * int(np.prod(shape[2:])) * 4
+            n_levels = max(1, max_block_bytes // bytes_per_level) if len(shape) == 4 else None
+            for t0, t1 in iter_time_chunks(n_time, time_chunk):
+                if n_levels is None:
+                    out[t0:t1] = variable[t0:t1]
+                    continue
+                for l0 in range(0, shape[1], n_levels):
+                    l1 = min(l0 + n_levels, shape[1])
+                    block = variable[t0:t1, l0:l1]
+                    out[t0:t1, l0:l1] = block
+                    if zonal is not None:
+                        zonal[t0:t1, l0:l1] = block.mean(axis=-1)
+            print("Transcoded {} {}".format(name, shape))
+    os.replace(tmp_file, save_as)
+    source_size = sum(os.path.getsize(path) for path in paths)
+    print("Saved as {} ({:.2f} GB, source {:.2f} GB)".format(save_as, os.path.getsize(save_as) / 1e9,
+                                                           source_size / 1e9))
+    return save_as
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Transcode a MiMA run for time series access')
+    parser.add_argument('rundir')
+    parser.add_argument('--filename', default='atmos_daily')
+    parser.add_argument('--variables', nargs='+', default=None, help='default all time dependent variables')
+    parser.add_argument('--no-zonal-means', action='store_true', help='do not store zonal means')
+    parser.add_argument('--time-chunk', type=int, default=90, help='days per chunk')
+    parser.add_argument('--complevel', type=int, default=4)
+    parser.add_argument('--significant-digits', type=int, default=None,
+                        help='quantize fields to this many significant digits (lossy), default lossless')
+    args = parser.parse_args()
+    transcode_run(args.rundir, args.filename, args.variables, not args.no_zonal_means,
+                  args.time_chunk, args.complevel, args.significant_digits)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""On-disk cache of zonal mean fields. The zonal mean (time, pfull, lat) of a 4-D variable in
+atmos_daily.nc is written to rundir/CACHE/ (next to PLOTS/) as a .npy file, together with a small
+.json key recording the size and mtime of the source file and the variable name. The cache is
+only rebuilt when the key no longer matches, so later sessions load a few MB instead of scanning
+the full netCDF file. e.g.
+    ubar = get_zonal_mean(rundir, 'ucomp')
+    u_zonal = mean_lat_weighted(ubar[:, :, 30:34], lat[30:34], axis=-1) """
+import os
+import json
+
+import numpy as np
+
+from io_functions.stream_reduce import iter_time_chunks
+from io_functions.multifile import get_run_files, find_transcoded, open_files
+from io_functions.instrument import instrumented
+
+
+def source_key(source, varname):
+    """ Returns the key used to check whether a cached product is still valid for source, a
+    file or a list of the segment files of a run (see io_functions.multifile) """
+    if isinstance(source, str):
+        source = [source]
+    stats = [os.stat(path) for path in source]
+    return {'source': ','.join(os.path.basename(path) for path in source),
+            'size': sum(stat.st_size for stat in stats),
+            'mtime_ns': max(stat.st_mtime_ns for stat in stats), 'variable': varname}
+
+
+def cache_paths(rundir, varname, filename='atmos_daily'):
+    """ Returns paths of the cached array and its key for varname """
+    cache_file = os.path.join(rundir, 'CACHE', '{}_{}_zonalmean.npy'.format(filename, varname))
+    return cache_file, cache_file[:-len('.npy')] + '.json'
+
+
+def build_zonal_mean(source, varname, cache_file, chunk_size=90):
+    """ Streams varname from source in time chunks, writing its zonal mean straight into a
+    .npy memmap so that the full 4-D field is never held in memory """
+    with open_files(source) as dataset:
+        variable = dataset[varname]
+        n_time = variable.shape[0]
+        shape = variable.shape[:-1]
+        zonal_name = varname + '_zonalmean'
+        if zonal_name in dataset.variables:
+            variable = dataset[zonal_name]
+        tmp_file = cache_file + '.tmp.npy'
+        zonal_mean = np.lib.format.open_memmap(tmp_file, mode='w+', dtype=variable.dtype,
+                                               shape=shape)
+        for t0, t1 in iter_time_chunks(n_time, chunk_size):
+            chunk = variable[t0:t1]
+            zonal_mean[t0:t1] = chunk if variable.name == zonal_name else chunk.mean(axis=-1)
+        zonal_mean.flush()
+        del zonal_mean
+    os.replace(tmp_file, cache_file)
+
+
+@instrumented
+def get_zonal_mean(rundir, varname, filename='atmos_daily', chunk_size=90, mmap=True):
+    """ Returns the zonal mean (time, pfull, lat) of varname from rundir/filename.nc (or all
+    segment files of the run, see io_functions.multifile), building
+    or rebuilding the cache in rundir/CACHE/ if the source file has changed since it was written.
+    With mmap=True (default) the cached array is memory mapped read-only, so slicing e.g. a
+    single level only reads that part from disk. """
+    source = get_run_files(rundir, filename)
+    cache_file, key_file = cache_paths(rundir, varname, filename)
+    key = source_key(source, varname)
+
+    if os.path.exists(cache_file) and os.path.exists(key_file):
+        with open(key_file) as f:
+            cached_key = json.load(f)
+        if cached_key == key:
+            return np.load(cache_file, mmap_mode='r' if mmap else None)
+        print("Source changed, rebuilding ", cache_file)
+
+    os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+    # Remove the old key first so an interrupted rebuild is never mistaken for a valid cache
+    if os.path.exists(key_file):
+        os.remove(key_file)
+    # Precomputed zonal means of a transcoded run are much faster to read than the 4-D field
+    build_zonal_mean(find_transcoded(rundir, filename) or source, varname, cache_file, chunk_size)
+    with open(key_file, 'w') as f:
+        json.dump(key, f)
+    print("Cached zonal mean of {} as {}".format(varname, cache_file))
+    return np.load(cache_file, mmap_mode='r' if mmap else None)
+
+
+def get_zonal_means(rundir, varnames=('ucomp', 'gwfu_cgwd'), filename='atmos_daily', **kwargs):
+    """ Returns a dict of cached zonal means for each of varnames, see get_zonal_mean """
+    return {varname: get_zonal_mean(rundir, varname, filename, **kwargs) for varname in varnames}
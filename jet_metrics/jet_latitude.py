@@ -1,33 +1,101 @@
-import os
-import glob
-
 import numpy as np
-import netCDF4 as nc
 
-from ..clim_functions import get_seasonal_inds
+from clim_functions.seasons import get_seasonal_inds
+from clim_functions.MiMA_height_indices import get_level_slice
+from clim_functions.online_stats import RunningStats
+from io_functions.stream_reduce import iter_time_chunks
+from io_functions.instrument import instrumented
+
+# Pressure bands (hPa) averaged over to get the jet. At T42 these are model levels 27-29 (194 -
+# 231 hPa) for the 200 hPa jet and 36-39 (738 - 902 hPa) for the eddy driven jet at 850 hPa.
+jet_level_bands = {'200hPa': (190., 235.),
+                   '850hPa': (735., 905.)}
+# Model level indices used when pfull is not given, as in the original T42 analysis
+jet_level_inds = {'200hPa': slice(27, 29),
+                  '850hPa': slice(36, 39)}
+
+
+def refine_peak(lat, u_jet, peak_inds):
+    """ Refines the latitude of maxima u_jet[t, peak_inds[t]] by fitting a parabola through the
+    maximum and its two neighbours (the Gaussian grid is not evenly spaced, so the general three
+    point formula is used). Peaks on the first or last latitude are left on the grid.
+    Args: lat (n_lat,), u_jet (time, n_lat), peak_inds (time,) indices of the maxima
+    Returns: jet latitudes (time,) """
+    lat = np.asarray(lat, dtype=np.float64)
+    jet_lat = lat[peak_inds]
+    interior = (peak_inds > 0) & (peak_inds < len(lat) - 1)
+    i = peak_inds[interior]
+    t = np.flatnonzero(interior)
+    x0, x1, x2 = lat[i - 1], lat[i], lat[i + 1]
+    f0, f1, f2 = u_jet[t, i - 1], u_jet[t, i], u_jet[t, i + 1]
+    numerator = (x1 - x0)**2 * (f1 - f2) - (x1 - x2)**2 * (f1 - f0)
+    denominator = (x1 - x0) * (f1 - f2) - (x1 - x2) * (f1 - f0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        vertex = x1 - 0.5 * numerator / denominator
+    # Flat tops (denominator 0) stay on the grid, the vertex always lies between the neighbours
+    valid = np.isfinite(vertex)
+    jet_lat[t[valid]] = np.clip(vertex[valid], np.minimum(x0, x2)[valid], np.maximum(x0, x2)[valid])
+    return jet_lat
 
-def jet_latitude(u, lat, eddy = False, return_SH_jet = False):
-    """ Returns jet latitude timeseries """
-    if eddy: 
-        u_jet = ucomp[:, 36:39, :, :].mean(axis=(1,3))   # extract 850 hPa level (model levels 36-39 give 738 - 902 hPa) and take zonal mean
 
+def jet_latitude_from_zonal_mean(u_jet, lat, refine=True):
+    """ Returns NH and SH jet latitudes from the zonal mean wind at the jet level, u_jet
+    (time, lat), as the latitude of the maximum wind in each hemisphere """
+    lat = np.asarray(lat[:])
+    u_jet = np.asarray(u_jet, dtype=np.float64)
+    n_SH = int(np.searchsorted(lat, 0.))
+    # Both hemispheres in one pass: masked argmax over lat < 0 and lat > 0
+    u_NH = np.where(lat > 0, u_jet, -np.inf)
+    u_SH = np.where(lat < 0, u_jet, -np.inf)
+    peak_inds = np.stack((np.argmax(u_NH, axis=1), np.argmax(u_SH, axis=1)))
+    if not refine:
+        return lat[peak_inds[0]], lat[peak_inds[1]]
+    # Refine within each hemisphere, so a neighbour across the equator is never used
+    jet_lat_NH = refine_peak(lat[n_SH:], u_jet[:, n_SH:], peak_inds[0] - n_SH)
+    jet_lat_SH = refine_peak(lat[:n_SH], u_jet[:, :n_SH], peak_inds[1])
+    return jet_lat_NH, jet_lat_SH
+
+
+@instrumented
+def jet_latitude(u, lat, eddy = False, return_SH_jet = False, pfull=None, refine=True, chunk_size=360):
+    """ Returns jet latitude timeseries, the latitude of maximum zonal mean zonal wind at 200 hPa
+    (or 850 hPa for the eddy driven jet, eddy=True) in the NH, and in the SH if return_SH_jet.
+    u is ucomp (time, pfull, lat, lon) or its zonal mean (time, pfull, lat), e.g. from
+    io_functions.zonal_cache, and can be a netCDF variable: it is read chunk_size days at a time
+    and only the jet levels are read, so the full 4-D field is never in memory. e.g.
+        jet_lat, jet_lat_SH = jet_latitude(dataset['ucomp'], lat, pfull=pfull, return_SH_jet=True)
+    With pfull the jet levels are picked by pressure (jet_level_bands), otherwise the T42 model
+    levels are used (jet_level_inds). refine=True fits a parabola through the maximum and its
+    neighbours to locate the jet between grid latitudes, refine=False gives grid latitudes. """
+    level = '850hPa' if eddy else '200hPa'
+    if pfull is None:
+        level_inds = jet_level_inds[level]
     else:
-        u_jet = ucomp[:, 27:29, :, :].mean(axis=(1,3))   # extract 200 hPa level (model levels 27-29 give 194 - 231 hPa) and take zonal mean
-    jet_lat = lat[32+np.argmax(u_jet[:, 32:], axis=1)]
+        level_inds = get_level_slice(pfull, jet_level_bands[level])
+    zonal_axes = (1, 3) if len(u.shape) == 4 else 1
+
+    n_time = u.shape[0]
+    jet_lat = np.zeros(n_time)
+    jet_lat_SH = np.zeros(n_time)
+    for t0, t1 in iter_time_chunks(n_time, chunk_size):
+        u_jet = np.asarray(u[t0:t1, level_inds]).mean(axis=zonal_axes)   # (time, lat)
+        jet_lat[t0:t1], jet_lat_SH[t0:t1] = jet_latitude_from_zonal_mean(u_jet, lat, refine=refine)
     if return_SH_jet:
-        jet_lat_SH = lat[np.argmax(u_jet[:, :32], axis=1)]
         return(jet_lat, jet_lat_SH)
     else:
         return(jet_lat)
 
-def jet_latitude_means(jet_lat, return_variance = False, return_sd = False): 
+def jet_latitude_means(jet_lat, return_variance = False, return_sd = False):
     """ Returns jet lat mean and variance over entire time series. To get seasonal means, use (e.g.)
     DJF_inds, MAM_inds, JJA_inds, SON_inds = get_seasonal_inds(len(jet_lat))
-    jet_lat_DJF = jet_latitude_means(jet_lat[DJF_inds]) """
+    jet_lat_DJF = jet_latitude_means(jet_lat[DJF_inds])
+    jet_lat can also be a RunningStats of jet latitudes accumulated over time chunks or merged
+    from several runs (see clim_functions.online_stats). """
+    if not isinstance(jet_lat, RunningStats):
+        jet_lat = RunningStats().update(jet_lat)
     if return_variance:
-        return jet_lat.mean(), jet_lat.var()
+        return jet_lat.mean, jet_lat.var
     elif return_sd:
-        return jet_lat.mean(), jet_lat.std()
+        return jet_lat.mean, jet_lat.std
     else:
-        return jet_lat.mean()
-
+        return jet_lat.mean
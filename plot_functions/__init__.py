@@ -1,4 +1,5 @@
 ## INIT FILE ##
 import os, sys; sys.path.append(os.path.dirname(os.path.realpath(__file__)))
 
-__all__ = ['make_gif',  'plot_ubar_annual',  'plot_ubar_daily', 'plot_ubar', 'plot_ubar_seasonal']
+__all__ = ['make_gif', 'make_gif_from_frames', 'plot_ubar_annual',  'plot_ubar_daily', 'plot_ubar', 'plot_ubar_seasonal',
+           'plot_ubar_daily_parallel', 'ubar_daily_frames']
@@ -1,10 +1,88 @@
+import os
 import glob
-from PIL import Image
+from PIL import Image, GifImagePlugin
+from io_functions.instrument import instrumented
 
-def make_gif(path_to_images):
-    frames = [Image.open(image) for image in sorted(glob.glob(f"{path_to_images}*.png"))]
-    frame_one = frames[0]
+
+class GifWriter:
+    """ Writes an animated GIF one frame at a time, so memory use does not grow with the number
+    of frames. Each frame gets its own local colour table. Use as
+        with GifWriter(save_as) as gif:
+            for frame in frames:
+                gif.append(frame)
+    where frames are PIL Images or matplotlib figures. """
+    def __init__(self, save_as, duration=100, loop=0):
+        self.save_as = save_as
+        self.duration = duration
+        self.loop = loop
+        self.n_frames = 0
+        self.fp = open(save_as, 'wb')
+
+    def append(self, frame):
+        if not isinstance(frame, Image.Image):
+            frame = figure_to_image(frame)
+        frame = frame.convert('RGB').convert('P', palette=Image.Palette.ADAPTIVE)
+        if self.n_frames == 0:
+            header, _ = GifImagePlugin.getheader(frame, info={'loop': self.loop,
+                                                              'duration': self.duration})
+            self.fp.write(b''.join(header))
+        for data in GifImagePlugin.getdata(frame, duration=self.duration, include_color_table=True):
+            self.fp.write(data)
+        self.n_frames += 1
+
+    def close(self):
+        """ Finishes the GIF. Raises ValueError (and removes the file) if no frames were added. """
+        if self.fp.closed:
+            return
+        if self.n_frames == 0:
+            self.fp.close()
+            os.remove(self.save_as)
+            raise ValueError("no frames to write to {}".format(self.save_as))
+        self.fp.write(b';')    # GIF trailer
+        self.fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *args):
+        if exc_type is not None and self.n_frames == 0:
+            # Do not hide the error that stopped the frames with the one about having no frames
+            self.fp.close()
+            os.remove(self.save_as)
+            return
+        self.close()
+
+
+def figure_to_image(fig):
+    """ Renders a matplotlib figure into a PIL Image straight from its canvas buffer, without
+    writing a PNG to disk """
+    fig.canvas.draw()
+    return canvas_to_image(fig)
+
+
+def canvas_to_image(fig):
+    """ Copies what is currently drawn on the figure's (Agg) canvas into a PIL Image """
+    return Image.frombuffer('RGBA', fig.canvas.get_width_height(physical=True),
+                            fig.canvas.buffer_rgba(), 'raw', 'RGBA', 0, 1).copy()
+
+
+@instrumented
+def make_gif_from_frames(frames, save_as, duration=100, loop=0):
+    """ Streams frames (an iterable or generator of PIL Images or matplotlib figures, e.g.
+    plot_ubar.ubar_daily_frames(...)) into an animated GIF at save_as """
+    with GifWriter(save_as, duration=duration, loop=loop) as gif:
+        for frame in frames:
+            gif.append(frame)
+    print("Gif saved as {} ({} frames)".format(save_as, gif.n_frames))
+
+
+@instrumented
+def make_gif(path_to_images, duration=100):
+    """ Makes an animated GIF from all PNGs matching path_to_images*.png, opening one at a time """
+    def frames():
+        for image in sorted(glob.glob(f"{path_to_images}*.png")):
+            with Image.open(image) as frame:
+                frame.load()
+                yield frame
     save_as = "{}_animation.gif".format(path_to_images)
-    frame_one.save(save_as, format="GIF", append_images=frames,
-                   save_all=True, duration=100, loop=0)
-    print("Gif saved as {}".format(save_as))
+    make_gif_from_frames(frames(), save_as, duration=duration)
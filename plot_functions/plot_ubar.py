@@ -5,16 +5,27 @@ import numpy as np
 import matplotlib.pyplot as plt
 
 from clim_functions.seasons import months, get_seasonal_inds
+from io_functions.instrument import instrumented
+from clim_functions.chunked import compute, compute_dict
+from plot_functions.raster import discrete_cmap, grid_edges
+from plot_functions.make_gif import figure_to_image, canvas_to_image
 
-def plot_ubar(lat, pfull, ubar, title='', levels = np.linspace(-40, 40, 100), color_bar = False):
+def plot_ubar(lat, pfull, ubar, title='', levels = np.linspace(-40, 40, 100), color_bar = False,
+              mode='contour'):
     """ Plots zonal mean winds on latitude-pressure contour plot. ubar must be of dimension
     len(pfull) x len(lat). e.g. ubar = np.mean(ucomp[t, :, :, :], axis=2) to take longitudinal 
     avg, at time index t.  Set up plot axis before use. Title and levels optional. Can add 
-    color_bar (if single plot)
+    color_bar (if single plot). mode='raster' draws a rasterized mesh coloured by the same
+    levels instead of contouring (see plot_functions.raster), which is much faster.
     Returns plot axis."""
     axs = plt.gca()
 
-    plt.contourf(lat[:], pfull[:], ubar, cmap = 'BrBG_r', levels = levels, extend='both')
+    if mode == 'raster':
+        lat_edges, pfull_edges = grid_edges(lat, pfull, log_y=True, y_limits=(None, 1000.))
+        cmap, norm = discrete_cmap(levels)
+        plt.pcolormesh(lat_edges, pfull_edges, ubar, cmap=cmap, norm=norm, shading='flat', rasterized=True)
+    else:
+        plt.contourf(lat[:], pfull[:], ubar, cmap = 'BrBG_r', levels = levels, extend='both')
     plt.ylabel('Pressure (hPa)')
     plt.xlabel('Latitude')
     plt.xticks(np.arange(-90., 90.1, 30.))
@@ -24,15 +35,24 @@ def plot_ubar(lat, pfull, ubar, title='', levels = np.linspace(-40, 40, 100), co
     if color_bar:
         cbar = plt.colorbar(ticks=np.arange(-20, 20.5, 20), location='bottom', label='m/s',
                         orientation='horizontal')
+        if mode == 'raster':
+            # A colorbar with a BoundaryNorm gets a minor tick at every level, slow to redraw
+            cbar.minorticks_off()
     plt.title(title)
     return axs
 
-def plot_ubar_annual(lat, pfull, ucomp, rundir=None):
-    """ Plots annual zonal mean zonal winds """
+@instrumented
+def plot_ubar_annual(lat, pfull, ucomp, rundir=None, ubar=None, mode='contour'):
+    """ Plots annual zonal mean zonal winds. If the annual zonal mean ubar (pfull x lat) has already 
+    been computed, e.g. with io_functions.stream_reduce, pass it as ubar and ucomp is not read. 
+    ucomp can be a dask array (see clim_functions.chunked). """
+    if ubar is None:
+        ubar = ucomp[:].mean(axis=(0, 3))
+    ubar = compute(ubar)
     plt.clf()
     fig, ax = plt.subplots(1, 1, figsize=(8, 8))
     plt.sca(ax)
-    plot_ubar(lat[:], pfull[:], ucomp[:].mean(axis=(0, 3)), title="ANN", color_bar=True)
+    plot_ubar(lat[:], pfull[:], ubar, title="ANN", color_bar=True, mode=mode)
     plt.subplots_adjust(bottom = 0.2)
 
     if rundir is not None:
@@ -43,10 +63,19 @@ def plot_ubar_annual(lat, pfull, ucomp, rundir=None):
     return fig, ax
         
        
-def plot_ubar_seasonal(lat, pfull, ucomp, rundir=None):
-    """ Plots 2x2 grid of zonal mean zonal winds for each season """
-    n_days = (ucomp.shape)[0] 
-    DJF_inds, MAM_inds, JJA_inds, SON_inds = get_seasonal_inds(n_days)
+@instrumented
+def plot_ubar_seasonal(lat, pfull, ucomp, rundir=None, ubar_seasonal=None, mode='contour'):
+    """ Plots 2x2 grid of zonal mean zonal winds for each season. Precomputed seasonal zonal 
+    means can be passed as ubar_seasonal, a dict with keys 'DJF', 'MAM', 'JJA', 'SON', in 
+    which case ucomp is not read. ucomp can be a dask array (see clim_functions.chunked). """
+    if ubar_seasonal is None:
+        n_days = (ucomp.shape)[0] 
+        DJF_inds, MAM_inds, JJA_inds, SON_inds = get_seasonal_inds(n_days)
+        ubar_seasonal = {'DJF': ucomp[DJF_inds].mean(axis=(0, 3)),
+                         'MAM': ucomp[MAM_inds].mean(axis=(0, 3)),
+                         'JJA': ucomp[JJA_inds].mean(axis=(0, 3)),
+                         'SON': ucomp[SON_inds].mean(axis=(0, 3))}
+    ubar_seasonal = compute_dict(ubar_seasonal)
     nrows=2
     ncols=2
     
@@ -57,16 +86,16 @@ def plot_ubar_seasonal(lat, pfull, ucomp, rundir=None):
     axs = axs.flatten()
     # DJF
     plt.sca(axs[0])
-    plot_ubar(lat[:], pfull[:], ucomp[DJF_inds].mean(axis=(0, 3)), title="DJF")
+    plot_ubar(lat[:], pfull[:], ubar_seasonal['DJF'], title="DJF", mode=mode)
     # MAM
     plt.sca(axs[1])
-    plot_ubar(lat[:], pfull[:], ucomp[MAM_inds].mean(axis=(0, 3)), title="MAM")
+    plot_ubar(lat[:], pfull[:], ubar_seasonal['MAM'], title="MAM", mode=mode)
     # JJA 
     plt.sca(axs[2])
-    plot_ubar(lat[:], pfull[:], ucomp[DJF_inds].mean(axis=(0, 3)), title="JJA")
+    plot_ubar(lat[:], pfull[:], ubar_seasonal['JJA'], title="JJA", mode=mode)
     #SON
     plt.sca(axs[3])
-    plot_ubar(lat[:], pfull[:], ucomp[DJF_inds].mean(axis=(0, 3)), title="SON")
+    plot_ubar(lat[:], pfull[:], ubar_seasonal['SON'], title="SON", mode=mode)
 
     cbar_ax = fig.add_axes([0.1, 0.08, 0.8, 0.05])
     cbar = plt.colorbar(ticks=np.arange(-20, 20.5, 20), label='m/s',cax=cbar_ax,
@@ -83,18 +112,24 @@ def plot_ubar_seasonal(lat, pfull, ucomp, rundir=None):
 
         
 
+def get_daily_title(t):
+    """ Returns 'day month year' title for time index t, assuming 360 day years starting in Jan """
+    day = t%30 + 1
+    year = int(t/360) + 1
+    month = months[int(t/30)%12]
+    return '{} {} {}'.format(day, month, year)
+
+
+@instrumented
 def plot_ubar_daily(lat, pfull, ucomp, rundir, dday=1):
     """ Saves daily (or dday number of days) zonal mean zonal wind plots. Can be combined 
-    with     gif_maker(...) to create animations. """
+    with     gif_maker(...) to create animations. For long runs see plot_ubar_daily_parallel. """
     ndays = ucomp.shape[0]
     for t in range(0, ndays, dday):
         plt.clf()
         fig, ax = plt.subplots(1, 1, figsize=(8, 8))
         plt.sca(ax)
-        day = t%30 + 1
-        year = int(t/360) + 1
-        month = months[int(t/30)%12]
-        title = '{} {} {}'.format(day, month, year)
+        title = get_daily_title(t)
         plot_ubar(lat[:], pfull[:], ucomp[t, :, :, :].mean(axis=2), title=title, 
                   color_bar=True)
         
@@ -104,4 +139,118 @@ def plot_ubar_daily(lat, pfull, ucomp, rundir, dday=1):
         plt.close()
 
 
-        
\ No newline at end of file
+def new_daily_frame(lat, pfull, levels = np.linspace(-40, 40, 100), mode='contour'):
+    """ Creates one figure to be reused for a sequence of daily frames, see update_daily_frame """
+    fig, ax = plt.subplots(1, 1, figsize=(8, 8))
+    return {'fig': fig, 'ax': ax, 'lat': lat, 'pfull': pfull, 'levels': levels, 'contours': None,
+            'mode': mode}
+
+
+def update_daily_frame(frame, ubar, t):
+    """ Draws ubar at time index t into a figure made by new_daily_frame, replacing only the 
+    contours and title of the previous frame (in raster mode only the mesh values are replaced).
+    Returns the figure. """
+    fig, ax = frame['fig'], frame['ax']
+    if frame['contours'] is None:
+        # First frame sets up axes, scales and colorbar
+        plt.sca(ax)
+        plot_ubar(frame['lat'], frame['pfull'], ubar, title=get_daily_title(t), 
+                  levels=frame['levels'], color_bar=True, mode=frame['mode'])
+        frame['contours'] = plt.gci()
+    elif frame['mode'] == 'raster':
+        frame['contours'].set_array(np.asarray(ubar).ravel())
+        ax.set_title(get_daily_title(t))
+    else:
+        frame['contours'].remove()
+        frame['contours'] = ax.contourf(frame['lat'], frame['pfull'], ubar, cmap = 'BrBG_r', 
+                                        levels = frame['levels'], extend='both')
+        ax.set_title(get_daily_title(t))
+    return fig
+
+
+def render_daily_frame(frame):
+    """ Returns the figure of a frame from new_daily_frame as a PIL Image. In raster mode
+    everything except the mesh and title is drawn once and kept as a background, so later frames
+    only redraw the mesh values and title (blitting). """
+    fig, ax = frame['fig'], frame['ax']
+    if frame['mode'] != 'raster':
+        return figure_to_image(fig)
+    # The spines overlap the mesh, so are redrawn on top of it each frame
+    changing = [frame['contours']] + list(ax.spines.values())
+    if frame.get('background') is None:
+        title = ax.get_title()
+        for artist in changing:
+            artist.set_visible(False)
+        ax.set_title('')
+        fig.canvas.draw()
+        frame['background'] = fig.canvas.copy_from_bbox(fig.bbox)
+        for artist in changing:
+            artist.set_visible(True)
+        ax.set_title(title)
+    fig.canvas.restore_region(frame['background'])
+    for artist in changing + [ax.title]:
+        ax.draw_artist(artist)
+    return canvas_to_image(fig)
+
+
+def ubar_daily_frames(lat, pfull, ubar, dday=1, levels = np.linspace(-40, 40, 100), mode='contour'):
+    """ Generator of daily (or every dday days) figures from precomputed zonal means ubar 
+    (time x len(pfull) x len(lat)). The same figure is updated and yielded for each frame, so it
+    can be streamed straight into make_gif.make_gif_from_frames without saving PNGs, e.g.
+    make_gif_from_frames(ubar_daily_frames(lat, pfull, ubar, dday=15), rundir+'PLOTS/ubar.gif')
+    mode='raster' is much faster for many frames, see plot_ubar. It yields PIL Images rendered
+    with render_daily_frame instead of the figure. """
+    frame = new_daily_frame(np.asarray(lat[:]), np.asarray(pfull[:]), levels, mode)
+    for t in range(0, ubar.shape[0], dday):
+        fig = update_daily_frame(frame, np.asarray(ubar[t]), t)
+        yield render_daily_frame(frame) if mode == 'raster' else fig
+    plt.close(frame['fig'])
+
+
+# Figure kept by each worker of plot_ubar_daily_parallel, reused for every frame it renders
+_daily_frame = {}
+
+def _init_daily_worker(lat, pfull, levels, mode='contour'):
+    """ Sets up the single figure used by this worker process """
+    plt.switch_backend('Agg')
+    _daily_frame.update(new_daily_frame(lat, pfull, levels, mode))
+
+
+def _render_daily_frames(task):
+    """ Renders a block of frames (ubar_block[i] at time index frame_inds[i]) in this worker's 
+    figure. Returns saved paths. """
+    ubar_block, frame_inds, rundir = task
+    saved = []
+    for ubar, t in zip(ubar_block, frame_inds):
+        fig = update_daily_frame(_daily_frame, ubar, t)
+        save_as = rundir+'PLOTS/ubar_t={:04d}.png'.format(t)
+        if _daily_frame['mode'] == 'raster':
+            render_daily_frame(_daily_frame).save(save_as)
+        else:
+            fig.savefig(save_as)
+        saved.append(save_as)
+    return saved
+
+
+@instrumented
+def plot_ubar_daily_parallel(lat, pfull, ubar, rundir, dday=1, n_workers=None, 
+                             frames_per_task=30, levels = np.linspace(-40, 40, 100), mode='contour'):
+    """ Parallel version of plot_ubar_daily. Takes precomputed zonal means ubar of dimension
+    time x len(pfull) x len(lat), e.g. ubar = get_zonal_mean(rundir, 'ucomp') from 
+    io_functions.zonal_cache, and spreads blocks of frames_per_task frames over a pool of 
+    n_workers processes (default all cores). Each worker keeps one figure and only redraws the
+    contours, so output matches plot_ubar_daily: rundir/PLOTS/ubar_t=XXXX.png. mode='raster'
+    redraws only the mesh values, see plot_ubar.
+    Returns sorted list of saved paths. """
+    from multiprocessing import Pool
+
+    frame_inds = np.arange(0, ubar.shape[0], dday)
+    tasks = ((np.asarray(ubar[frame_inds[i:i+frames_per_task]]), frame_inds[i:i+frames_per_task], rundir)
+             for i in range(0, len(frame_inds), frames_per_task))
+    saved = []
+    with Pool(n_workers, initializer=_init_daily_worker, 
+              initargs=(np.asarray(lat[:]), np.asarray(pfull[:]), levels, mode)) as pool:
+        for saved_block in pool.imap_unordered(_render_daily_frames, tasks):
+            saved.extend(saved_block)
+            print("Saved {} of {} frames".format(len(saved), len(frame_inds)))
+    return sorted(saved)
@@ -0,0 +1,76 @@
+"""Helpers for the raster rendering mode of plot_map and plot_ubar (mode='raster'). Fields are
+drawn as a rasterized pcolormesh with a discrete colormap on the same levels as the contourf
+plots, so colours match, but nothing is contoured. Cell edges, colormaps and projected coastline
+segments are cached per grid/levels, so redrawing a frame is little more than uploading the
+array and encoding the PNG. """
+from functools import lru_cache
+
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.colors import BoundaryNorm, Normalize
+
+
+@lru_cache(maxsize=32)
+def _discrete_cmap(levels, cmap_name, extend):
+    cmap = plt.get_cmap(cmap_name)
+    if levels is None:
+        return cmap, None
+    return cmap, BoundaryNorm(np.array(levels), ncolors=cmap.N, extend=extend)
+
+
+def discrete_cmap(levels, cmap='BrBG_r', extend='both'):
+    """ Returns (cmap, norm) mapping values to the colours contourf uses for the same levels and
+    extend. norm is None if levels is None (plain linear scaling). """
+    levels = None if levels is None else tuple(np.asarray(levels, dtype=float).tolist())
+    return _discrete_cmap(levels, cmap, extend)
+
+
+def cell_edges(centers, log=False, lower=None, upper=None):
+    """ Returns len(centers)+1 cell edges half way between centers (geometric mean if log), with
+    the end cells as wide as their neighbours, clipped to [lower, upper] """
+    centers = np.asarray(centers, dtype=float)
+    x = np.log(centers) if log else centers
+    if len(x) == 1:
+        edges = np.array([x[0] - 0.5, x[0] + 0.5])
+    else:
+        mid = 0.5 * (x[1:] + x[:-1])
+        edges = np.concatenate(([2 * x[0] - mid[0]], mid, [2 * x[-1] - mid[-1]]))
+    edges = np.exp(edges) if log else edges
+    if lower is not None or upper is not None:
+        edges = np.clip(edges, lower, upper)
+    return edges
+
+
+_edges_cache = {}
+
+def grid_edges(x, y, log_y=False, y_limits=(None, None)):
+    """ Cached cell edges for a (x, y) grid, e.g. (lon, lat) for maps or (lat, pfull) for
+    zonal means, keyed on the coordinate values """
+    x = np.asarray(x[:], dtype=float)
+    y = np.asarray(y[:], dtype=float)
+    key = (x.tobytes(), y.tobytes(), log_y, y_limits)
+    if key not in _edges_cache:
+        _edges_cache[key] = (cell_edges(x), cell_edges(y, log=log_y, lower=y_limits[0], upper=y_limits[1]))
+    return _edges_cache[key]
+
+
+@lru_cache(maxsize=4)
+def coastline_segments(resolution='110m'):
+    """ Returns list of (n, 2) lon/lat arrays of Natural Earth coastlines, read once """
+    import cartopy.feature as cfeature
+    segments = []
+    feature = cfeature.NaturalEarthFeature('physical', 'coastline', resolution)
+    for geometry in feature.geometries():
+        lines = geometry.geoms if hasattr(geometry, 'geoms') else [geometry]
+        segments.extend(np.asarray(line.coords) for line in lines)
+    return segments
+
+
+def add_coastlines(ax, resolution='110m', color='k', linewidth=0.75):
+    """ Adds the cached coastlines to a GeoAxes as one line collection """
+    import cartopy.crs as ccrs
+    from matplotlib.collections import LineCollection
+    lines = LineCollection(coastline_segments(resolution), colors=color, linewidths=linewidth,
+                           transform=ccrs.PlateCarree())
+    ax.add_collection(lines)
+    return lines
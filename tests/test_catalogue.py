@@ -0,0 +1,48 @@
+"""Regression tests for the incremental SSW catalogue. Run from the parent directory with
+    python -m pytest tests """
+import numpy as np
+
+from clim_functions.datetime360 import day_to_date, date_to_day
+from SSW_metrics.get_SSWs import find_SSW_events, event_dtype, winter_dtype
+from SSW_metrics.catalogue import update_catalogue
+
+
+def _run(n_days, seed=0):
+    """ Random u10at60 from 1 Jul 2000 and its dates """
+    rng = np.random.default_rng(seed)
+    u10at60 = 30. + 20. * rng.standard_normal(n_days)
+    start = date_to_day([2000, 7, 1])
+    return u10at60, day_to_date(np.arange(start, start + n_days))
+
+
+def _same(a, b):
+    return all(x.dtype == y.dtype and x.tobytes() == y.tobytes() for x, y in zip(a, b))
+
+
+def test_no_complete_winter():
+    u10at60, dates = _run(200)
+    ssws, spvs, winters = find_SSW_events(u10at60, dates)
+    assert ssws.dtype == event_dtype and spvs.dtype == event_dtype and winters.dtype == winter_dtype
+    assert len(ssws) == len(spvs) == len(winters) == 0
+
+
+def test_extend_by_less_than_a_winter(tmp_path):
+    u10at60, dates = _run(3600)
+    update_catalogue(str(tmp_path), u10at60[:3450], dates[:3450])
+    # 100 more days, still inside the same winter
+    result = update_catalogue(str(tmp_path), u10at60[:3550], dates[:3550])
+    assert _same(result, find_SSW_events(u10at60[:3550], dates[:3550]))
+    # Completing the winter then recomputes it
+    result = update_catalogue(str(tmp_path), u10at60, dates)
+    assert _same(result, find_SSW_events(u10at60, dates))
+
+
+def test_random_extensions(tmp_path):
+    rng = np.random.default_rng(1)
+    for i in range(10):
+        u10at60, dates = _run(5400, seed=i)
+        rundir = str(tmp_path / str(i))
+        ends = np.sort(rng.integers(1, 5400, 7))
+        for n_days in list(ends) + [5400]:
+            result = update_catalogue(rundir, u10at60[:n_days], dates[:n_days])
+            assert _same(result, find_SSW_events(u10at60[:n_days], dates[:n_days]))
@@ -0,0 +1,100 @@
+"""Tests of the netCDF read planner. Run from the parent directory with
+    python -m pytest tests """
+import numpy as np
+import netCDF4 as nc
+import pytest
+
+from io_functions.read_planner import ReadPlanner, read_hyperslabs
+
+shape = (60, 10, 16, 8)    # (time, pfull, lat, lon)
+# One day per chunk as MiMA writes, time series chunks as io_functions.transcode writes, and contiguous
+layouts = {'daily': (1, 10, 16, 8), 'time_series': (30, 1, 4, 8), 'contiguous': None}
+requests = {'u10': (slice(None), 3),
+            'u_eq': (slice(None), slice(None), slice(6, 10)),
+            'u_60N': (slice(10, 50, 2), [3, 5, 6], slice(13, 15)),
+            'day': (-1,),
+            'points': ([0, 7, 3], 2, [15, 0], slice(1, 8, 3))}
+
+
+@pytest.fixture(scope='module')
+def dataset(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('planner') / 'atmos_daily.nc')
+    values = np.random.default_rng(0).standard_normal(shape).astype(np.float32)
+    with nc.Dataset(path, 'w') as dataset:
+        for name, size in zip(['time', 'pfull', 'lat', 'lon'], shape):
+            dataset.createDimension(name, size)
+        for layout, chunks in layouts.items():
+            variable = dataset.createVariable(layout, 'f4', ('time', 'pfull', 'lat', 'lon'),
+                                              contiguous=chunks is None, chunksizes=chunks)
+            variable[:] = values
+    dataset = nc.Dataset(path, 'r')
+    yield dataset
+    dataset.close()
+
+
+@pytest.mark.parametrize('layout', sorted(layouts))
+@pytest.mark.parametrize('max_box_bytes', [None, 2**12, 1])
+def test_reads_equal_slicing(dataset, layout, max_box_bytes):
+    variable = dataset[layout]
+    data = read_hyperslabs(variable, requests, max_box_bytes=max_box_bytes)
+    assert list(data) == list(requests)
+    for key, index in requests.items():
+        expected = variable[index]
+        assert data[key].shape == expected.shape
+        assert np.array_equal(data[key], expected)
+    # Each result is its own array, not a view of a merged read
+    arrays = [np.ma.getdata(array) for array in data.values()]
+    for i in range(len(arrays)):
+        assert arrays[i].base is None or arrays[i].base.size == arrays[i].size
+        for j in range(i + 1, len(arrays)):
+            assert not np.shares_memory(arrays[i], arrays[j])
+
+
+def _n_boxes(variable, index_a, index_b, max_box_bytes=None):
+    planner = ReadPlanner(variable, max_box_bytes)
+    planner.add('a', index_a)
+    planner.add('b', index_b)
+    boxes, owner = planner.plan()
+    return len(boxes)
+
+
+def test_merge_decisions(dataset):
+    # Two levels over all times touch every daily chunk, so are read together
+    assert _n_boxes(dataset['daily'], (slice(None), 2), (slice(None), 7)) == 1
+    # but are separate chunks in the time series and contiguous layouts
+    assert _n_boxes(dataset['time_series'], (slice(None), 2), (slice(None), 7)) == 2
+    assert _n_boxes(dataset['contiguous'], (slice(None), 2), (slice(None), 7)) == 2
+    # Neighbouring latitudes in the same time series chunk are read together
+    assert _n_boxes(dataset['time_series'], (slice(None), 2, 4), (slice(None), 2, 6)) == 1
+
+
+class RecordingVariable:
+    """ Wraps a netCDF variable, recording the shape of each read """
+    def __init__(self, variable):
+        self.variable = variable
+        self.shape = variable.shape
+        self.dtype = variable.dtype
+        self.reads = []
+
+    def chunking(self):
+        return self.variable.chunking()
+
+    def __getitem__(self, key):
+        data = self.variable[key]
+        self.reads.append(data.shape)
+        return data
+
+
+def test_size_cap(dataset):
+    variable = RecordingVariable(dataset['daily'])
+    max_box_bytes = 7 * shape[1] * shape[2] * shape[3] * 4    # 7 days
+    data = read_hyperslabs(variable, requests, max_box_bytes=max_box_bytes)
+    # u10 and u_eq are merged into a box of the whole variable, read a week at a time
+    assert max(np.prod(read) * 4 for read in variable.reads) <= max_box_bytes
+    assert sum(read[0] for read in variable.reads) < 2 * shape[0]
+    for key, index in requests.items():
+        assert np.array_equal(data[key], dataset['daily'][index])
+    # At least one time chunk is read at a time
+    variable = RecordingVariable(dataset['time_series'])
+    read_hyperslabs(variable, {'u10': (slice(5, 60), 3)}, max_box_bytes=1)
+    assert variable.reads == [(25, 1, 16, 8), (30, 1, 16, 8)]